@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+MAX_ACTIVE_TURNS = int(os.environ.get("JARVIS_MAX_ACTIVE_TURNS", "32"))
+MAX_QUEUED_TURNS = int(os.environ.get("JARVIS_MAX_QUEUED_TURNS", "64"))
+TURN_QUEUE_TIMEOUT = float(os.environ.get("JARVIS_TURN_QUEUE_TIMEOUT", "5"))
+MAX_USER_PENDING = int(os.environ.get("JARVIS_MAX_USER_PENDING", "2"))
+USER_TURN_TIMEOUT = float(os.environ.get("JARVIS_USER_TURN_TIMEOUT", "30"))
+
+class TurnRejected(Exception):
+    """Turno recusado: 429 (o utilizador já tem turnos pendentes) ou 503 (servidor sobrecarregado)."""
+
+    def __init__(self, status: int, message: str, retry_after: int):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+class TurnTicket:
+    """Vagas ocupadas por um turno admitido; release() pode ser chamado mais de uma vez."""
+
+    def __init__(self, controller: "AdmissionController", user_id):
+        self.controller = controller
+        self.user_id = user_id
+        self.holds_user = False
+        self.holds_slot = False
+
+    def release(self):
+        self.controller.release(self)
+
+class AdmissionController:
+    """Serializa os turnos de cada utilizador e limita os turnos em curso no processo.
+
+    Cada utilizador tem um lock: os seus turnos correm um de cada vez, pela
+    ordem de chegada, e no máximo `max_user_pending` podem estar pendentes
+    (429 a partir daí). Globalmente, `max_active` turnos correm ao mesmo
+    tempo e até `max_queue` esperam por vaga; com a fila cheia, ou esgotado o
+    tempo de espera, o pedido é recusado de imediato com 503.
+    """
+
+    def __init__(self, max_active: int = MAX_ACTIVE_TURNS, max_queue: int = MAX_QUEUED_TURNS, queue_timeout: float = TURN_QUEUE_TIMEOUT,
+                 max_user_pending: int = MAX_USER_PENDING, user_timeout: float = USER_TURN_TIMEOUT):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_user_pending = max_user_pending
+        self.user_timeout = user_timeout
+        self._slots = threading.BoundedSemaphore(max_active)
+        self._lock = threading.Lock()
+        self._users: Dict = {}  # user_id -> [lock, pendentes]
+        self._queued = 0
+        self._stats = {"admitted": 0, "rejected_user_busy": 0, "rejected_user_timeout": 0, "rejected_queue_full": 0,
+                       "rejected_queue_timeout": 0, "active": 0, "peak_queue_depth": 0}
+
+    # --- Etapas da admissão ---
+
+    def _enter_user(self, user_id) -> threading.Lock:
+        with self._lock:
+            entry = self._users.setdefault(user_id, [threading.Lock(), 0])
+            if entry[1] >= self.max_user_pending:
+                self._stats["rejected_user_busy"] += 1
+                raise TurnRejected(429, "Ainda estou a responder à sua pergunta anterior. Aguarde um instante.", 2)
+            entry[1] += 1
+            return entry[0]
+
+    def _leave_user(self, user_id):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._users[user_id]
+
+    def _user_timeout(self, ticket: TurnTicket):
+        self._leave_user(ticket.user_id)
+        with self._lock:
+            self._stats["rejected_user_timeout"] += 1
+        raise TurnRejected(429, "Ainda estou a responder à sua pergunta anterior. Aguarde um instante.", 2)
+
+    def _enter_queue(self):
+        with self._lock:
+            if self._queued >= self.max_queue:
+                self._stats["rejected_queue_full"] += 1
+                raise TurnRejected(503, "O Jarvis está sobrecarregado neste momento. Tente novamente em instantes.", self._retry_after())
+            self._queued += 1
+            self._stats["peak_queue_depth"] = max(self._stats["peak_queue_depth"], self._queued)
+
+    def _leave_queue(self, admitted: bool):
+        with self._lock:
+            self._queued -= 1
+            if admitted:
+                self._stats["admitted"] += 1
+                self._stats["active"] += 1
+            else:
+                self._stats["rejected_queue_timeout"] += 1
+
+    def _retry_after(self) -> int:
+        return max(1, round(self.queue_timeout))
+
+    def _rejected_by_timeout(self, ticket: TurnTicket):
+        self.release(ticket)
+        raise TurnRejected(503, "O Jarvis está sobrecarregado neste momento. Tente novamente em instantes.", self._retry_after())
+
+    # --- API síncrona ---
+
+    def acquire(self, user_id) -> TurnTicket:
+        """Admite um turno (bloqueia a thread enquanto espera) ou levanta TurnRejected."""
+        ticket = TurnTicket(self, user_id)
+        user_lock = self._enter_user(user_id)
+        if not user_lock.acquire(timeout=self.user_timeout):
+            self._user_timeout(ticket)
+        ticket.holds_user = True
+        try:
+            self._enter_queue()
+        except TurnRejected:
+            self.release(ticket)
+            raise
+        admitted = self._slots.acquire(timeout=self.queue_timeout)
+        self._leave_queue(admitted)
+        if not admitted:
+            self._rejected_by_timeout(ticket)
+        ticket.holds_slot = True
+        return ticket
+
+    @contextmanager
+    def turn(self, user_id):
+        ticket = self.acquire(user_id)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    # --- API assíncrona (modo ASGI) ---
+
+    @staticmethod
+    async def _poll(primitive, timeout: float) -> bool:
+        """Espera por um lock/semáforo de threading sem bloquear o event loop."""
+        deadline = time.monotonic() + timeout
+        delay = 0.005
+        while not primitive.acquire(blocking=False):
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        return True
+
+    async def aacquire(self, user_id) -> TurnTicket:
+        ticket = TurnTicket(self, user_id)
+        user_lock = self._enter_user(user_id)
+        if not await self._poll(user_lock, self.user_timeout):
+            self._user_timeout(ticket)
+        ticket.holds_user = True
+        try:
+            self._enter_queue()
+        except TurnRejected:
+            self.release(ticket)
+            raise
+        admitted = await self._poll(self._slots, self.queue_timeout)
+        self._leave_queue(admitted)
+        if not admitted:
+            self._rejected_by_timeout(ticket)
+        ticket.holds_slot = True
+        return ticket
+
+    # --- Libertação ---
+
+    def release(self, ticket: TurnTicket):
+        with self._lock:
+            holds_slot, holds_user = ticket.holds_slot, ticket.holds_user
+            ticket.holds_slot = ticket.holds_user = False
+            if holds_slot:
+                self._stats["active"] -= 1
+            entry = self._users.get(ticket.user_id) if holds_user else None
+        if holds_slot:
+            self._slots.release()
+        if holds_user:
+            if entry is not None:
+                entry[0].release()
+            self._leave_user(ticket.user_id)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["queue_depth"] = self._queued
+            stats["users_waiting"] = sum(max(pending - 1, 0) for _, pending in self._users.values())
+        stats["rejected"] = sum(v for k, v in stats.items() if k.startswith("rejected_"))
+        stats.update(max_active=self.max_active, max_queue=self.max_queue, queue_timeout=self.queue_timeout, max_user_pending=self.max_user_pending)
+        return stats
+
+
+admission = AdmissionController()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from text_utils import normalize_words
+from ttl_cache import TTLCache
+
+ANSWER_CACHE_SIZE = int(os.environ.get("JARVIS_ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL = float(os.environ.get("JARVIS_ANSWER_CACHE_TTL", "600"))
+
+# Ferramentas cujas respostas dependem só dos argumentos e dos dados de origem.
+# Buscas que devolvem listas para o utilizador escolher não entram no cache.
+CACHEABLE_TOOLS = {
+    "search_clients_by_text",
+    "find_client_by_cnpj",
+    "list_client_responsibles",
+    "get_client_group",
+    "get_client_contacts",
+    "get_client_address",
+    "find_ramal_by_name",
+    "format_ramais_list",
+    "get_contec_history",
+}
+
+def make_key(question: str, entity=None) -> Optional[Tuple[str, Optional[str]]]:
+    """Chave (pergunta normalizada, entidade resolvida); None se a pergunta for vazia."""
+    text = normalize_words(question)
+    if not text:
+        return None
+    return text, None if entity is None else str(entity)
+
+class AnswerCache:
+    """Cache de respostas finais, partilhado por todos os utilizadores.
+
+    Cada entrada guarda as versões de que dependia: a versão da base de
+    conhecimento e a impressão digital da ficha de cada cliente consultado.
+    Na leitura, se alguma delas mudou, a entrada é descartada.
+    """
+
+    def __init__(self, maxsize: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._stats = {"stored": 0, "stale_knowledge": 0, "stale_client": 0, "skipped": 0}
+
+    def get(self, key, knowledge_version: str, record_version: Callable[[int], Optional[str]]) -> Optional[str]:
+        if key is None:
+            return None
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        reason = None
+        if entry["knowledge_version"] != knowledge_version:
+            reason = "stale_knowledge"
+        elif any(record_version(client_id) != version for client_id, version in entry["clients"].items()):
+            reason = "stale_client"
+        if reason:
+            self._cache.invalidate(key)
+            with self._lock:
+                self._stats[reason] += 1
+            return None
+        return entry["answer"]
+
+    def put(self, key, answer: str, knowledge_version: str, client_versions: Dict[int, Optional[str]]) -> bool:
+        if key is None or not answer or None in client_versions.values():
+            with self._lock:
+                self._stats["skipped"] += 1
+            return False
+        self._cache.set(key, {"answer": answer, "knowledge_version": knowledge_version, "clients": dict(client_versions)})
+        with self._lock:
+            self._stats["stored"] += 1
+        return True
+
+    def is_cacheable(self, tools: Iterable[str]) -> bool:
+        tools = list(tools)
+        return bool(tools) and all(tool in CACHEABLE_TOOLS for tool in tools)
+
+    def invalidate(self):
+        self._cache.invalidate()
+
+    def stats(self) -> Dict:
+        stats = self._cache.stats()
+        with self._lock:
+            stats.update(self._stats)
+        # Entradas encontradas mas desatualizadas contam como falhas.
+        stale = stats["stale_knowledge"] + stats["stale_client"]
+        stats["hits"] -= stale
+        stats["misses"] += stale
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        return stats
+
+
+answer_cache = AnswerCache()
@@ -1,24 +1,57 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, Response, stream_with_context, g
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 import os
-import sqlite3
 import bcrypt
 from dotenv import load_dotenv
 import json
 import datetime
+import threading
+import time
 
 # Importa a classe correta do cérebro
-from jarvis_brain import JarvisBrain
+from jarvis_brain import JarvisBrain, gclick_stats, model_stats, warm_up
+from knowledge_store import knowledge_store
+from brain_pool import BrainPool
+from history_manager import history_manager
+from persistence import writer
+from answer_cache import answer_cache
+from intent_router import intent_router
+from llm_gate import llm_gate, LLMBusyError
+from admission import admission, TurnRejected
+from metrics import metrics, server_timing, PHASE_SECONDS, ROUTE_SECONDS
+from tracing import traces, ORDERS as TRACE_ORDERS
+from feedback_embeddings import correction_index
+import db
 
 # --- Configurações Iniciais ---
 load_dotenv()
 app = Flask(__name__)
 # ADICIONE ESTA LINHA para corrigir a codificação de caracteres
 app.config['JSON_AS_ASCII'] = False
-app.secret_key = os.urandom(24)
+# Com vários workers a chave tem de ser a mesma em todos, senão a sessão de login só vale num processo.
+app.secret_key = os.environ.get("FLASK_SECRET_KEY") or os.urandom(24)
 
 # --- Gestão de Sessões Cerebrais ---
-user_brains = {}
+user_brains = BrainPool(
+    JarvisBrain,
+    max_size=int(os.environ.get("JARVIS_MAX_BRAINS", "200")),
+    idle_ttl=float(os.environ.get("JARVIS_BRAIN_IDLE_TTL", "1800")),
+)
+# O SDK do Gemini e o G-Click só são carregados no primeiro pedido de chat; com
+# JARVIS_PREWARM=1 esse custo é pago numa thread logo após o arranque.
+if os.environ.get("JARVIS_PREWARM") == "1":
+    threading.Thread(target=warm_up, name="jarvis-prewarm", daemon=True).start()
+
+# --- Métricas por rota ---
+@app.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def _observe_route(response):
+    if request.url_rule is not None and request.endpoint != 'static' and 'request_started' in g:
+        ROUTE_SECONDS.observe(time.perf_counter() - g.request_started, route=request.url_rule.rule, method=request.method)
+    return response
 
 # --- Configuração do Login ---
 login_manager = LoginManager()
@@ -34,34 +67,26 @@ class User(UserMixin):
 
 @login_manager.user_loader
 def load_user(user_id):
-    conn = get_db_connection()
-    user_db = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
-    conn.close()
+    user_db = db.get_user(user_id)
     if user_db:
         return User(id=user_db['id'], username=user_db['username'], role=user_db['role'])
     return None
 
-def get_db_connection():
-    conn = sqlite3.connect('jarvis.db')
-    conn.row_factory = sqlite3.Row
-    return conn
-
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
         
-        conn = get_db_connection()
-        user_db = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
-        conn.close()
+        with db.connection() as conn:
+            user_db = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
         
         if user_db and bcrypt.checkpw(password.encode('utf-8'), user_db['password']):
             user = User(id=user_db['id'], username=user_db['username'], role=user_db['role'])
             login_user(user)
             
             # Instancia a classe correta
-            user_brains[current_user.id] = JarvisBrain(current_user.id)
+            user_brains.create(current_user.id)
             
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                 return jsonify({'success': True, 'redirect_url': url_for('index')})
@@ -79,8 +104,7 @@ def login():
 @app.route('/logout')
 @login_required
 def logout():
-    if current_user.id in user_brains:
-        del user_brains[current_user.id]
+    user_brains.discard(current_user.id)
     logout_user()
     return redirect(url_for('login'))
 
@@ -90,34 +114,106 @@ def index():
     is_admin = current_user.role == 'admin'
     return render_template('index.html', username=current_user.username, is_admin=is_admin)
 
+def _rejected(e):
+    return jsonify({"text": e.message}), e.status, {"Retry-After": str(e.retry_after)}
+
 @app.route("/ask", methods=["POST"])
 @login_required
 def ask():
     user_message = request.json.get("message")
-    
-    brain = user_brains.get(current_user.id)
-    if not brain:
-        # Instancia a classe correta
-        brain = JarvisBrain(current_user.id)
-        user_brains[current_user.id] = brain
-    
+    if not isinstance(user_message, str) or not user_message.strip():
+        return jsonify({"text": "A mensagem não pode ser vazia."}), 400
+
+    # Um turno de cada vez por utilizador; com o servidor cheio, recusa logo em vez de acumular pedidos.
+    try:
+        ticket = admission.acquire(current_user.id)
+    except TurnRejected as e:
+        return _rejected(e)
+
     try:
-        response_text = brain.get_response(user_message)
+        with metrics.request_breakdown() as breakdown, traces.turn(current_user.id, user_message) as trace:
+            with PHASE_SECONDS.time(phase="brain_load"):
+                brain = user_brains.get(current_user.id)
+            trace["session_id"] = brain.session_id
+            started = time.perf_counter()
+            response_text = brain.get_response(user_message)
+            traces.finish(trace, response_text)
+            writer.record_turn(current_user.id, brain.session_id, user_message, response_text, brain.last_turn_tools, (time.perf_counter() - started) * 1000)
+            with PHASE_SECONDS.time(phase="brain_save"):
+                user_brains.save(current_user.id, brain)
         response_data = {
             'text': response_text,
             'timestamp': datetime.datetime.now().strftime("%H:%M")
         }
-        return jsonify(response_data)
+        # Detalhe do tempo gasto em cada fase, visível no separador Rede do browser.
+        return jsonify(response_data), 200, {"Server-Timing": server_timing(breakdown)}
+    except LLMBusyError as e:
+        return jsonify({"text": "O Jarvis está com muitas perguntas neste momento. Tente novamente em instantes."}), 503, {"Retry-After": str(e.retry_after)}
     except Exception as e:
         print(f"Erro no processamento: {e}")
         return jsonify({"text": "Desculpe, ocorreu um erro interno. Tente novamente."}), 500
+    finally:
+        ticket.release()
+
+@app.route("/ask_stream", methods=["POST"])
+@login_required
+def ask_stream():
+    user_message = request.json.get("message")
+    if not isinstance(user_message, str) or not user_message.strip():
+        return jsonify({"text": "A mensagem não pode ser vazia."}), 400
+
+    try:
+        ticket = admission.acquire(current_user.id)
+    except TurnRejected as e:
+        return _rejected(e)
+
+    try:
+        brain = user_brains.get(current_user.id)
+    except Exception:
+        ticket.release()
+        raise
+    user_id = current_user.id
+
+    def generate():
+        # Server-Sent Events: "progress" para ferramentas, "message" (padrão) para texto.
+        turn = brain.stream_response(user_message)
+        saved = False
+        try:
+            with traces.turn(user_id, user_message) as trace:
+                trace["session_id"] = brain.session_id
+                started = time.perf_counter()
+                for event, data in turn:
+                    if event in ("done", "error"):
+                        traces.finish(trace, data, error=brain.last_turn_error and type(brain.last_turn_error).__name__)
+                        writer.record_turn(user_id, brain.session_id, user_message, data, brain.last_turn_tools, (time.perf_counter() - started) * 1000)
+                        user_brains.save(user_id, brain)
+                        saved = True
+                    payload = json.dumps(data, ensure_ascii=False)
+                    if event == "text":
+                        yield f"data: {payload}\n\n"
+                    else:
+                        yield f"event: {event}\ndata: {payload}\n\n"
+        finally:
+            if not saved:
+                # Cliente desligou-se a meio: fechar o turno desfá-lo no histórico.
+                turn.close()
+                user_brains.save(user_id, brain)
+            ticket.release()
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    # Se o cliente desistir antes de o gerador arrancar, o finally acima não corre.
+    response.call_on_close(ticket.release)
+    return response
 
 @app.route("/get_shortcuts", methods=["GET"])
 @login_required
 def get_shortcuts():
-    conn = get_db_connection()
-    shortcuts_db = conn.execute('SELECT id, text FROM shortcuts WHERE user_id = ? ORDER BY id DESC', (current_user.id,)).fetchall()
-    conn.close()
+    with db.connection() as conn:
+        shortcuts_db = conn.execute('SELECT id, text FROM shortcuts WHERE user_id = ? ORDER BY id DESC', (current_user.id,)).fetchall()
     shortcuts = [{"id": row["id"], "text": row["text"]} for row in shortcuts_db]
     return jsonify({"shortcuts": shortcuts})
 
@@ -127,12 +223,11 @@ def add_shortcut():
     text = request.json.get("text")
     if not text:
         return jsonify({"success": False, "error": "Texto do atalho não pode ser vazio."}), 400
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO shortcuts (user_id, text) VALUES (?, ?)', (current_user.id, text))
-    new_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('INSERT INTO shortcuts (user_id, text) VALUES (?, ?)', (current_user.id, text))
+        new_id = cursor.lastrowid
+        conn.commit()
     return jsonify({"success": True, "message": "Atalho adicionado!", "id": new_id, "text": text})
 
 @app.route("/delete_shortcut", methods=["POST"])
@@ -142,11 +237,10 @@ def delete_shortcut():
     if not shortcut_id:
         return jsonify({"success": False, "error": "ID do atalho não fornecido."}), 400
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM shortcuts WHERE id = ? AND user_id = ?', (shortcut_id, current_user.id))
-    conn.commit()
-    conn.close()
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM shortcuts WHERE id = ? AND user_id = ?', (shortcut_id, current_user.id))
+        conn.commit()
 
     if cursor.rowcount > 0:
         return jsonify({"success": True, "message": "Atalho removido."})
@@ -164,18 +258,11 @@ def feedback():
     if not user_query or not bot_response or rating is None:
         return jsonify({"success": False, "error": "Dados de feedback incompletos."}), 400
 
-    try:
-        conn = get_db_connection()
-        conn.execute(
-            'INSERT INTO feedback (user_id, user_query, bot_response, rating, correction) VALUES (?, ?, ?, ?, ?)',
-            (current_user.id, user_query, bot_response, rating, correction)
-        )
-        conn.commit()
-        conn.close()
+    # Gravado em segundo plano pelo escritor; a fila só recusa quando está cheia.
+    if writer.record_feedback(current_user.id, user_query, bot_response, rating, correction):
         return jsonify({"success": True, "message": "Obrigado pelo seu feedback!"})
-    except Exception as e:
-        print(f"Erro ao guardar feedback: {e}")
-        return jsonify({"success": False, "error": "Erro interno ao guardar feedback."}), 500
+    print("Erro ao guardar feedback: fila de escrita cheia.")
+    return jsonify({"success": False, "error": "Servidor ocupado. Tente novamente em instantes."}), 503
 
 def admin_required(f):
     from functools import wraps
@@ -193,30 +280,70 @@ def admin_required(f):
 def admin_panel():
     return render_template("admin.html")
 
+@app.route("/api/admin/stats")
+@login_required
+@admin_required
+def admin_stats():
+    return jsonify({
+        "brains": user_brains.stats(),
+        "history": history_manager.stats(),
+        "writer": writer.stats(),
+        "db": db.stats(),
+        "answers": answer_cache.stats(),
+        "intents": intent_router.stats(),
+        "llm": llm_gate.stats(),
+        "admission": admission.stats(),
+        "model": model_stats(),
+        "gclick": gclick_stats(),
+        "metrics": metrics.summary(),
+        "traces": traces.stats(),
+        "corrections": correction_index.stats(),
+    })
+
+@app.route("/api/admin/traces")
+@login_required
+@admin_required
+def admin_traces():
+    """Turnos mais lentos ("slowest"), com mais ferramentas ("tools") ou mais recentes ("recent")."""
+    order = request.args.get("order", "slowest")
+    if order not in TRACE_ORDERS:
+        return jsonify({"error": f"Ordem inválida. Use: {', '.join(TRACE_ORDERS)}"}), 400
+    limit = min(request.args.get("limit", 20, type=int), 200)
+    if request.args.get("source") == "db":
+        items = traces.top_from_db(order, limit, since_hours=request.args.get("hours", 24, type=float))
+    else:
+        items = traces.top(order, limit)
+    return jsonify({"order": order, "traces": items, "stats": traces.stats()})
+
+@app.route("/api/admin/metrics")
+@login_required
+@admin_required
+def admin_metrics():
+    """Métricas no formato de texto do Prometheus."""
+    admission_stats, llm_stats, brain_stats = admission.stats(), llm_gate.stats(), user_brains.stats()
+    gauges = {
+        "jarvis_turns_active": ("Turnos em curso neste processo.", admission_stats["active"]),
+        "jarvis_turns_queued": ("Turnos à espera de vaga.", admission_stats["queue_depth"]),
+        "jarvis_llm_in_flight": ("Chamadas ao Gemini em curso.", llm_stats["in_flight"]),
+        "jarvis_llm_waiting": ("Chamadas à espera de vaga no Gemini.", llm_stats["waiting"]),
+        "jarvis_brains_loaded": ("Cérebros em memória.", brain_stats["size"]),
+        "jarvis_writer_queue_depth": ("Escritas pendentes na fila do SQLite.", writer.stats()["queue_depth"]),
+    }
+    return Response(metrics.render(gauges), mimetype="text/plain; version=0.0.4")
+
 @app.route("/api/knowledge/<key>", methods=['GET', 'POST'])
 @login_required
 @admin_required
 def handle_knowledge(key):
-    conn = get_db_connection()
     if request.method == 'GET':
-        row = conn.execute('SELECT content FROM knowledge_base WHERE key = ?', (key,)).fetchone()
-        conn.close()
-        return jsonify(json.loads(row['content'])) if row else (jsonify({"error": "Chave não encontrada"}), 404)
+        content = knowledge_store.current().data.get(key)
+        return jsonify(content) if content is not None else (jsonify({"error": "Chave não encontrada"}), 404)
     if request.method == 'POST':
         try:
-            new_content = request.json
-            cursor = conn.cursor()
-            cursor.execute("SELECT key FROM knowledge_base WHERE key = ?", (key,))
-            if cursor.fetchone() is None:
-                cursor.execute("INSERT INTO knowledge_base (key, content) VALUES (?, ?)", (key, json.dumps(new_content, indent=4, ensure_ascii=False)))
-            else:
-                cursor.execute('UPDATE knowledge_base SET content = ? WHERE key = ?', (json.dumps(new_content, indent=4, ensure_ascii=False), key))
-            conn.commit()
-            conn.close()
-            user_brains.clear()
+            # Troca o snapshot partilhado; as conversas em curso passam a usar a nova versão.
+            knowledge_store.update(key, request.json)
             return jsonify({"message": f"'{key}' atualizado com sucesso!"})
         except Exception as e:
-            conn.close()
             return jsonify({"error": str(e)}), 500
 
 if __name__ == "__main__":
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Modo de serviço assíncrono (ASGI).
+
+As rotas de chat (/ask e /ask_stream) são atendidas diretamente no event
+loop: as chamadas ao Gemini são aguardadas e as ferramentas correm em
+threads, por isso uma pergunta lenta não prende um worker. As restantes
+rotas continuam a ser a aplicação Flask, servida através do asgiref.
+
+    uvicorn asgi:application --workers 4
+"""
+import asyncio
+import datetime
+import json
+import time
+from http.cookies import SimpleCookie
+from typing import Optional
+
+from asgiref.wsgi import WsgiToAsgi
+
+import db
+from admission import admission, TurnRejected
+from app import app, user_brains
+from llm_gate import LLMBusyError
+from persistence import writer
+from tracing import traces
+
+_flask = WsgiToAsgi(app)
+_session_serializer = app.session_interface.get_signing_serializer(app)
+
+def _user_id(scope) -> Optional[int]:
+    """Utilizador autenticado, lido do mesmo cookie de sessão assinado que o Flask-Login usa."""
+    headers = dict(scope.get("headers") or [])
+    cookie = SimpleCookie(headers.get(b"cookie", b"").decode("latin-1"))
+    morsel = cookie.get(app.config["SESSION_COOKIE_NAME"])
+    if morsel is None or _session_serializer is None:
+        return None
+    try:
+        session = _session_serializer.loads(morsel.value, max_age=int(app.permanent_session_lifetime.total_seconds()))
+    except Exception:
+        return None
+    user = db.get_user(session["_user_id"]) if session.get("_user_id") else None
+    return user["id"] if user else None
+
+async def _read_json(receive) -> dict:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    try:
+        return json.loads(body or b"{}")
+    except ValueError:
+        return {}
+
+async def _send_json(send, status: int, payload: dict, headers=()):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def ask(receive, send, user_id):
+    user_message = (await _read_json(receive)).get("message")
+    if not isinstance(user_message, str) or not user_message.strip():
+        await _send_json(send, 400, {"text": "A mensagem não pode ser vazia."})
+        return
+    try:
+        with traces.turn(user_id, user_message) as trace:
+            brain = await asyncio.to_thread(user_brains.get, user_id)
+            trace["session_id"] = brain.session_id
+            started = time.perf_counter()
+            response_text = await brain.get_response_async(user_message)
+            traces.finish(trace, response_text)
+    except LLMBusyError as e:
+        await _send_json(send, 503, {"text": "O Jarvis está com muitas perguntas neste momento. Tente novamente em instantes."},
+                         [(b"retry-after", str(e.retry_after).encode())])
+        return
+    writer.record_turn(user_id, brain.session_id, user_message, response_text, brain.last_turn_tools, (time.perf_counter() - started) * 1000)
+    await asyncio.to_thread(user_brains.save, user_id, brain)
+    await _send_json(send, 200, {"text": response_text, "timestamp": datetime.datetime.now().strftime("%H:%M")})
+
+async def ask_stream(receive, send, user_id):
+    user_message = (await _read_json(receive)).get("message")
+    if not isinstance(user_message, str) or not user_message.strip():
+        await _send_json(send, 400, {"text": "A mensagem não pode ser vazia."})
+        return
+    brain = await asyncio.to_thread(user_brains.get, user_id)
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/event-stream; charset=utf-8"), (b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")],
+    })
+    # Mesmo formato de eventos que a rota /ask_stream do Flask.
+    turn = brain.astream_response(user_message)
+    saved = False
+    try:
+        with traces.turn(user_id, user_message) as trace:
+            trace["session_id"] = brain.session_id
+            started = time.perf_counter()
+            async for event, data in turn:
+                if event in ("done", "error"):
+                    traces.finish(trace, data, error=brain.last_turn_error and type(brain.last_turn_error).__name__)
+                    writer.record_turn(user_id, brain.session_id, user_message, data, brain.last_turn_tools, (time.perf_counter() - started) * 1000)
+                    await asyncio.to_thread(user_brains.save, user_id, brain)
+                    saved = True
+                payload = json.dumps(data, ensure_ascii=False)
+                frame = f"data: {payload}\n\n" if event == "text" else f"event: {event}\ndata: {payload}\n\n"
+                await send({"type": "http.response.body", "body": frame.encode("utf-8"), "more_body": True})
+    finally:
+        if not saved:
+            # Cliente desligou-se (ou o pedido foi cancelado) a meio: desfaz o turno e grava o estado.
+            await turn.aclose()
+            await asyncio.to_thread(user_brains.save, user_id, brain)
+    await send({"type": "http.response.body", "body": b""})
+
+CHAT_ROUTES = {"/ask": ask, "/ask_stream": ask_stream}
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    handler = CHAT_ROUTES.get(scope.get("path")) if scope["type"] == "http" and scope.get("method") == "POST" else None
+    if handler is None:
+        await _flask(scope, receive, send)
+        return
+    user_id = await asyncio.to_thread(_user_id, scope)
+    if user_id is None:
+        await _send_json(send, 401, {"text": "Sessão expirada. Faça login novamente."})
+        return
+    try:
+        ticket = await admission.aacquire(user_id)
+    except TurnRejected as e:
+        await _send_json(send, e.status, {"text": e.message}, [(b"retry-after", str(e.retry_after).encode())])
+        return
+    try:
+        await handler(receive, send, user_id)
+    finally:
+        ticket.release()
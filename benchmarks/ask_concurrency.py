@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""Vazão do /ask: caminho síncrono (Flask + threads) vs modo assíncrono (asgi.py).
+
+O Gemini é substituído por um stub com latência fixa e a sincronização do
+G-Click fica desligada, por isso o teste corre sem rede. Usa uma cópia do
+jarvis.db numa pasta temporária.
+
+    python benchmarks/ask_concurrency.py --users 120 --requests 3 --latency 0.5 --threads 16
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+QUESTION = "bom dia, tudo bem?"  # sem entidade: não vai ao fast path nem ao cache de respostas
+
+def _prepare_workdir(users: int) -> list:
+    workdir = tempfile.mkdtemp(prefix="jarvis-bench-")
+    shutil.copy(os.path.join(ROOT, "jarvis.db"), workdir)
+    os.chdir(workdir)
+    conn = sqlite3.connect("jarvis.db")
+    ids = []
+    for i in range(users):
+        cursor = conn.execute("INSERT INTO users (username, password, role) VALUES (?, ?, 'user')", (f"bench-{i}", b"x"))
+        ids.append(cursor.lastrowid)
+    conn.commit()
+    conn.close()
+    return ids
+
+def _install_stubs(latency: float):
+    import google.generativeai as genai
+    from google.generativeai import protos
+    import client_directory
+
+    client_directory.ClientDirectory.start_background_sync = lambda self: None
+
+    class _Reply:
+        text = "Olá! Em que posso ajudar?"
+
+    def send_message(self, content, **kwargs):
+        time.sleep(latency)
+        self._history.extend([
+            protos.Content(role="user", parts=[protos.Part(text=str(content))]),
+            protos.Content(role="model", parts=[protos.Part(text=_Reply.text)]),
+        ])
+        return _Reply()
+
+    class _Chunk:
+        def __init__(self, text):
+            self.parts = [protos.Part(text=text)]
+
+    class _AsyncStream:
+        def __init__(self, text):
+            self.text = text
+
+        async def __aiter__(self):
+            yield _Chunk(self.text)
+
+    async def send_message_async(self, content, **kwargs):
+        await asyncio.sleep(latency)
+        self._history.extend([
+            protos.Content(role="user", parts=[protos.Part(text=str(content))]),
+            protos.Content(role="model", parts=[protos.Part(text=_Reply.text)]),
+        ])
+        return _AsyncStream(_Reply.text)
+
+    genai.ChatSession.send_message = send_message
+    genai.ChatSession.send_message_async = send_message_async
+
+def _summary(mode: str, latencies: list, errors: int, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "mode": mode,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(statistics.median(latencies) * 1000, 1) if latencies else None,
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1) if latencies else None,
+        "max_ms": round(latencies[-1] * 1000, 1) if latencies else None,
+    }
+
+def run_sync(app_module, user_ids: list, requests_per_user: int, threads: int) -> dict:
+    """Cada utilizador envia os seus pedidos em sequência; o servidor tem `threads` threads."""
+    def user_session(user_id):
+        client = app_module.app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(user_id)
+            session["_fresh"] = True
+        latencies, errors = [], 0
+        for _ in range(requests_per_user):
+            started = time.perf_counter()
+            response = client.post("/ask", json={"message": QUESTION})
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+        return latencies, errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(user_session, user_ids))
+    elapsed = time.perf_counter() - started
+    return _summary(f"sync ({threads} threads)", [l for lat, _ in results for l in lat], sum(e for _, e in results), elapsed)
+
+def run_async(app_module, asgi_module, user_ids: list, requests_per_user: int) -> dict:
+    serializer = app_module.app.session_interface.get_signing_serializer(app_module.app)
+    cookie_name = app_module.app.config["SESSION_COOKIE_NAME"]
+
+    async def call(user_id):
+        cookie = f"{cookie_name}={serializer.dumps({'_user_id': str(user_id), '_fresh': True})}".encode()
+        body = json.dumps({"message": QUESTION}).encode()
+        scope = {"type": "http", "method": "POST", "path": "/ask", "headers": [(b"cookie", cookie), (b"content-type", b"application/json")]}
+        sent = {"status": None}
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                sent["status"] = message["status"]
+
+        await asgi_module.application(scope, receive, send)
+        return sent["status"]
+
+    async def user_session(user_id):
+        latencies, errors = [], 0
+        for _ in range(requests_per_user):
+            started = time.perf_counter()
+            if await call(user_id) == 200:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+        return latencies, errors
+
+    async def main():
+        return await asyncio.gather(*(user_session(user_id) for user_id in user_ids))
+
+    started = time.perf_counter()
+    results = asyncio.run(main())
+    elapsed = time.perf_counter() - started
+    return _summary("async (asgi)", [l for lat, _ in results for l in lat], sum(e for _, e in results), elapsed)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=120)
+    parser.add_argument("--requests", type=int, default=3, help="pedidos por utilizador")
+    parser.add_argument("--latency", type=float, default=0.5, help="latência simulada do Gemini (s)")
+    parser.add_argument("--threads", type=int, default=16, help="threads do servidor síncrono")
+    parser.add_argument("--llm-limit", type=int, default=256, help="JARVIS_LLM_MAX_CONCURRENCY")
+    parser.add_argument("--max-active", type=int, default=256, help="JARVIS_MAX_ACTIVE_TURNS (fila com o dobro)")
+    parser.add_argument("--output", help="ficheiro JSON para os resultados")
+    args = parser.parse_args()
+
+    os.environ["JARVIS_LLM_MAX_CONCURRENCY"] = str(args.llm_limit)
+    os.environ["JARVIS_MAX_ACTIVE_TURNS"] = str(args.max_active)
+    os.environ["JARVIS_MAX_QUEUED_TURNS"] = str(args.max_active * 2)
+    os.environ.setdefault("GEMINI_API_KEY", "bench")
+    user_ids = _prepare_workdir(args.users)
+    _install_stubs(args.latency)
+    import app as app_module
+    import asgi as asgi_module
+
+    results = {
+        "config": vars(args),
+        "results": [
+            run_sync(app_module, user_ids, args.requests, args.threads),
+            run_async(app_module, asgi_module, user_ids, args.requests),
+        ],
+    }
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
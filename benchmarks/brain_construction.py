@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""Custo de criar um JarvisBrain e tamanho da entrada por turno, antes e depois do modelo partilhado.
+
+"antes": um GenerativeModel por cérebro e o prompt de sistema como um falso
+turno no histórico. "depois": o modelo partilhado com system_instruction.
+Os tokens são estimados localmente (~4 bytes por token); com --live e uma
+GEMINI_API_KEY válida usa-se model.count_tokens.
+
+    python benchmarks/brain_construction.py --brains 200 [--live]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+LEGACY_ACK = "Entendido. Seguirei as instruções e fluxos de ação rigorosamente."
+QUESTION = "Qual o regime tributário da empresa Acme?"
+
+def _prepare_workdir():
+    workdir = tempfile.mkdtemp(prefix="jarvis-bench-")
+    shutil.copy(os.path.join(ROOT, "jarvis.db"), workdir)
+    os.chdir(workdir)
+
+def _legacy_chat(genai, jb):
+    model = genai.GenerativeModel(model_name=jb.MODEL_NAME, tools=list(jb.get_tools().values()))
+    chat = model.start_chat(history=[{'role': 'user', 'parts': [jb.SYSTEM_PROMPT]}, {'role': 'model', 'parts': [LEGACY_ACK]}],
+                            enable_automatic_function_calling=True)
+    return model, chat
+
+def _bytes_tokens(message) -> int:
+    return type(message).pb(message).ByteSize() // 4
+
+def _estimate_input_tokens(model, history, system_instruction) -> dict:
+    from google.generativeai import protos
+    contents = list(history) + [protos.Content(role="user", parts=[protos.Part(text=QUESTION)])]
+    tools = model._tools.to_proto() if model._tools else []
+    estimate = {
+        "history": sum(_bytes_tokens(c) for c in contents),
+        "tools": sum(_bytes_tokens(t) for t in tools),
+        "system_instruction": _bytes_tokens(system_instruction) if system_instruction is not None else 0,
+    }
+    estimate["total"] = sum(estimate.values())
+    return estimate
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--brains", type=int, default=200)
+    parser.add_argument("--live", action="store_true", help="contar tokens com a API (requer GEMINI_API_KEY)")
+    parser.add_argument("--output", help="ficheiro JSON para os resultados")
+    args = parser.parse_args()
+
+    _prepare_workdir()
+    import client_directory
+    client_directory.ClientDirectory.start_background_sync = lambda self: None
+    import google.generativeai as genai
+    import jarvis_brain as jb
+
+    started = time.perf_counter()
+    legacy = [_legacy_chat(genai, jb) for _ in range(args.brains)]
+    legacy_ms = (time.perf_counter() - started) * 1000 / args.brains
+
+    started = time.perf_counter()
+    jb.get_model()
+    first_model_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    brains = [jb.JarvisBrain(i) for i in range(args.brains)]
+    shared_ms = (time.perf_counter() - started) * 1000 / args.brains
+
+    legacy_model, legacy_chat = legacy[0]
+    shared_model = jb.get_model()
+    results = {
+        "brains": args.brains,
+        "construction_ms_per_brain": {"before": round(legacy_ms, 3), "after": round(shared_ms, 3), "shared_model_build_ms": round(first_model_ms, 1)},
+        "history_bytes_per_brain": {
+            "before": sum(type(c).pb(c).ByteSize() for c in legacy_chat.history),
+            "after": brains[0].memory_usage()["approx_bytes"],
+        },
+        "input_tokens_first_turn_estimate": {
+            "before": _estimate_input_tokens(legacy_model, legacy_chat.history, None),
+            "after": _estimate_input_tokens(shared_model, brains[0].chat.history, shared_model._system_instruction),
+        },
+    }
+    if args.live:
+        question = {"role": "user", "parts": [QUESTION]}
+        results["input_tokens_first_turn_live"] = {
+            "before": legacy_model.count_tokens(list(legacy_chat.history) + [question]).total_tokens,
+            "after": shared_model.count_tokens(list(brains[0].chat.history) + [question]).total_tokens,
+        }
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Latência da busca por correções parecidas (feedback_embeddings) a 10k, 100k e 1M linhas.
+
+Numa cópia do jarvis.db insere correções sintéticas com embedding (tirado de
+um conjunto de perguntas distintas, para não medir o embedder na carga) e,
+para cada tamanho, carrega um CorrectionIndex novo e mede o tempo de carga
+e o p50/p95 de top_ids() e de search() (que lê também o texto do banco).
+Sem NumPy só se mede até `--python-max` linhas.
+
+    python benchmarks/correction_search.py --sizes 10000,100000,1000000 --queries 200
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SUBJECTS = ["regime tributário", "responsável fiscal", "ramal", "prazo da DCTF", "endereço", "contato", "CNPJ", "status das tarefas"]
+WORDS = ["Alfa", "Beta", "Gama", "Delta", "Sigma", "Omega", "Atlas", "Aurora", "Horizonte", "Vale"]
+
+def _prepare_workdir():
+    workdir = tempfile.mkdtemp(prefix="jarvis-bench-")
+    shutil.copy(os.path.join(ROOT, "jarvis.db"), workdir)
+    os.chdir(workdir)
+
+def _question(rng: random.Random) -> str:
+    return f"qual o {rng.choice(SUBJECTS)} da empresa {rng.choice(WORDS)} Comercio {rng.randint(1, 5000):04d}"
+
+def _seed(conn, rows: int, pool: list, rng: random.Random):
+    def generate():
+        for _ in range(rows):
+            query, blob = rng.choice(pool)
+            yield (1, query, "Não sei.", -1, f"Correção para: {query}", blob)
+    with conn:
+        conn.executemany("INSERT INTO feedback (user_id, user_query, bot_response, rating, correction, embedding) VALUES (?, ?, ?, ?, ?, ?)", generate())
+
+def _percentiles(samples: list) -> dict:
+    samples = sorted(samples)
+    return {"p50_ms": round(statistics.median(samples), 3), "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 3)}
+
+def _measure(fe, questions: list, memmap_rows: int) -> dict:
+    index = fe.CorrectionIndex("jarvis.db", memmap_rows=memmap_rows)
+    started = time.perf_counter()
+    index.refresh(force=True)
+    load_s = time.perf_counter() - started
+    top_ids, search = [], []
+    for question in questions:
+        started = time.perf_counter()
+        index.top_ids(question, 3)
+        top_ids.append((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        index.search(question, 3)
+        search.append((time.perf_counter() - started) * 1000)
+    stats = index.stats()
+    return {"load_s": round(load_s, 2), "memmap": stats["memmap"], "top_ids": _percentiles(top_ids), "search": _percentiles(search)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--pool", type=int, default=20000, help="perguntas distintas usadas nas linhas sintéticas")
+    parser.add_argument("--python-max", type=int, default=100000, help="maior tamanho medido sem NumPy")
+    parser.add_argument("--memmap-rows", type=int, default=None, help="limite para a matriz em memmap (por omissão o do módulo)")
+    parser.add_argument("--output", help="ficheiro JSON para os resultados")
+    args = parser.parse_args()
+
+    _prepare_workdir()
+    import db
+    import feedback_embeddings as fe
+
+    rng = random.Random(42)
+    pool = [(query, fe.embed_blob(query)) for query in {_question(rng) for _ in range(args.pool)}]
+    questions = [_question(rng) for _ in range(args.queries)]
+    memmap_rows = args.memmap_rows if args.memmap_rows is not None else fe.MEMMAP_ROWS
+    has_numpy = fe._numpy() is not None
+
+    conn = db.open_connection("jarvis.db")
+    results = {"numpy": has_numpy, "dim": fe.EMBEDDING_DIM, "sizes": {}}
+    seeded = 0
+    for size in sorted(int(s) for s in args.sizes.split(",")):
+        if not has_numpy and size > args.python_max:
+            print(f"Sem NumPy: {size} linhas ignoradas (acima de --python-max).")
+            continue
+        _seed(conn, size - seeded, pool, rng)
+        seeded = size
+        results["sizes"][size] = _measure(fe, questions, memmap_rows)
+        print(f"{size:>8} linhas: {json.dumps(results['sizes'][size])}")
+    conn.close()
+
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Relatório semanal de feedback: agregados diários vs varrimento da tabela feedback.
+
+Numa cópia do jarvis.db insere N linhas de feedback sintéticas espalhadas
+pelos últimos `--days` dias, incorpora-as nos agregados (o mesmo catch_up
+que o escritor em segundo plano faz a cada lote) e mede
+FeedbackAnalyzer.generate_weekly_report() contra a análise com raw=True,
+que percorre as linhas do período.
+
+    python benchmarks/feedback_report.py --rows 1000000 --days 90 --runs 3
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+QUERIES = ["qual o ramal do setor fiscal", "regime tributário da empresa Alfa", "prazo da obrigação DCTF",
+           "contato do responsável contábil", "status das tarefas da empresa Beta"]
+RESPONSES = ["Não sei responder a isso.", "Desculpe, ocorreu um erro.", "O regime é Simples Nacional.", "O ramal é 200."]
+CORRECTIONS = ["O ramal correto é 215.", "O prazo é dia 15.", "É Lucro Presumido desde 2023, conforme o cadastro da empresa.", "Lucro Real."]
+
+def _prepare_workdir():
+    workdir = tempfile.mkdtemp(prefix="jarvis-bench-")
+    shutil.copy(os.path.join(ROOT, "jarvis.db"), workdir)
+    os.chdir(workdir)
+
+def _seed(conn, rows: int, days: int, users: list):
+    rng = random.Random(42)
+    def generate():
+        for _ in range(rows):
+            negative = rng.random() < 0.3
+            yield (rng.choice(users), rng.choice(QUERIES), rng.choice(RESPONSES), -1 if negative else 1,
+                   rng.choice(CORRECTIONS) if negative else None, f"-{rng.randint(0, days * 86400)} seconds")
+    with conn:
+        conn.executemany(
+            "INSERT INTO feedback (user_id, user_query, bot_response, rating, correction, timestamp) VALUES (?, ?, ?, ?, ?, datetime('now', ?))",
+            generate())
+
+def _timed(fn, runs: int) -> dict:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {"median_ms": round(statistics.median(samples), 1), "min_ms": round(min(samples), 1)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--days", type=int, default=90, help="período por onde se espalham as linhas")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--output", help="ficheiro JSON para os resultados")
+    args = parser.parse_args()
+
+    _prepare_workdir()
+    import db
+    import feedback_rollups
+    from learning_system import FeedbackAnalyzer, LearningSystem
+
+    conn = db.open_connection("jarvis.db")
+    feedback_rollups.ensure_schema(conn)
+    conn.commit()
+    users = [row[0] for row in conn.execute("SELECT id FROM users")] or [1]
+
+    started = time.perf_counter()
+    _seed(conn, args.rows, args.days, users)
+    seed_s = time.perf_counter() - started
+    started = time.perf_counter()
+    folded = feedback_rollups.refresh(conn)
+    catch_up_s = time.perf_counter() - started
+    conn.close()
+
+    analyzer = FeedbackAnalyzer("jarvis.db")
+    learning = LearningSystem("jarvis.db")
+    results = {
+        "rows": args.rows,
+        "days": args.days,
+        "seed_s": round(seed_s, 1),
+        "catch_up": {"rows": folded, "s": round(catch_up_s, 2)},
+        "weekly_report_rollups": _timed(analyzer.generate_weekly_report, args.runs),
+        "analysis_rollups": _timed(lambda: learning.analyze_negative_feedback(7), args.runs),
+        "analysis_raw_scan": _timed(lambda: learning.analyze_negative_feedback(7, raw=True), args.runs),
+    }
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
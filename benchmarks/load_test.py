@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""Teste de carga ponta a ponta do app.py com Gemini e G-Click falsos (benchmarks/stubs.py).
+
+Numa cópia do jarvis.db cria N utilizadores sintéticos, faz login de cada um
+pelo /login e dispara uma mistura de tráfego realista: perguntas sobre
+empresas, conversa livre, ramais (fast path), /feedback e atalhos. Cada
+utilizador é uma sessão própria; `--threads` limita quantas correm ao mesmo
+tempo. O relatório (vazão, p50/p95/p99 e taxa de erro por endpoint) é gravado
+em JSON em benchmarks/results/ e pode ser comparado com uma execução anterior.
+
+    python benchmarks/load_test.py --users 50 --requests 20 --threads 16
+    python benchmarks/load_test.py --mix ask_company=5,feedback=1 --compare benchmarks/results/anterior.json
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import stubs
+
+PASSWORD = "bench-password"
+DEFAULT_MIX = "ask_company=40,ask_smalltalk=15,ask_ramal=15,feedback=15,shortcuts=15"
+ERROR_TEXTS = ("Ocorreu um erro ao processar", "Desculpe, ocorreu um erro interno")
+COMPANY_QUESTIONS = [
+    "Qual o regime tributário da empresa {}?",
+    "Quais os contatos da empresa {}?",
+    "Qual o endereço da empresa {}?",
+    "Quem são os responsáveis da empresa {}?",
+]
+SMALLTALK = ["bom dia, tudo bem?", "obrigado pela ajuda", "boa tarde"]
+
+def _percentile(sorted_values: list, pct: float):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return round(sorted_values[index] * 1000, 1)
+
+class Recorder:
+    """Latências e erros por endpoint, partilhados pelas threads dos utilizadores."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def add(self, endpoint: str, seconds: float, ok: bool):
+        with self._lock:
+            latencies, errors = self._samples.setdefault(endpoint, ([], [0]))
+            latencies.append(seconds)
+            if not ok:
+                errors[0] += 1
+
+    def report(self, elapsed: float) -> dict:
+        with self._lock:
+            samples = {k: (sorted(v[0]), v[1][0]) for k, v in self._samples.items()}
+        every = sorted(l for latencies, _ in samples.values() for l in latencies)
+        samples["total"] = (every, sum(errors for _, errors in samples.values()))
+        return {
+            endpoint: {
+                "requests": len(latencies),
+                "errors": errors,
+                "error_rate": round(errors / len(latencies), 4) if latencies else 0.0,
+                "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+                "p50_ms": _percentile(latencies, 50),
+                "p95_ms": _percentile(latencies, 95),
+                "p99_ms": _percentile(latencies, 99),
+                "max_ms": round(latencies[-1] * 1000, 1) if latencies else None,
+            }
+            for endpoint, (latencies, errors) in samples.items()
+        }
+
+def _prepare_workdir(users: int) -> list:
+    import bcrypt
+    workdir = tempfile.mkdtemp(prefix="jarvis-bench-")
+    shutil.copy(os.path.join(ROOT, "jarvis.db"), workdir)
+    os.chdir(workdir)
+    password = bcrypt.hashpw(PASSWORD.encode("utf-8"), bcrypt.gensalt(rounds=4))
+    names = [f"bench-{i}" for i in range(users)]
+    conn = sqlite3.connect("jarvis.db")
+    conn.executemany("INSERT INTO users (username, password, role) VALUES (?, ?, 'user')", [(name, password) for name in names])
+    conn.commit()
+    conn.close()
+    return names
+
+def _parse_mix(text: str) -> dict:
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() not in SCENARIOS:
+            raise SystemExit(f"Cenário desconhecido: {name!r}. Disponíveis: {', '.join(SCENARIOS)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+class VirtualUser:
+    """Uma sessão autenticada que executa cenários escolhidos pela mistura configurada."""
+
+    def __init__(self, app_module, username: str, recorder: Recorder, rng: random.Random, context: dict):
+        self.client = app_module.app.test_client()
+        self.username = username
+        self.recorder = recorder
+        self.rng = rng
+        self.context = context
+        self.last_turn = None
+
+    def _call(self, endpoint: str, method: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.client.open(endpoint, method=method, **kwargs)
+        except Exception as e:
+            print(f"ERRO no pedido {endpoint}: {e}")
+            self.recorder.add(endpoint, time.perf_counter() - started, False)
+            return None
+        body = response.get_json(silent=True) or {}
+        ok = response.status_code == 200 and not any(text in str(body.get("text", "")) for text in ERROR_TEXTS)
+        self.recorder.add(endpoint, time.perf_counter() - started, ok)
+        return body if ok else None
+
+    def login(self) -> bool:
+        body = self._call("/login", "POST", data={"username": self.username, "password": PASSWORD}, headers={"X-Requested-With": "XMLHttpRequest"})
+        return bool(body and body.get("success"))
+
+    def _ask(self, message: str):
+        body = self._call("/ask", "POST", json={"message": message})
+        if body:
+            self.last_turn = (message, body["text"])
+        return body
+
+    def ask_company(self):
+        client_id = self.rng.randint(1, self.context["clients"])
+        template = self.rng.choice(COMPANY_QUESTIONS)
+        if self.rng.random() < self.context["ambiguous"]:
+            # Nome ambíguo: o Jarvis lista as opções e o utilizador escolhe a primeira.
+            body = self._ask(template.format(stubs.WORDS[client_id % len(stubs.WORDS)]))
+            if body and "Encontrei estas empresas" in body["text"]:
+                self._ask("1")
+            return
+        self._ask(template.format(stubs.client_search_term(client_id)))
+
+    def ask_smalltalk(self):
+        self._ask(self.rng.choice(SMALLTALK))
+
+    def ask_ramal(self):
+        names = self.context["ramal_names"]
+        self._ask(f"qual o ramal do {self.rng.choice(names)}" if names else "lista de ramais")
+
+    def feedback(self):
+        query, answer = self.last_turn or ("bom dia", "Olá! Em que posso ajudar?")
+        rating = self.rng.choice([1, 1, 1, -1])
+        self._call("/feedback", "POST", json={"user_query": query, "bot_response": answer, "rating": rating,
+                                               "correction": "Resposta incompleta." if rating == -1 else None})
+
+    def shortcuts(self):
+        added = self._call("/add_shortcut", "POST", json={"text": f"Atalho {self.rng.randint(1, 10 ** 6)}"})
+        self._call("/get_shortcuts", "GET")
+        if added:
+            self._call("/delete_shortcut", "POST", json={"id": added["id"]})
+
+SCENARIOS = {
+    "ask_company": VirtualUser.ask_company,
+    "ask_smalltalk": VirtualUser.ask_smalltalk,
+    "ask_ramal": VirtualUser.ask_ramal,
+    "feedback": VirtualUser.feedback,
+    "shortcuts": VirtualUser.shortcuts,
+}
+
+def _ramal_names() -> list:
+    from knowledge_store import knowledge_store
+    departments = knowledge_store.current().data.get("departments", {})
+    return sorted({member["nome"].split()[0] for teams in departments.values() for team in teams for member in team.get("equipe", []) if member.get("nome")})
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+def _compare(current: dict, previous_path: str) -> dict:
+    """Diferença por endpoint face a uma execução anterior (positivo = pior, exceto na vazão)."""
+    with open(previous_path, encoding="utf-8") as f:
+        previous = json.load(f)["endpoints"]
+    comparison = {}
+    for endpoint, now in current.items():
+        before = previous.get(endpoint)
+        if not before:
+            continue
+        comparison[endpoint] = {
+            key: round(now[key] - before[key], 4 if key == "error_rate" else 1)
+            for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "error_rate")
+            if now.get(key) is not None and before.get(key) is not None
+        }
+    return comparison
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=20, help="cenários por utilizador")
+    parser.add_argument("--threads", type=int, default=16, help="utilizadores ativos ao mesmo tempo")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"pesos dos cenários ({', '.join(SCENARIOS)})")
+    parser.add_argument("--gemini-latency", type=float, default=0.3, help="latência simulada por chamada ao Gemini (s)")
+    parser.add_argument("--gclick-latency", type=float, default=0.05, help="latência simulada por pedido ao G-Click (s)")
+    parser.add_argument("--clients", type=int, default=600, help="clientes no catálogo sintético do G-Click")
+    parser.add_argument("--ambiguous", type=float, default=0.1, help="fração das perguntas sobre empresas com nome ambíguo")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="ficheiro JSON (por omissão benchmarks/results/load_test-<data>.json)")
+    parser.add_argument("--compare", help="JSON de uma execução anterior para comparar")
+    args = parser.parse_args()
+    mix = _parse_mix(args.mix)
+    # Os caminhos são resolvidos antes de mudar para a pasta temporária.
+    output = os.path.abspath(args.output or os.path.join(ROOT, "benchmarks", "results", f"load_test-{datetime.datetime.now():%Y%m%d-%H%M%S}.json"))
+    compare = os.path.abspath(args.compare) if args.compare else None
+
+    os.environ.setdefault("GEMINI_API_KEY", "bench")
+    os.environ.setdefault("GCLICK_CLIENT_ID", "bench")
+    os.environ.setdefault("GCLICK_CLIENT_SECRET", "bench")
+    usernames = _prepare_workdir(args.users)
+    stubs.install_gclick_stub(args.gclick_latency, args.clients)
+    stubs.install_gemini_stub(args.gemini_latency)
+    import app as app_module
+    import jarvis_brain
+    from admission import admission
+    from llm_gate import llm_gate
+    from answer_cache import answer_cache
+    from persistence import writer
+
+    # O diretório local é preenchido antes da medição, como num worker já em serviço.
+    jarvis_brain.get_gclick().directory.sync()
+    context = {"clients": args.clients, "ambiguous": args.ambiguous, "ramal_names": _ramal_names()}
+    recorder = Recorder()
+    names, weights = list(mix), list(mix.values())
+
+    def run_user(index_and_name):
+        index, username = index_and_name
+        rng = random.Random(args.seed * 100003 + index)
+        user = VirtualUser(app_module, username, recorder, rng, context)
+        if not user.login():
+            return
+        for scenario in rng.choices(names, weights, k=args.requests):
+            SCENARIOS[scenario](user)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(run_user, enumerate(usernames)))
+    elapsed = time.perf_counter() - started
+
+    results = {
+        "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "revision": _git_revision(),
+        "config": dict(vars(args), mix=mix),
+        "elapsed_s": round(elapsed, 2),
+        "endpoints": recorder.report(elapsed),
+        "server": {
+            "admission": admission.stats(),
+            "llm": llm_gate.stats(),
+            "answers": answer_cache.stats(),
+            "writer": writer.stats(),
+            "gemini_calls": stubs.gemini_calls.snapshot(),
+            "gclick_calls": stubs.gclick_calls.snapshot(),
+        },
+    }
+    if compare:
+        results["compared_to"] = compare
+        results["delta"] = _compare(results["endpoints"], compare)
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False, default=str)
+    print(json.dumps({k: results[k] for k in ("elapsed_s", "endpoints", "delta") if k in results}, indent=2, ensure_ascii=False))
+    print(f"Resultados gravados em {output}")
+
+if __name__ == "__main__":
+    main()
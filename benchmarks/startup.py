@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Arranque a frio: tempo de `import app` (via -X importtime) e até o /login responder.
+
+Cada medição corre num processo novo, numa cópia do jarvis.db numa pasta
+temporária e sem GEMINI_API_KEY nem credenciais G-Click, como um worker
+acabado de reiniciar. Termina com código 1 se a mediana passar do orçamento
+ou se o import do app carregar módulos que deviam ser adiados.
+
+    python benchmarks/startup.py --runs 5 --budget-ms 250
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Módulos que só devem ser carregados no primeiro pedido de chat.
+DEFERRED_MODULES = ("google.generativeai", "gclick_automation", "client_directory", "numpy")
+
+PROBE = f"""
+import json, sys, time
+sys.path.insert(0, {ROOT!r})
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get("/login")
+ready = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - started) * 1000,
+    "first_login_ms": (ready - started) * 1000,
+    "login_status": response.status_code,
+    "loaded_deferred": [m for m in {DEFERRED_MODULES!r} if m in sys.modules],
+}}))
+"""
+
+def _run_once(workdir: str) -> dict:
+    env = {k: v for k, v in os.environ.items() if k not in ("GEMINI_API_KEY", "GCLICK_CLIENT_ID", "GCLICK_CLIENT_SECRET", "JARVIS_PREWARM")}
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE], cwd=workdir, env=env, capture_output=True, text=True, timeout=120)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr[-2000:])
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["top_imports"] = _top_imports(proc.stderr)
+    return result
+
+def _top_imports(importtime_log: str, limit: int = 10) -> list:
+    """Módulos de topo (importados diretamente pelo app) ordenados pelo tempo cumulativo."""
+    # O -X importtime escreve os filhos antes do pai, com dois espaços a mais por nível.
+    rows, children = [], []
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        if depth == 1:
+            children.append((int(cumulative) / 1000, name.strip()))
+        elif depth == 0:
+            if name.strip() == "app":
+                rows = children
+            children = []
+    return [{"module": name, "cumulative_ms": round(ms, 1)} for ms, name in sorted(rows, reverse=True)[:limit]]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=250.0, help="orçamento para a mediana até o primeiro /login")
+    parser.add_argument("--output", help="ficheiro JSON para os resultados")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="jarvis-bench-")
+    shutil.copy(os.path.join(ROOT, "jarvis.db"), workdir)
+    try:
+        runs = [_run_once(workdir) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    first_login = statistics.median(r["first_login_ms"] for r in runs)
+    loaded_deferred = sorted({m for r in runs for m in r["loaded_deferred"]})
+    results = {
+        "runs": args.runs,
+        "budget_ms": args.budget_ms,
+        "import_app_ms": round(statistics.median(r["import_ms"] for r in runs), 1),
+        "first_login_ms": round(first_login, 1),
+        "login_status": runs[-1]["login_status"],
+        "loaded_deferred": loaded_deferred,
+        "top_imports": runs[-1]["top_imports"],
+        "within_budget": first_login <= args.budget_ms and not loaded_deferred and runs[-1]["login_status"] == 200,
+    }
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    sys.exit(0 if results["within_budget"] else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""Substitutos locais e determinísticos do Gemini e do G-Click para os benchmarks.
+
+O G-Click falso serve um catálogo sintético de clientes pelos mesmos
+endpoints que o GClickAutomation usa; o Gemini falso imita a chamada
+automática de funções: escolhe as ferramentas pela pergunta, chama-as de
+verdade e grava no histórico os mesmos pares function_call/function_response.
+Ambos têm latência configurável por chamada.
+"""
+import re
+import threading
+import time
+from typing import Dict, List
+
+WORDS = ["Alfa", "Beta", "Gama", "Delta", "Sigma", "Omega", "Atlas", "Aurora", "Horizonte", "Vale"]
+GROUPS = ["Simples Nacional", "Lucro Presumido", "Lucro Real", "MEI"]
+
+def client_name(client_id: int) -> str:
+    return f"{WORDS[client_id % len(WORDS)]} Comercio {client_id:04d} Ltda"
+
+def client_search_term(client_id: int) -> str:
+    """Termo que identifica um único cliente do catálogo."""
+    return f"{WORDS[client_id % len(WORDS)]} Comercio {client_id:04d}"
+
+def _cnpj(client_id: int) -> str:
+    return f"{client_id:08d}0001{client_id % 100:02d}"
+
+class Counters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values: Dict[str, int] = {}
+
+    def add(self, key: str):
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.values)
+
+gclick_calls = Counters()
+gemini_calls = Counters()
+
+def install_gclick_stub(latency: float, clients: int):
+    """Troca o GClickAutomation por uma subclasse que responde a partir do catálogo sintético."""
+    import gclick_automation
+
+    catalog = {
+        client_id: {
+            "id": client_id,
+            "nome": client_name(client_id),
+            "inscricao": _cnpj(client_id),
+            "grupos": [{"nome": GROUPS[client_id % len(GROUPS)]}],
+            "telefones": [f"(11) 4000-{client_id:04d}"],
+            "emails": [f"contato{client_id}@cliente.example"],
+            "endereco": {"logradouro": f"Rua {client_id}", "cidade": "São Paulo", "uf": "SP"},
+        }
+        for client_id in range(1, clients + 1)
+    }
+
+    class StubGClickAutomation(gclick_automation.GClickAutomation):
+        def _make_request(self, method: str, endpoint: str, data: Dict = None, params: Dict = None):
+            time.sleep(latency)
+            params = params or {}
+            if endpoint == "/clientes":
+                gclick_calls.add("list")
+                page, size = int(params.get("page", 0)), int(params.get("size", 200))
+                rows = list(catalog.values())[page * size:(page + 1) * size]
+                return [{"id": c["id"], "nome": c["nome"], "inscricao": c["inscricao"]} for c in rows]
+            if endpoint == "/clientes/search":
+                gclick_calls.add("search")
+                text = str(params.get("texto", "")).lower()
+                return [{"id": c["id"], "nome": c["nome"], "inscricao": c["inscricao"]} for c in catalog.values()
+                        if text in c["nome"].lower() or text == re.sub(r"\D", "", c["inscricao"])]
+            match = re.fullmatch(r"/clientes/(\d+)(/responsaveis)?", endpoint)
+            if match and int(match.group(1)) in catalog:
+                client = catalog[int(match.group(1))]
+                if match.group(2):
+                    gclick_calls.add("responsibles")
+                    return [{"nome": f"Analista {client['id'] % 7}", "cargo": {"nome": "Contábil"}}]
+                gclick_calls.add("details")
+                return client
+            gclick_calls.add("not_found")
+            return {"error": f"404 Not Found: {endpoint}"}
+
+    gclick_automation.GClickAutomation = StubGClickAutomation
+    return catalog
+
+# Pergunta -> ferramenta de detalhe usada depois de localizar a empresa.
+DETAIL_TOOLS = [
+    ("regime", "get_client_group"),
+    ("contato", "get_client_contacts"),
+    ("endere", "get_client_address"),
+    ("respons", "list_client_responsibles"),
+]
+
+def install_gemini_stub(latency: float):
+    """Substitui ChatSession.send_message por um modelo falso que usa as ferramentas reais do Jarvis."""
+    import google.generativeai as genai
+    from google.generativeai import protos
+
+    class _Reply:
+        usage_metadata = None
+
+        def __init__(self, text):
+            self.text = text
+
+    def _tool_round(history: List, name: str, args: Dict):
+        import jarvis_brain
+        time.sleep(latency)
+        gemini_calls.add("rounds")
+        result = jarvis_brain.get_tools()[name](**args)
+        history.append(protos.Content(role="model", parts=[protos.Part(function_call=protos.FunctionCall(name=name, args=args))]))
+        history.append(protos.Content(role="user", parts=[protos.Part(function_response=protos.FunctionResponse(
+            name=name, response=result if isinstance(result, dict) else {"result": result}
+        ))]))
+        return result
+
+    def _answer(history: List, message: str) -> str:
+        text = message.lower()
+        detail = next((tool for keyword, tool in DETAIL_TOOLS if keyword in text), "get_client_group")
+        by_id = re.search(r"empresa com id (\d+)", text)
+        if by_id:
+            client_id = int(by_id.group(1))
+        else:
+            company = re.search(r"empresa (.+?)\??$", message, re.IGNORECASE)
+            if not company:
+                return "Olá! Em que posso ajudar?"
+            found = _tool_round(history, "search_clients_by_text", {"search_text": company.group(1)})
+            if not found:
+                return "Não encontrei nenhuma empresa com este nome. Verifique a grafia e tente novamente."
+            if len(found) > 1:
+                options = "<br>".join(f"{i}. {c['nome']}" for i, c in enumerate(found[:10], 1))
+                return f"Encontrei estas empresas:<br>{options}"
+            client_id = found[0]["id"]
+        result = _tool_round(history, detail, {"client_id": client_id})
+        return f"Resultado para a empresa {client_id}: {result}"
+
+    def send_message(self, content, **kwargs):
+        time.sleep(latency)
+        gemini_calls.add("messages")
+        message = str(content)
+        history = [protos.Content(role="user", parts=[protos.Part(text=message)])]
+        text = _answer(history, message)
+        history.append(protos.Content(role="model", parts=[protos.Part(text=text)]))
+        self._history.extend(history)
+        return _Reply(text)
+
+    genai.ChatSession.send_message = send_message
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+import db
+
+MAX_BRAINS = 200
+IDLE_TTL = 30 * 60  # segundos sem atividade antes de o cérebro ser despejado
+
+def ensure_schema(conn: sqlite3.Connection):
+    """Estado partilhado das conversas, com versão para concorrência otimista."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS brain_state (
+            user_id INTEGER PRIMARY KEY,
+            state TEXT NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(brain_state)")}
+    if "version" not in columns:
+        conn.execute("ALTER TABLE brain_state ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+
+def encode_state(state: Dict) -> bytes:
+    """JSON sem espaços, comprimido com zlib."""
+    return zlib.compress(json.dumps(state, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+def decode_state(raw) -> Dict:
+    # Linhas antigas guardavam o JSON como texto simples.
+    if isinstance(raw, bytes):
+        raw = zlib.decompress(raw).decode("utf-8")
+    return json.loads(raw)
+
+class SQLiteStateStore:
+    """Estado das conversas no SQLite, partilhado por todos os processos."""
+
+    def __init__(self, db_path: str = "jarvis.db"):
+        self.db_path = db_path
+        self._schema_ready = False
+
+    def _connection(self):
+        if not self._schema_ready:
+            with db.connection(self.db_path) as conn:
+                ensure_schema(conn)
+                conn.commit()
+            self._schema_ready = True
+        return db.connection(self.db_path)
+
+    def version(self, user_id) -> int:
+        """Versão atual (0 = sem estado). Consulta barata feita a cada pedido."""
+        with self._connection() as conn:
+            row = conn.execute("SELECT version FROM brain_state WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def load(self, user_id) -> Tuple[int, Optional[bytes]]:
+        with self._connection() as conn:
+            row = conn.execute("SELECT version, state FROM brain_state WHERE user_id = ?", (user_id,)).fetchone()
+        return (row[0], row[1]) if row else (0, None)
+
+    def save(self, user_id, payload: bytes, expected_version: int) -> Optional[int]:
+        """Grava se a versão guardada ainda for a esperada; devolve a nova versão ou None (conflito)."""
+        with self._connection() as conn, conn:
+            if expected_version == 0:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO brain_state (user_id, state, version, updated_at) VALUES (?, ?, 1, CURRENT_TIMESTAMP)",
+                    (user_id, payload)
+                )
+            else:
+                cursor = conn.execute(
+                    "UPDATE brain_state SET state = ?, version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE user_id = ? AND version = ?",
+                    (payload, user_id, expected_version)
+                )
+        return expected_version + 1 if cursor.rowcount == 1 else None
+
+    def clear(self, user_id, payload: bytes) -> int:
+        """Substitui o estado por `payload` e avança a versão, sem condição; devolve a nova versão.
+
+        A linha nunca é apagada: se a versão recomeçasse em 1, um worker que
+        ainda tivesse o cérebro da sessão antiga na versão 1 continuaria a usá-lo.
+        """
+        with self._connection() as conn, conn:
+            conn.execute('''
+                INSERT INTO brain_state (user_id, state, version, updated_at) VALUES (?, ?, 1, CURRENT_TIMESTAMP)
+                ON CONFLICT(user_id) DO UPDATE SET state = excluded.state, version = version + 1, updated_at = CURRENT_TIMESTAMP
+            ''', (user_id, payload))
+            return conn.execute("SELECT version FROM brain_state WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+
+class MemoryStateStore:
+    """Substituto local (um só processo) com a mesma interface do SQLiteStateStore."""
+
+    def __init__(self):
+        self._rows: Dict = {}
+        self._lock = threading.Lock()
+
+    def version(self, user_id) -> int:
+        return self._rows.get(user_id, (0, None))[0]
+
+    def load(self, user_id) -> Tuple[int, Optional[bytes]]:
+        return self._rows.get(user_id, (0, None))
+
+    def save(self, user_id, payload: bytes, expected_version: int) -> Optional[int]:
+        with self._lock:
+            if self.version(user_id) != expected_version:
+                return None
+            self._rows[user_id] = (expected_version + 1, payload)
+            return expected_version + 1
+
+    def clear(self, user_id, payload: bytes) -> int:
+        with self._lock:
+            version = self.version(user_id) + 1
+            self._rows[user_id] = (version, payload)
+            return version
+
+
+class BrainPool:
+    """Pool limitado de JarvisBrain sobre um armazenamento de estado partilhado.
+
+    O estado de cada conversa (empresa selecionada, últimos resultados e
+    turnos recentes) é gravado no armazenamento após cada turno, com a versão
+    lida como condição; essa versão fica no próprio cérebro (state_version),
+    por isso um turno ainda grava depois de o cérebro sair do pool. Os
+    cérebros em memória são só um cache: se outro processo avançou a versão,
+    o cérebro local é reconstruído a partir do estado guardado, por isso
+    qualquer worker pode atender qualquer turno. A versão nunca recua, nem
+    no logout.
+    """
+
+    def __init__(self, factory: Callable, max_size: int = MAX_BRAINS, idle_ttl: float = IDLE_TTL, db_path: str = "jarvis.db", store=None):
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.store = store or SQLiteStateStore(db_path)
+        self._brains: "OrderedDict[int, list]" = OrderedDict()  # user_id -> [brain, last_used]
+        self._lock = threading.RLock()
+        self._user_locks: Dict[int, threading.Lock] = {}  # um por utilizador; limitado pela tabela users
+        self._stats = {"created": 0, "rehydrated": 0, "evicted_idle": 0, "evicted_lru": 0, "saved": 0, "conflicts": 0, "state_bytes": 0}
+
+    # --- Acesso ---
+
+    def get(self, user_id) -> object:
+        """Devolve o cérebro do utilizador, reconstruindo-o se o estado guardado for mais novo."""
+        # A leitura da versão e a criação do cérebro ficam fora do lock do pool:
+        # só esperam uns pelos outros os pedidos do mesmo utilizador.
+        with self._user_lock(user_id):
+            with self._lock:
+                self._evict_idle()
+                entry = self._brains.get(user_id)
+            if entry is not None and entry[0].state_version == self._stored_version(user_id, entry[0].state_version):
+                with self._lock:
+                    if self._brains.get(user_id) is entry:
+                        entry[1] = time.monotonic()
+                        self._brains.move_to_end(user_id)
+                        return entry[0]
+            brain = self.factory(user_id)
+            version, state = self._load_state(user_id)
+            if state:
+                brain.restore_state(state)
+            with self._lock:
+                self._stats["rehydrated" if state else "created"] += 1
+                self._insert(user_id, brain, version)
+            return brain
+
+    def create(self, user_id) -> object:
+        """Cérebro novo (login): descarta qualquer estado anterior."""
+        with self._user_lock(user_id):
+            version = self.discard(user_id)
+            brain = self.factory(user_id)
+            with self._lock:
+                self._stats["created"] += 1
+                self._insert(user_id, brain, version)
+            return brain
+
+    def save(self, user_id, brain) -> bool:
+        """Grava o estado após um turno. Em conflito, o estado mais novo de outro processo prevalece."""
+        with self._user_lock(user_id):
+            # Grava mesmo que o cérebro já tenha sido despejado a meio do turno;
+            # se entretanto outro cérebro gravou, a versão não bate e é conflito.
+            try:
+                payload = encode_state(brain.export_state())
+                new_version = self.store.save(user_id, payload, brain.state_version)
+            except Exception as e:
+                print(f"ERRO ao persistir estado do cérebro {user_id}: {e}")
+                return False
+            with self._lock:
+                if new_version is None:
+                    # Outro processo gravou primeiro: o próximo get() recarrega o estado dele.
+                    entry = self._brains.get(user_id)
+                    if entry is not None and entry[0] is brain:
+                        self._brains.pop(user_id)
+                    self._stats["conflicts"] += 1
+                else:
+                    brain.state_version = new_version
+                    self._stats["saved"] += 1
+                    self._stats["state_bytes"] += len(payload)
+            if new_version is None:
+                print(f"AVISO: conflito de versão no estado do utilizador {user_id}; estado recarregado.")
+                return False
+            return True
+
+    def discard(self, user_id) -> int:
+        """Remove o cérebro e esvazia o estado persistido (logout); devolve a nova versão (0 se falhar)."""
+        with self._lock:
+            self._brains.pop(user_id, None)
+        try:
+            # Estado vazio com versão nova: os cérebros da sessão antiga noutros workers deixam de bater.
+            return self.store.clear(user_id, encode_state({}))
+        except Exception as e:
+            print(f"ERRO ao remover estado do cérebro {user_id}: {e}")
+            return 0
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self._brains
+
+    def _user_lock(self, user_id) -> threading.Lock:
+        with self._lock:
+            lock = self._user_locks.get(user_id)
+            if lock is None:
+                lock = self._user_locks[user_id] = threading.Lock()
+            return lock
+
+    # --- Despejo ---
+
+    def _insert(self, user_id, brain, version: int):
+        brain.state_version = version
+        self._brains[user_id] = [brain, time.monotonic()]
+        self._brains.move_to_end(user_id)
+        while len(self._brains) > self.max_size:
+            # Um turno em curso no cérebro despejado ainda grava o estado no fim (save usa a versão do cérebro).
+            self._brains.popitem(last=False)
+            self._stats["evicted_lru"] += 1
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._brains:
+            user_id, (brain, last_used) = next(iter(self._brains.items()))
+            if last_used > cutoff:
+                break
+            del self._brains[user_id]
+            self._stats["evicted_idle"] += 1
+
+    def evict_idle(self):
+        with self._lock:
+            self._evict_idle()
+
+    # --- Persistência ---
+
+    def _stored_version(self, user_id, default: int) -> int:
+        try:
+            return self.store.version(user_id)
+        except Exception as e:
+            print(f"ERRO ao consultar versão do estado do cérebro {user_id}: {e}")
+            return default  # Sem armazenamento, continua com o cérebro local.
+
+    def _load_state(self, user_id) -> Tuple[int, Optional[Dict]]:
+        try:
+            version, payload = self.store.load(user_id)
+            return version, decode_state(payload) if payload else None
+        except Exception as e:
+            print(f"ERRO ao carregar estado do cérebro {user_id}: {e}")
+            return 0, None
+
+    # --- Métricas ---
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._brains.items())
+            stats = dict(self._stats)
+        brains = []
+        for user_id, (brain, last_used) in entries:
+            brains.append({"user_id": user_id, "idle_seconds": round(now - last_used, 1), "version": brain.state_version, **brain.memory_usage()})
+        state_bytes = stats.pop("state_bytes")
+        return dict(
+            stats,
+            avg_state_bytes=state_bytes // stats["saved"] if stats["saved"] else 0,
+            size=len(entries),
+            max_size=self.max_size,
+            idle_ttl=self.idle_ttl,
+            total_bytes=sum(b["approx_bytes"] for b in brains),
+            brains=sorted(brains, key=lambda b: -b["approx_bytes"]),
+        )
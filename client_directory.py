@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+import db
+from gclick_automation import _format_cnpj
+from text_utils import normalize_text
+
+SYNC_INTERVAL = 6 * 60 * 60  # segundos entre sincronizações completas
+STALE_AFTER = 2 * SYNC_INTERVAL
+
+def _normalize(text: str) -> str:
+    """Remove acentos e pontuação: 'Comércio S.A.' -> 'comercio s a'."""
+    return " ".join(re.split(r"[^a-z0-9]+", normalize_text(text))).strip()
+
+def _compact(text: str) -> str:
+    """Forma sem separadores, para casar 'sa' com 'S.A.' e 'j r' com 'J.R.'."""
+    return _normalize(text).replace(" ", "")
+
+def normalize_inscricao(value: str) -> str:
+    """Apenas os dígitos de um CNPJ/CPF, formatado ou não."""
+    return re.sub(r"\D", "", value or "")
+
+def ensure_schema(conn: sqlite3.Connection):
+    """Cria as tabelas do diretório local de clientes (idempotente)."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS client_directory (
+            id INTEGER PRIMARY KEY,
+            nome TEXT NOT NULL,
+            inscricao TEXT,
+            nome_norm TEXT NOT NULL,
+            nome_compact TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS client_directory_fts USING fts5(
+            nome_norm, content='client_directory', content_rowid='id'
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS client_directory_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    ''')
+
+class ClientDirectory:
+    """Espelho local (SQLite FTS5) da lista de clientes do G-Click.
+
+    As buscas são respondidas localmente; a busca remota só é usada pelo
+    chamador quando o índice está desatualizado ou não encontra nada.
+    """
+
+    def __init__(self, gclick, db_path: str = "jarvis.db", sync_interval: int = SYNC_INTERVAL, stale_after: int = STALE_AFTER):
+        self.gclick = gclick
+        self.db_path = db_path
+        self.sync_interval = sync_interval
+        self.stale_after = stale_after
+        self._sync_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._last_sync: Optional[float] = None
+        self._cnpj_index: Dict[str, Dict] = {}
+        try:
+            with db.connection(self.db_path) as conn:
+                ensure_schema(conn)
+                conn.commit()
+                row = conn.execute("SELECT value FROM client_directory_meta WHERE key = 'last_sync'").fetchone()
+            self._last_sync = float(row[0]) if row else None
+            self._load_cnpj_index()
+        except Exception as e:
+            print(f"ERRO ao preparar diretório local de clientes: {e}")
+
+    # --- Sincronização ---
+
+    def sync(self) -> int:
+        """Copia a lista completa de clientes do G-Click para o índice local."""
+        if not self._sync_lock.acquire(blocking=False):
+            return 0  # Já existe uma sincronização em curso.
+        try:
+            clients = self.gclick.list_all_clients()
+            if not clients:
+                return 0  # Falha na API (None) ou lista vazia: mantém o espelho anterior.
+            rows = [
+                (int(c["id"]), c.get("nome") or "", normalize_inscricao(c.get("inscricao")),
+                 _normalize(c.get("nome")), _compact(c.get("nome")))
+                for c in clients if c.get("id") is not None
+            ]
+            now = time.time()
+            with db.connection(self.db_path) as conn, conn:
+                conn.execute("DELETE FROM client_directory")
+                conn.executemany(
+                    "INSERT OR REPLACE INTO client_directory (id, nome, inscricao, nome_norm, nome_compact) VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+                conn.execute("INSERT INTO client_directory_fts(client_directory_fts) VALUES ('rebuild')")
+                conn.execute("INSERT OR REPLACE INTO client_directory_meta (key, value) VALUES ('last_sync', ?)", (str(now),))
+            self._last_sync = now
+            self._load_cnpj_index()
+            print(f"Diretório local de clientes sincronizado: {len(rows)} clientes.")
+            return len(rows)
+        except Exception as e:
+            print(f"ERRO ao sincronizar diretório de clientes: {e}")
+            return 0
+        finally:
+            self._sync_lock.release()
+
+    def start_background_sync(self):
+        """Inicia a thread que mantém o índice atualizado (uma vez por processo)."""
+        if self._thread and self._thread.is_alive():
+            return
+
+        def _loop():
+            while True:
+                if self.needs_refresh():
+                    self.sync()
+                time.sleep(min(self.sync_interval, 300))
+
+        self._thread = threading.Thread(target=_loop, name="client-directory-sync", daemon=True)
+        self._thread.start()
+
+    def is_stale(self) -> bool:
+        return self._last_sync is None or time.time() - self._last_sync > self.stale_after
+
+    def needs_refresh(self) -> bool:
+        return self._last_sync is None or time.time() - self._last_sync > self.sync_interval
+
+    def _load_cnpj_index(self):
+        """Reconstrói o índice CNPJ/CPF -> cliente e troca-o de uma só vez."""
+        with db.connection(self.db_path) as conn:
+            rows = conn.execute("SELECT id, nome, inscricao FROM client_directory WHERE inscricao != ''").fetchall()
+        self._cnpj_index = {
+            r[2]: {"id": r[0], "nome": r[1], "inscricao": _format_cnpj(r[2])}
+            for r in rows if len(r[2]) in (11, 14)
+        }
+
+    # --- Busca ---
+
+    def find_by_cnpj(self, cnpj: str) -> Optional[Dict]:
+        """Resolve um CNPJ (ou CPF), formatado ou só dígitos, em O(1)."""
+        client = self._cnpj_index.get(normalize_inscricao(cnpj))
+        return dict(client) if client else None
+
+    def search(self, query: str, limit: int = 10) -> List[Dict]:
+        """Busca por nome, insensível a acentos e pontuação, ordenada por relevância."""
+        tokens = _normalize(query).split()
+        if not tokens:
+            return []
+        try:
+            with db.connection(self.db_path) as conn:
+                match = " ".join(f'"{t}"*' for t in tokens)
+                rows = conn.execute('''
+                    SELECT d.id, d.nome, d.inscricao
+                    FROM client_directory_fts f
+                    JOIN client_directory d ON d.id = f.rowid
+                    WHERE client_directory_fts MATCH ?
+                    ORDER BY bm25(client_directory_fts), length(d.nome)
+                    LIMIT ?
+                ''', (match, limit)).fetchall()
+                if not rows:
+                    # 'sa' vs 'S.A.', 'jr' vs 'J.R.': compara a forma sem separadores.
+                    compact = "".join(tokens)
+                    rows = conn.execute('''
+                        SELECT id, nome, inscricao FROM client_directory
+                        WHERE nome_compact LIKE ?
+                        ORDER BY length(nome)
+                        LIMIT ?
+                    ''', (f"%{compact}%", limit)).fetchall()
+        except Exception as e:
+            print(f"ERRO na busca local de clientes: {e}")
+            return []
+        return [{"id": r[0], "nome": r[1], "inscricao": _format_cnpj(r[2])} for r in rows]
+
+    def stats(self) -> Dict:
+        try:
+            with db.connection(self.db_path) as conn:
+                total = conn.execute("SELECT COUNT(*) FROM client_directory").fetchone()[0]
+        except Exception:
+            total = 0
+        return {"clients": total, "cnpj_index": len(self._cnpj_index), "last_sync": self._last_sync, "stale": self.is_stale()}
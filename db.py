@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from metrics import SQLITE_SECONDS
+from ttl_cache import TTLCache
+
+DB_PATH = "jarvis.db"
+POOL_SIZE = int(os.environ.get("JARVIS_DB_POOL_SIZE", "8"))
+USER_CACHE_TTL = float(os.environ.get("JARVIS_USER_CACHE_TTL", "30"))
+
+# Pragmas aplicados a cada conexão nova. journal_mode=WAL é persistente no
+# ficheiro e permite leituras concorrentes com uma escrita em curso.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+def configure_connection(conn: sqlite3.Connection) -> sqlite3.Connection:
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def open_connection(db_path: str = DB_PATH) -> sqlite3.Connection:
+    """Conexão nova já configurada (para threads dedicadas, fora do pool)."""
+    conn = sqlite3.connect(db_path, check_same_thread=False, cached_statements=256)
+    conn.row_factory = sqlite3.Row
+    return configure_connection(conn)
+
+class ConnectionPool:
+    """Pool de conexões SQLite reutilizáveis.
+
+    Reaproveitar a conexão evita o custo de abrir o ficheiro e reaplicar os
+    pragmas em cada pedido, e mantém o cache de statements compilados.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, size: int = POOL_SIZE):
+        self.db_path = db_path
+        self._idle: "queue.LifoQueue" = queue.LifoQueue(maxsize=size)
+        self._stats = {"opened": 0, "reused": 0}
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+            self._stats["reused"] += 1
+        except queue.Empty:
+            conn = open_connection(self.db_path)
+            self._stats["opened"] += 1
+        started = time.perf_counter()
+        try:
+            yield conn
+        finally:
+            SQLITE_SECONDS.observe(time.perf_counter() - started)
+            if conn.in_transaction:
+                conn.rollback()  # Transação não concluída pelo chamador.
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def stats(self) -> Dict:
+        return dict(self._stats, idle=self._idle.qsize())
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_path: str = DB_PATH) -> ConnectionPool:
+    pool = _pools.get(db_path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(db_path, ConnectionPool(db_path))
+    return pool
+
+def connection(db_path: str = DB_PATH):
+    """Uso: `with db.connection() as conn: ...` — a conexão volta ao pool no fim."""
+    return get_pool(db_path).connection()
+
+# --- Utilizadores ---
+
+_user_cache = TTLCache(maxsize=1024, ttl=USER_CACHE_TTL)
+
+def get_user(user_id) -> Optional[Dict]:
+    """Utilizador por id, com cache curto (usado em cada pedido autenticado)."""
+    key = str(user_id)
+    user = _user_cache.get(key)
+    if user is None:
+        with connection() as conn:
+            row = conn.execute('SELECT id, username, role FROM users WHERE id = ?', (user_id,)).fetchone()
+        if row is None:
+            return None
+        user = dict(row)
+        _user_cache.set(key, user)
+    return user
+
+def invalidate_user(user_id=None):
+    """Descarta o utilizador do cache (ou todos). Chamar após mudar papel ou senha."""
+    if user_id is None:
+        _user_cache.invalidate()
+    else:
+        _user_cache.invalidate(str(user_id))
+
+def update_user(user_id, role: Optional[str] = None, password_hash: Optional[bytes] = None):
+    """Altera papel e/ou senha e invalida o cache do utilizador."""
+    with connection() as conn:
+        if role is not None:
+            conn.execute('UPDATE users SET role = ? WHERE id = ?', (role, user_id))
+        if password_hash is not None:
+            conn.execute('UPDATE users SET password = ? WHERE id = ?', (password_hash, user_id))
+        conn.commit()
+    invalidate_user(user_id)
+
+def stats() -> Dict:
+    return {"pools": {path: pool.stats() for path, pool in _pools.items()}, "user_cache": _user_cache.stats()}
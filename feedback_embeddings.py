@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""Busca por semelhança nas correções dadas pelos utilizadores (feedback negativo).
+
+Cada pergunta corrigida é convertida num vetor por hashing de palavras e
+trigramas de letras (local, sem modelos nem rede) e gravada em
+feedback.embedding como float32 little-endian. O `CorrectionIndex` mantém os
+vetores numa matriz contígua (NumPy, em memmap acima de MEMMAP_ROWS linhas),
+e as correções mais parecidas com uma pergunta nova saem de um único produto
+matriz-vetor. Sem NumPy instalado a busca continua a funcionar em Python puro,
+apenas mais lenta.
+"""
+import atexit
+import heapq
+import itertools
+import math
+import os
+import re
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from array import array
+from typing import Dict, List, Optional
+
+import db
+from text_utils import normalize_text
+
+EMBEDDING_DIM = int(os.environ.get("JARVIS_EMBEDDING_DIM", "256"))
+MEMMAP_ROWS = int(os.environ.get("JARVIS_EMBEDDING_MEMMAP_ROWS", "200000"))
+POLL_INTERVAL = 30  # segundos entre verificações de correções novas
+MIN_SCORE = float(os.environ.get("JARVIS_FEEDBACK_HINT_MIN_SCORE", "0.5"))
+MAX_HINT_CHARS = 300
+INITIAL_CAPACITY = 1024
+WORD_WEIGHT = 1.0
+TRIGRAM_WEIGHT = 0.5
+
+_WORDS = re.compile(r"\w+")
+_PACK = struct.Struct(f"<{EMBEDDING_DIM}f")
+_numpy_module = None
+
+def _numpy():
+    """NumPy, importado só quando o índice é carregado; None se não estiver instalado (dependência opcional)."""
+    global _numpy_module
+    if _numpy_module is None:
+        try:
+            import numpy
+            _numpy_module = numpy
+        except ImportError:
+            _numpy_module = False
+    return _numpy_module or None
+
+def _features(text: str):
+    for word in _WORDS.findall(normalize_text(text)):
+        yield word, WORD_WEIGHT
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            yield padded[i:i + 3], TRIGRAM_WEIGHT
+
+def embed(text: str) -> List[float]:
+    """Vetor normalizado (norma 1) de dimensão EMBEDDING_DIM; o mesmo texto dá sempre o mesmo vetor."""
+    vector = [0.0] * EMBEDDING_DIM
+    for feature, weight in _features(text):
+        h = zlib.crc32(feature.encode("utf-8"))
+        vector[h % EMBEDDING_DIM] += weight if (h // EMBEDDING_DIM) & 1 else -weight
+    norm = math.sqrt(sum(value * value for value in vector))
+    return [value / norm for value in vector] if norm else vector
+
+def pack(vector: List[float]) -> bytes:
+    return _PACK.pack(*vector)
+
+def unpack(blob: bytes) -> array:
+    return array("f", _PACK.unpack(blob))
+
+def embed_blob(text: str) -> bytes:
+    """Embedding pronto a gravar em feedback.embedding."""
+    return pack(embed(text))
+
+def backfill(conn: sqlite3.Connection, chunk_size: int = 5000) -> int:
+    """Calcula o embedding das correções que ainda não o têm (ou com outra dimensão); devolve quantas atualizou."""
+    updated = 0
+    while True:
+        rows = conn.execute('''
+            SELECT id, user_query FROM feedback
+            WHERE rating = -1 AND correction IS NOT NULL AND (embedding IS NULL OR length(embedding) != ?)
+            LIMIT ?
+        ''', (_PACK.size, chunk_size)).fetchall()
+        if not rows:
+            return updated
+        with conn:
+            conn.executemany("UPDATE feedback SET embedding = ? WHERE id = ?", [(embed_blob(row[1]), row[0]) for row in rows])
+        updated += len(rows)
+
+def render_hints(hints: List[Dict]) -> str:
+    """Bloco few-shot posto antes da pergunta enviada ao Gemini."""
+    lines = ["[Correções feitas por utilizadores a perguntas parecidas; use-as apenas se forem relevantes]"]
+    for hint in hints:
+        lines.append(f"Pergunta: {hint['query'][:MAX_HINT_CHARS]}\nResposta correta: {hint['correction'][:MAX_HINT_CHARS]}")
+    return "\n".join(lines) + "\n\n[Pergunta atual]\n"
+
+class CorrectionIndex:
+    """Matriz com os embeddings das correções, atualizada de forma incremental.
+
+    Só os ids ficam em memória ao lado da matriz; o texto das melhores
+    correções é lido do banco no fim de cada busca. A primeira carga reserva
+    50% de folga e a capacidade duplica quando enche; acima de MEMMAP_ROWS a
+    matriz passa para um ficheiro temporário mapeado em memória.
+    """
+
+    def __init__(self, db_path: str = "jarvis.db", poll_interval: float = POLL_INTERVAL, memmap_rows: int = MEMMAP_ROWS):
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self.memmap_rows = memmap_rows
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._np = None
+        self._matrix = None  # NumPy: array (capacidade, dim); sem NumPy: lista de array('f')
+        self._ids = array("q")
+        self._size = 0
+        self._last_id = 0
+        self._data_version = None
+        self._last_poll = 0.0
+        self._memmap_paths: List[str] = []
+        self._stats = {"searches": 0, "loaded": 0, "polls": 0, "grown": 0}
+        atexit.register(self._remove_memmaps)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # Conexão dedicada (fora do pool): PRAGMA data_version é por conexão.
+            self._conn = db.open_connection(self.db_path)
+        return self._conn
+
+    def refresh(self, force: bool = False):
+        """Acrescenta à matriz as correções gravadas desde a última verificação."""
+        if not force and time.monotonic() - self._last_poll < self.poll_interval:
+            return
+        with self._lock:
+            try:
+                self._poll()
+            except Exception as e:
+                print(f"ERRO ao atualizar o índice de correções: {e}")
+            self._last_poll = time.monotonic()
+
+    def _poll(self):
+        conn = self._connection()
+        self._stats["polls"] += 1
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if self._matrix is not None and data_version == self._data_version:
+            return
+        self._data_version = data_version
+        cursor = conn.execute('''
+            SELECT id, embedding FROM feedback
+            WHERE id > ? AND rating = -1 AND correction IS NOT NULL AND length(embedding) = ?
+            ORDER BY id
+        ''', (self._last_id, _PACK.size))
+        if self._matrix is None:
+            self._np = _numpy()
+            if self._np is None:
+                self._matrix = []
+            else:
+                self._matrix = self._np.zeros((0, EMBEDDING_DIM), dtype=self._np.float32)
+                self._grow(conn.execute('''
+                    SELECT COUNT(*) FROM feedback
+                    WHERE rating = -1 AND correction IS NOT NULL AND length(embedding) = ?
+                ''', (_PACK.size,)).fetchone()[0])
+        while True:
+            rows = cursor.fetchmany(10000)
+            if not rows:
+                break
+            self._append([row[0] for row in rows], [row[1] for row in rows])
+
+    def _append(self, ids: List[int], blobs: List[bytes]):
+        np = self._np
+        if np is None:
+            self._matrix.extend(unpack(blob) for blob in blobs)
+        else:
+            self._grow(self._size + len(blobs))
+            self._matrix[self._size:self._size + len(blobs)] = np.frombuffer(b"".join(blobs), dtype="<f4").reshape(-1, EMBEDDING_DIM)
+        self._ids.extend(ids)
+        self._size += len(ids)
+        self._last_id = ids[-1]
+        self._stats["loaded"] += len(ids)
+
+    def _grow(self, needed: int):
+        """Garante capacidade para `needed` linhas; as buscas em curso continuam na matriz antiga."""
+        np = self._np
+        capacity = self._matrix.shape[0]
+        if needed <= capacity:
+            return
+        capacity = max(INITIAL_CAPACITY, capacity * 2, needed * 3 // 2)
+        if capacity > self.memmap_rows:
+            fd, path = tempfile.mkstemp(prefix="jarvis-corrections-", suffix=".f32")
+            os.close(fd)
+            # Os ficheiros antigos só são apagados no fim do processo: apagar
+            # um ficheiro grande pode demorar segundos e não deve cair num pedido.
+            self._memmap_paths.append(path)
+            matrix = np.memmap(path, dtype=np.float32, mode="w+", shape=(capacity, EMBEDDING_DIM))
+        else:
+            matrix = np.zeros((capacity, EMBEDDING_DIM), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        self._matrix = matrix
+        self._stats["grown"] += 1
+
+    def _remove_memmaps(self):
+        self._matrix = None
+        for path in self._memmap_paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # No Windows um ficheiro ainda mapeado não pode ser apagado.
+        self._memmap_paths = []
+
+    def top_ids(self, question: str, k: int = 3) -> List[tuple]:
+        """(id, semelhança) das k correções mais parecidas, da mais para a menos parecida."""
+        self.refresh()
+        matrix, ids, size = self._matrix, self._ids, self._size
+        self._stats["searches"] += 1
+        if not size or k <= 0:
+            return []
+        query = embed(question)
+        np = self._np
+        if np is None:
+            active = [(i, value) for i, value in enumerate(query) if value]
+            scores = (sum(row[i] * value for i, value in active) for row in itertools.islice(matrix, size))
+            best = heapq.nlargest(k, enumerate(scores), key=lambda item: item[1])
+        else:
+            scores = matrix[:size] @ np.asarray(query, dtype=np.float32)
+            top = np.argpartition(-scores, k - 1)[:k] if size > k else np.arange(size)
+            best = sorted(((int(row), float(scores[row])) for row in top), key=lambda item: item[1], reverse=True)
+        return [(ids[row], score) for row, score in best]
+
+    def search(self, question: str, k: int = 3, min_score: float = MIN_SCORE) -> List[Dict]:
+        """As k correções mais parecidas com a pergunta (sem repetidas), acima de `min_score`."""
+        best = [(feedback_id, score) for feedback_id, score in self.top_ids(question, k * 2) if score >= min_score]
+        if not best:
+            return []
+        placeholders = ",".join("?" * len(best))
+        with db.connection(self.db_path) as conn:
+            rows = {row["id"]: row for row in conn.execute(
+                f"SELECT id, user_query, correction FROM feedback WHERE id IN ({placeholders})", [i for i, _ in best])}
+        hints, seen = [], set()
+        for feedback_id, score in best:
+            row = rows.get(feedback_id)
+            if row is None or row["correction"] in seen:
+                continue
+            seen.add(row["correction"])
+            hints.append({"query": row["user_query"], "correction": row["correction"], "score": round(score, 3)})
+            if len(hints) == k:
+                break
+        return hints
+
+    def stats(self) -> Dict:
+        return dict(self._stats, rows=self._size, numpy=self._np is not None, memmap=bool(self._memmap_paths), dim=EMBEDDING_DIM)
+
+
+correction_index = CorrectionIndex()
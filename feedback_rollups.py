@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Agregados diários do feedback, mantidos de forma incremental.
+
+Os relatórios leem estas tabelas (uma linha por dia e utilizador, tipo de
+erro ou palavra-chave) em vez de percorrer a tabela feedback. `catch_up()`
+processa apenas as linhas com id acima da marca d'água guardada em
+feedback_rollup_state; o escritor em segundo plano chama-a no mesmo commit
+em que grava o feedback.
+"""
+import re
+import sqlite3
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+MIN_KEYWORD_LEN = 4
+_WORDS = re.compile(r'\b\w+\b')
+
+def ensure_schema(conn: sqlite3.Connection):
+    """Cria as tabelas de agregados, a marca d'água e os índices da tabela feedback."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS feedback_daily (
+            day TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            positive INTEGER NOT NULL DEFAULT 0,
+            negative INTEGER NOT NULL DEFAULT 0,
+            corrections INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, user_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS feedback_error_daily (
+            day TEXT NOT NULL,
+            error_type TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (day, error_type)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS feedback_keyword_daily (
+            day TEXT NOT NULL,
+            keyword TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (day, keyword)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS feedback_rollup_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_feedback_id INTEGER NOT NULL
+        )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO feedback_rollup_state (id, last_feedback_id) VALUES (1, 0)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_feedback_timestamp ON feedback (timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_feedback_rating_timestamp ON feedback (rating, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_feedback_user_rating ON feedback (user_id, rating, timestamp)")
+
+def classify_error_type(bot_response: str, correction: str) -> str:
+    """Classifica o tipo de erro baseado na resposta e correção"""
+    bot_lower = bot_response.lower()
+    correction_lower = correction.lower()
+
+    if "não sei" in bot_lower or "não encontrei" in bot_lower:
+        return "Falta de conhecimento"
+    elif "erro" in bot_lower or "desculpe" in bot_lower:
+        return "Erro de processamento"
+    elif len(correction) > len(bot_response) * 2:
+        return "Resposta incompleta"
+    elif any(word in correction_lower for word in ["ramal", "telefone", "contato"]):
+        return "Informação de contato incorreta"
+    elif any(word in correction_lower for word in ["prazo", "data", "quando"]):
+        return "Informação temporal incorreta"
+    else:
+        return "Informação factual incorreta"
+
+def query_keywords(user_query: str) -> List[str]:
+    """Palavras da pergunta com mais de 3 letras (os tópicos contados nos relatórios)."""
+    return [word for word in _WORDS.findall(user_query.lower()) if len(word) >= MIN_KEYWORD_LEN]
+
+def _aggregate(rows: Iterable[Tuple]) -> Tuple[Dict, Counter, Counter, int, int]:
+    """Agrega linhas (id, user_id, pergunta, resposta, rating, correção, dia) lidas de um cursor."""
+    daily: Dict[Tuple[str, int], List[int]] = {}
+    errors: Counter = Counter()
+    keywords: Counter = Counter()
+    last_id = 0
+    count = 0
+    for feedback_id, user_id, user_query, bot_response, rating, correction, day in rows:
+        last_id = feedback_id
+        count += 1
+        counts = daily.setdefault((day, user_id), [0, 0, 0])
+        if rating == 1:
+            counts[0] += 1
+        elif rating == -1:
+            counts[1] += 1
+            if correction is not None:
+                counts[2] += 1
+                errors[(day, classify_error_type(bot_response or "", correction))] += 1
+                for word in query_keywords(user_query or ""):
+                    keywords[(day, word)] += 1
+    return daily, errors, keywords, last_id, count
+
+def catch_up(conn: sqlite3.Connection, chunk_size: int = 10000) -> int:
+    """Incorpora nos agregados o feedback novo desde a última execução; devolve quantas linhas processou.
+
+    Tem de correr dentro de uma transação de escrita (o escritor já a tem;
+    os outros chamadores usam BEGIN IMMEDIATE), para que dois processos não
+    contem as mesmas linhas.
+    """
+    processed = 0
+    while True:
+        last_id = conn.execute("SELECT last_feedback_id FROM feedback_rollup_state WHERE id = 1").fetchone()[0]
+        cursor = conn.execute('''
+            SELECT id, user_id, user_query, bot_response, rating, correction, substr(timestamp, 1, 10)
+            FROM feedback WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, chunk_size))
+        daily, errors, keywords, new_last_id, rows = _aggregate(cursor)
+        if not rows:
+            return processed
+        conn.executemany('''
+            INSERT INTO feedback_daily (day, user_id, positive, negative, corrections) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(day, user_id) DO UPDATE SET positive = positive + excluded.positive,
+                negative = negative + excluded.negative, corrections = corrections + excluded.corrections
+        ''', [(day, user_id, *counts) for (day, user_id), counts in daily.items()])
+        conn.executemany('''
+            INSERT INTO feedback_error_daily (day, error_type, count) VALUES (?, ?, ?)
+            ON CONFLICT(day, error_type) DO UPDATE SET count = count + excluded.count
+        ''', [(day, error_type, count) for (day, error_type), count in errors.items()])
+        conn.executemany('''
+            INSERT INTO feedback_keyword_daily (day, keyword, count) VALUES (?, ?, ?)
+            ON CONFLICT(day, keyword) DO UPDATE SET count = count + excluded.count
+        ''', [(day, keyword, count) for (day, keyword), count in keywords.items()])
+        conn.execute("UPDATE feedback_rollup_state SET last_feedback_id = ? WHERE id = 1", (new_last_id,))
+        processed += rows
+        if rows < chunk_size:
+            return processed
+
+def refresh(conn: sqlite3.Connection) -> int:
+    """catch_up() numa transação própria, para quem não está dentro do escritor."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        processed = catch_up(conn)
+        conn.commit()
+        return processed
+    except Exception:
+        conn.rollback()
+        raise
@@ -1,19 +1,172 @@
 # -*- coding: utf-8 -*-
+import contextvars
+import hashlib
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
-from typing import Dict, List, Any
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional
 from dotenv import load_dotenv
 import re
 
+from metrics import HTTP_REQUESTS, HTTP_SECONDS, endpoint_label
+import tracing
+from ttl_cache import TTLCache
+
 load_dotenv()
 
+GCLICK_POOL_SIZE = int(os.environ.get("GCLICK_POOL_SIZE", "10"))
+GCLICK_MAX_RETRIES = int(os.environ.get("GCLICK_MAX_RETRIES", "2"))
+GCLICK_RETRY_BACKOFF = float(os.environ.get("GCLICK_RETRY_BACKOFF", "0.3"))
+
+# Timeouts (connect, read) por prefixo de endpoint; o prefixo mais longo vence.
+ENDPOINT_TIMEOUTS = {
+    "/oauth/token": (3.05, 10),
+    "/clientes/search": (3.05, 15),
+    "/clientes": (3.05, 10),
+}
+DEFAULT_TIMEOUT = (3.05, 30)
+
+CLIENT_CACHE_SIZE = int(os.environ.get("GCLICK_CLIENT_CACHE_SIZE", "1024"))
+CLIENT_CACHE_TTL = float(os.environ.get("GCLICK_CLIENT_CACHE_TTL", "600"))
+
+# Fichas de cliente (GET /clientes/{id}) partilhadas por todos os get_client_*.
+client_cache = TTLCache(maxsize=CLIENT_CACHE_SIZE, ttl=CLIENT_CACHE_TTL)
+
+GCLICK_SEARCH_WORKERS = int(os.environ.get("GCLICK_SEARCH_WORKERS", "8"))
+
+# Pool limitado para disparar as variações de grafia em paralelo.
+_search_executor = ThreadPoolExecutor(max_workers=GCLICK_SEARCH_WORKERS, thread_name_prefix="gclick-search")
+
+# Relatórios recentes de latência por variação (ver search_reports()).
+_search_reports = deque(maxlen=100)
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_http_session() -> requests.Session:
+    """Sessão HTTP partilhada (keep-alive + pool) para todo o tráfego do G-Click.
+
+    O retry com backoff só se aplica a GETs (idempotentes); POSTs nunca são repetidos.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retry = Retry(
+                    total=GCLICK_MAX_RETRIES,
+                    backoff_factor=GCLICK_RETRY_BACKOFF,
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    allowed_methods=frozenset(["GET"]),
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=GCLICK_POOL_SIZE, max_retries=retry, pool_block=True)
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+def _timeout_for(endpoint: str) -> tuple:
+    matches = [prefix for prefix in ENDPOINT_TIMEOUTS if endpoint.startswith(prefix)]
+    return ENDPOINT_TIMEOUTS[max(matches, key=len)] if matches else DEFAULT_TIMEOUT
+
 def _format_cnpj(cnpj: str) -> str:
     """Formata uma string de CNPJ para o padrão 00.000.000/0000-00."""
     if not cnpj or not cnpj.isdigit() or len(cnpj) != 14:
         return cnpj
     return f"{cnpj[:2]}.{cnpj[2:5]}.{cnpj[5:8]}/{cnpj[8:12]}-{cnpj[12:]}"
 
+class TokenManager:
+    """Cache do token OAuth do G-Click, partilhado por todo o processo.
+
+    O token é reutilizado até `refresh_margin` segundos antes do `expires_in`.
+    A renovação é single-flight: apenas uma thread faz o POST em /oauth/token,
+    as restantes esperam pelo lock e reaproveitam o token novo.
+    """
+
+    def __init__(self, token_url: str, client_id: str, client_secret: str, refresh_margin: int = 60):
+        self.token_url = token_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._stats = {"hits": 0, "misses": 0, "refreshes": 0, "failures": 0, "invalidations": 0}
+
+    def _is_valid(self) -> bool:
+        return self._token is not None and time.monotonic() < self._expires_at - self.refresh_margin
+
+    def get_token(self) -> str:
+        """Devolve um token válido, renovando-o apenas quando necessário."""
+        if self._is_valid():
+            self._stats["hits"] += 1
+            return self._token
+        with self._lock:
+            # Outra thread pode ter renovado o token enquanto esperávamos pelo lock.
+            if self._is_valid():
+                self._stats["hits"] += 1
+                return self._token
+            self._stats["misses"] += 1
+            return self._refresh()
+
+    def _refresh(self) -> str:
+        data = {'client_id': self.client_id, 'client_secret': self.client_secret, 'grant_type': 'client_credentials'}
+        try:
+            response = get_http_session().post(self.token_url, data=data, timeout=_timeout_for("/oauth/token"))
+            response.raise_for_status()
+            payload = response.json()
+        except Exception:
+            self._stats["failures"] += 1
+            raise
+        self._stats["refreshes"] += 1
+        self._token = payload.get('access_token')
+        try:
+            expires_in = float(payload.get('expires_in') or 0)
+        except (TypeError, ValueError):
+            expires_in = 0
+        # Sem expires_in conhecido, o token é usado uma única vez (comportamento anterior).
+        self._expires_at = time.monotonic() + expires_in if expires_in else 0.0
+        return self._token
+
+    def invalidate(self, token: Optional[str] = None):
+        """Descarta o token em cache (ex.: após um 401). Ignora se já foi trocado."""
+        with self._lock:
+            if token is None or token == self._token:
+                self._token = None
+                self._expires_at = 0.0
+                self._stats["invalidations"] += 1
+
+    def stats(self) -> Dict:
+        return dict(self._stats)
+
+
+_token_managers: Dict[tuple, TokenManager] = {}
+_token_managers_lock = threading.Lock()
+
+def get_token_manager(base_url: str, client_id: str, client_secret: str) -> TokenManager:
+    """Devolve o TokenManager do processo para estas credenciais."""
+    key = (base_url, client_id)
+    with _token_managers_lock:
+        manager = _token_managers.get(key)
+        if manager is None:
+            manager = TokenManager(f"{base_url}/oauth/token", client_id, client_secret)
+            _token_managers[key] = manager
+        return manager
+
+def _record_http_retries(service: str, response):
+    """Passa para o trace do turno as repetições feitas pelo Retry do urllib3 neste pedido."""
+    retries = getattr(getattr(response, "raw", None), "retries", None)
+    for attempt in getattr(retries, "history", None) or ():
+        reason = attempt.status if attempt.status else type(attempt.error).__name__
+        tracing.record_retry(service, f"{attempt.method} {endpoint_label(attempt.url or '')}: {reason}")
+
 class GClickAutomation:
     """Cliente para automação de processos no G-Click."""
     
@@ -21,30 +174,120 @@ class GClickAutomation:
         self.client_id = os.environ.get("GCLICK_CLIENT_ID")
         self.client_secret = os.environ.get("GCLICK_CLIENT_SECRET")
         self.base_url = "https://api.gclick.com.br"
+        self.session = get_http_session()
+        self.directory = None  # ClientDirectory local, anexado por attach_directory()
         
         if not self.client_id or not self.client_secret:
             print("ERRO CRÍTICO: Credenciais G-Click não encontradas no arquivo .env")
+        self.token_manager = get_token_manager(self.base_url, self.client_id, self.client_secret)
 
     def _get_access_token(self) -> str:
-        data = {'client_id': self.client_id, 'client_secret': self.client_secret, 'grant_type': 'client_credentials'}
-        response = requests.post(f"{self.base_url}/oauth/token", data=data, timeout=10)
-        response.raise_for_status()
-        return response.json().get('access_token')
+        return self.token_manager.get_token()
+
+    def token_stats(self) -> Dict:
+        """Contadores de hit/miss/refresh do token OAuth."""
+        return self.token_manager.stats()
     
     def _make_request(self, method: str, endpoint: str, data: Dict = None, params: Dict = None) -> Any:
+        started = time.perf_counter()
+        outcome = "error"
         try:
+            url = f"{self.base_url}{endpoint}"
             token = self._get_access_token()
+            timeout = _timeout_for(endpoint)
             headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-            url = f"{self.base_url}{endpoint}"
-            response = requests.request(method.upper(), url, headers=headers, params=params, json=data, timeout=30)
+            response = self.session.request(method.upper(), url, headers=headers, params=params, json=data, timeout=timeout)
+            _record_http_retries("gclick", response)
+            if response.status_code == 401:
+                # Token revogado ou expirado antes do previsto: renova e tenta uma única vez.
+                tracing.record_retry("gclick", f"401 em {endpoint_label(endpoint)}: token renovado")
+                self.token_manager.invalidate(token)
+                token = self._get_access_token()
+                headers["Authorization"] = f"Bearer {token}"
+                response = self.session.request(method.upper(), url, headers=headers, params=params, json=data, timeout=timeout)
+                _record_http_retries("gclick", response)
             response.raise_for_status()
+            outcome = "ok"
             return response.json() if response.content else {"success": True}
         except Exception as e:
             print(f"ERRO na chamada à API G-CLICK: {e}")
             return {"error": str(e)}
+        finally:
+            HTTP_SECONDS.observe(time.perf_counter() - started, service="gclick", endpoint=endpoint_label(endpoint))
+            HTTP_REQUESTS.inc(service="gclick", outcome=outcome)
+
+    def attach_directory(self, directory):
+        """Passa a responder as buscas pelo diretório local, com a API como fallback."""
+        self.directory = directory
+
+    def list_all_clients(self, page_size: int = 200) -> Optional[List[Dict]]:
+        """Lista todos os clientes (id, nome, inscricao), percorrendo as páginas da API.
+
+        Devolve None se alguma página falhar: uma lista parcial apagaria do
+        diretório local os clientes das páginas em falta.
+        """
+        clients = []
+        page = 0
+        while True:
+            result = self._make_request("GET", "/clientes", params={'page': page, 'size': page_size})
+            if isinstance(result, dict) and "error" in result:
+                return None
+            if not result:
+                return clients  # Página vazia: o total era múltiplo de page_size.
+            if isinstance(result, list):
+                data_list = result
+            else:
+                data_list = result.get("content") or next((v for v in result.values() if isinstance(v, list)), [])
+            clients.extend({"id": c.get("id"), "nome": c.get("nome"), "inscricao": c.get("inscricao")} for c in data_list if isinstance(c, dict))
+            last_page = isinstance(result, dict) and result.get("last")
+            if last_page or len(data_list) < page_size:
+                return clients
+            page += 1
 
     def search_clients_by_text(self, search_text: str) -> List[Dict]:
         """Busca clientes de forma inteligente, tentando múltiplas variações e filtrando por relevância."""
+        if self.directory is not None and re.fullmatch(r'[\d./\-\s]+', search_text or '') \
+                and len(re.sub(r'\D', '', search_text)) in (11, 14):
+            client = self.directory.find_by_cnpj(search_text)
+            if client:
+                return [client]
+        if self.directory is not None and not self.directory.is_stale():
+            local_results = self.directory.search(search_text)
+            if local_results:
+                return local_results
+        return self._search_clients_remote(search_text)
+
+    def find_client_by_cnpj(self, cnpj: str) -> Dict:
+        """Encontra o cliente exato a partir do CNPJ ou CPF (com ou sem formatação)."""
+        digits = re.sub(r'\D', '', cnpj or '')
+        if len(digits) not in (11, 14):
+            return {"error": "CNPJ/CPF inválido. Informe os 14 dígitos do CNPJ ou os 11 do CPF."}
+        client = self.directory.find_by_cnpj(digits) if self.directory is not None else None
+        if not client:
+            # Diretório por sincronizar, desatualizado ou sem este cliente: confirma na API
+            # antes de responder que não existe (o modelo não tenta variações de números).
+            client = self._find_client_by_cnpj_remote(digits)
+        if not client:
+            return {"error": f"Nenhuma empresa encontrada com a inscrição {_format_cnpj(digits)}."}
+        return client
+
+    def _find_client_by_cnpj_remote(self, digits: str) -> Optional[Dict]:
+        """Uma única busca na API pelos dígitos, aceitando só o cliente com essa inscrição exata."""
+        results = self._make_request("GET", "/clientes/search", params={'texto': digits})
+        if isinstance(results, dict):
+            results = results.get("content") or []
+        for c in results if isinstance(results, list) else []:
+            if isinstance(c, dict) and re.sub(r'\D', '', str(c.get("inscricao") or '')) == digits:
+                return {"id": c.get("id"), "nome": c.get("nome"), "inscricao": _format_cnpj(digits)}
+        return None
+
+    def _search_clients_remote(self, search_text: str) -> List[Dict]:
+        """Busca na API do G-Click, disparando as variações de grafia em paralelo.
+
+        O resultado é determinístico: vence a primeira variação, pela ordem de
+        prioridade, que tiver resultados filtrados; as restantes são canceladas
+        ou ignoradas.
+        """
         
         def _filter_and_format(results, query):
             if not isinstance(results, list):
@@ -69,16 +312,30 @@ class GClickAutomation:
             re.sub(r'[.\s]', '', search_text),
             re.sub(r'[\s.-/]', '', search_text)
         ]
-        search_variations = list(dict.fromkeys(search_variations))
+        search_variations = [term for term in dict.fromkeys(search_variations) if term]
 
-        for term in search_variations:
-            if not term: continue
+        def _timed_search(term):
+            start = time.perf_counter()
             results = self._make_request("GET", "/clientes/search", params={'texto': term})
-            filtered_results = _filter_and_format(results, search_text)
-            if filtered_results:
-                return filtered_results
+            return results, (time.perf_counter() - start) * 1000
 
-        return []
+        # Cada busca corre numa cópia do contexto do pedido: sem isto o tempo HTTP
+        # e os retries não chegam ao detalhe do pedido (Server-Timing) nem ao trace.
+        futures = [_search_executor.submit(contextvars.copy_context().run, _timed_search, term) for term in search_variations]
+        report = {"query": search_text, "variations": [], "winner": None}
+        try:
+            for term, future in zip(search_variations, futures):
+                results, elapsed_ms = future.result()
+                report["variations"].append({"term": term, "ms": round(elapsed_ms, 1)})
+                filtered_results = _filter_and_format(results, search_text)
+                if filtered_results:
+                    report["winner"] = term
+                    return filtered_results
+            return []
+        finally:
+            for future in futures:
+                future.cancel()
+            _search_reports.append(report)
 
     def list_client_responsibles(self, client_id: int) -> List[Dict]:
         endpoint = f"/clientes/{int(client_id)}/responsaveis"
@@ -87,9 +344,44 @@ class GClickAutomation:
         data_list = result if isinstance(result, list) else next((v for v in result.values() if isinstance(v, list)), [])
         return [{"nome": r.get("nome"), "cargo": r.get("cargo", {}).get("nome", "N/A")} for r in data_list if isinstance(r, dict) and r.get("nome")]
 
+    def _get_client_details(self, client_id: int) -> Any:
+        """Ficha do cliente, servida do cache quando disponível. Erros não são guardados."""
+        client_id = int(client_id)
+        client_details = client_cache.get(client_id)
+        if client_details is not None:
+            return client_details
+        client_details = self._make_request("GET", f"/clientes/{client_id}")
+        if client_details and not (isinstance(client_details, dict) and "error" in client_details):
+            client_cache.set(client_id, client_details)
+        return client_details
+
+    def invalidate_client(self, client_id: int = None):
+        """Descarta a ficha de um cliente do cache (ou todas, sem argumento)."""
+        if client_id is None:
+            client_cache.invalidate()
+        else:
+            client_cache.invalidate(int(client_id))
+
+    def record_version(self, client_id: int) -> Optional[str]:
+        """Impressão digital da ficha atual do cliente (None se indisponível).
+
+        Muda quando a ficha no G-Click muda (após expirar do cache ou ser
+        invalidada); o cache de respostas usa-a para descartar respostas antigas.
+        """
+        client_details = self._get_client_details(client_id)
+        if not client_details or isinstance(client_details, dict) and "error" in client_details:
+            return None
+        return hashlib.sha1(json.dumps(client_details, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def search_reports(self) -> List[Dict]:
+        """Latência por variação das buscas remotas mais recentes."""
+        return list(_search_reports)
+
+    def client_cache_stats(self) -> Dict:
+        return client_cache.stats()
+
     def get_client_group(self, client_id: int) -> str:
-        endpoint = f"/clientes/{int(client_id)}"
-        client_details = self._make_request("GET", endpoint)
+        client_details = self._get_client_details(client_id)
         if not client_details or isinstance(client_details, dict) and "error" in client_details:
              return "Não foi possível obter os detalhes da empresa."
         if 'grupos' in client_details and isinstance(client_details['grupos'], list) and client_details['grupos']:
@@ -98,15 +390,13 @@ class GClickAutomation:
         return "Não possui um regime tributário associado."
 
     def get_client_contacts(self, client_id: int) -> Dict:
-        endpoint = f"/clientes/{int(client_id)}"
-        client_details = self._make_request("GET", endpoint)
+        client_details = self._get_client_details(client_id)
         if not client_details or isinstance(client_details, dict) and "error" in client_details:
             return {"error": "Não foi possível obter os detalhes da empresa."}
         return { "telefones": client_details.get("telefones", []), "emails": client_details.get("emails", []) }
     
     def get_client_address(self, client_id: int) -> Dict:
-        endpoint = f"/clientes/{int(client_id)}"
-        client_details = self._make_request("GET", endpoint)
+        client_details = self._get_client_details(client_id)
         if not client_details or isinstance(client_details, dict) and "error" in client_details:
             return {"error": "Não foi possível obter os detalhes da empresa."}
         return client_details.get("endereco", {})
\ No newline at end of file
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+from typing import Dict, List, Tuple
+
+TOKEN_BUDGET = int(os.environ.get("JARVIS_HISTORY_TOKEN_BUDGET", "8000"))
+KEEP_RECENT_TURNS = int(os.environ.get("JARVIS_HISTORY_RECENT_TURNS", "4"))
+SUMMARY_CHARS = 240
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(contents) -> int:
+    """Estimativa barata de tokens: ~4 bytes serializados por token."""
+    return sum(type(content).pb(content).ByteSize() for content in contents) // CHARS_PER_TOKEN
+
+def _summarize_payload(response: Dict) -> str:
+    result = response.get("result", response)
+    if isinstance(result, list):
+        names = [str(item.get("nome")) for item in result if isinstance(item, dict) and item.get("nome")]
+        summary = f"{len(result)} resultado(s)"
+        if names:
+            summary += ": " + ", ".join(names[:5]) + (" …" if len(names) > 5 else "")
+    else:
+        summary = json.dumps(result, ensure_ascii=False, default=str)
+    return summary[:SUMMARY_CHARS]
+
+def _compact_content(content):
+    """Substitui payloads de ferramentas por um resumo, mantendo o par call/response."""
+    from google.generativeai import protos  # import tardio: só há conteúdo a compactar depois de uma chamada ao Gemini
+    parts = []
+    changed = False
+    for part in content.parts:
+        if part.function_response.name:
+            response = type(part.function_response).to_dict(part.function_response).get("response") or {}
+            if response.keys() == {"resumo"}:
+                parts.append(part)
+                continue
+            parts.append(protos.Part(function_response=protos.FunctionResponse(
+                name=part.function_response.name, response={"resumo": _summarize_payload(response)}
+            )))
+            changed = True
+        else:
+            parts.append(part)
+    return (protos.Content(role=content.role, parts=parts), True) if changed else (content, False)
+
+def _split_turns(contents) -> List[List]:
+    """Agrupa o histórico em turnos, cada um começando numa mensagem de texto do utilizador."""
+    turns = []
+    for content in contents:
+        starts_turn = content.role == "user" and any(part.text for part in content.parts)
+        if starts_turn or not turns:
+            turns.append([content])
+        else:
+            turns[-1].append(content)
+    return turns
+
+class HistoryManager:
+    """Mantém o histórico do chat dentro de um orçamento de tokens.
+
+    O prompt de sistema e os turnos mais recentes ficam intactos; os turnos
+    antigos têm os payloads das ferramentas resumidos e, se ainda assim o
+    orçamento for excedido, são descartados do mais antigo para o mais novo.
+    """
+
+    def __init__(self, token_budget: int = TOKEN_BUDGET, keep_recent_turns: int = KEEP_RECENT_TURNS):
+        self.token_budget = token_budget
+        self.keep_recent_turns = keep_recent_turns
+        self._lock = threading.Lock()
+        self._stats = {"turns": 0, "compactions": 0, "dropped_turns": 0, "tokens_before": 0, "tokens_after": 0}
+        self.last_report: Dict = {}
+
+    def compact(self, history, base_len: int) -> Tuple[list, Dict]:
+        """Devolve (histórico, relatório). O histórico só é uma nova lista se algo mudou."""
+        base, rest = list(history[:base_len]), list(history[base_len:])
+        tokens_before = estimate_tokens(history)
+        tokens_after = tokens_before
+        dropped = 0
+        changed = False
+
+        if tokens_before > self.token_budget:
+            turns = _split_turns(rest)
+            split = max(len(turns) - self.keep_recent_turns, 0)
+            old_turns, recent_turns = turns[:split], turns[split:]
+            compacted_old = []
+            for turn in old_turns:
+                new_turn = []
+                for content in turn:
+                    new_content, content_changed = _compact_content(content)
+                    changed = changed or content_changed
+                    new_turn.append(new_content)
+                compacted_old.append(new_turn)
+
+            fixed_tokens = estimate_tokens(base) + sum(estimate_tokens(turn) for turn in recent_turns)
+            old_tokens = [estimate_tokens(turn) for turn in compacted_old]
+            while compacted_old and fixed_tokens + sum(old_tokens) > self.token_budget:
+                compacted_old.pop(0)
+                old_tokens.pop(0)
+                dropped += 1
+                changed = True
+
+            if changed:
+                rest = [content for turn in compacted_old + recent_turns for content in turn]
+                history = base + rest
+                tokens_after = fixed_tokens + sum(old_tokens)
+
+        report = {"tokens_before": tokens_before, "tokens_after": tokens_after, "dropped_turns": dropped, "compacted": changed}
+        with self._lock:
+            self._stats["turns"] += 1
+            self._stats["compactions"] += int(changed)
+            self._stats["dropped_turns"] += dropped
+            self._stats["tokens_before"] += tokens_before
+            self._stats["tokens_after"] += tokens_after
+            self.last_report = report
+        return history, report
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+        turns = stats["turns"] or 1
+        stats["avg_tokens_before"] = stats["tokens_before"] // turns
+        stats["avg_tokens_after"] = stats["tokens_after"] // turns
+        stats["token_budget"] = self.token_budget
+        return stats
+
+
+history_manager = HistoryManager()
@@ -32,6 +32,10 @@ cursor.execute('''
 ''')
 print("Tabela 'knowledge_base' verificada.")
 
+from knowledge_store import ensure_schema as ensure_knowledge_schema
+ensure_knowledge_schema(conn)
+print("Tabela 'knowledge_meta' verificada.")
+
 # --- Tabela de Atalhos ---
 cursor.execute('''
     CREATE TABLE IF NOT EXISTS shortcuts (
@@ -56,7 +60,14 @@ cursor.execute('''
         FOREIGN KEY (user_id) REFERENCES users (id)
     )
 ''')
-print("Tabela 'conversation_history' verificada.")
+from persistence import ensure_schema as ensure_history_schema
+ensure_history_schema(conn)
+print("Tabelas 'conversation_history' e 'turn_traces' verificadas.")
+
+# --- Estado Persistido dos Cérebros ---
+from brain_pool import ensure_schema as ensure_brain_state_schema
+ensure_brain_state_schema(conn)
+print("Tabela 'brain_state' verificada.")
 
 # --- Tabela de Feedback ---
 cursor.execute('''
@@ -74,6 +85,21 @@ cursor.execute('''
 ''')
 print("Tabela 'feedback' verificada.")
 
+# --- Agregados diários do feedback (índices + preenchimento a partir das linhas existentes) ---
+import feedback_rollups
+feedback_rollups.ensure_schema(conn)
+conn.commit()
+print(f"Agregados de feedback verificados ({feedback_rollups.refresh(conn)} linhas novas incorporadas).")
+
+# --- Embeddings das correções (busca por semelhança) ---
+import feedback_embeddings
+print(f"Embeddings de correções verificados ({feedback_embeddings.backfill(conn)} calculados).")
+
+# --- Diretório Local de Clientes (espelho do G-Click com índice FTS5) ---
+from client_directory import ensure_schema as ensure_client_directory_schema
+ensure_client_directory_schema(conn)
+print("Tabelas 'client_directory' verificadas.")
+
 # --- Migração de Dados do JSON (se necessário) ---
 try:
     with open('knowledge_base.json', 'r', encoding='utf-8') as f:
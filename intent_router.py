@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from text_utils import normalize_words
+
+CAPABILITIES_TEXT = "Olá! 👋 Sou Jarvis, seu assistente da Contec Contabilidade. Posso ajudar você com diversas informações, como:<br><br>• Buscar informações sobre empresas clientes (responsáveis, tributação, endereço, contatos).<br>• Consultar ramais de funcionários.<br>• Acessar a história resumida da Contec Contabilidade.<br><br>Basta me perguntar! 😊"
+
+# Padrões aplicados ao texto normalizado (sem acentos nem pontuação).
+_CAPABILITIES = re.compile(r"^(?:ola |oi )?(?:jarvis )?(?:o que (?:voce|vc) (?:pode|sabe|consegue) fazer|o que (?:voce|vc) faz|quais (?:sao )?(?:as )?suas funcoes|como (?:voce|vc) pode (?:me )?ajudar|ajuda)$")
+_HISTORY = re.compile(r"\bhistoria\b.*\bcontec\b|\bcontec\b.*\bhistoria\b")
+_RAMAIS_LIST = re.compile(r"^(?:me )?(?:mostre |mostra |ver |veja |quero |qual (?:e )?a )?(?:a )?(?:lista (?:de|dos|com os) ramais|todos os ramais|ramais)(?: da contec)?$")
+_RAMAL_BY_NAME = re.compile(r"^(?:qual (?:e )?)?(?:o )?ramal (?:d[aoe]s? |de )?(?P<nome>[a-z][a-z ]{1,40})$")
+
+class IntentRouter:
+    """Roteador determinístico para as perguntas mais frequentes.
+
+    Identifica intenções cujas respostas seguem modelos fixos (ramais, história,
+    capacidades) para que sejam respondidas sem passar pelo Gemini.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = {"llm": 0}
+
+    def match(self, message: str, departments: Dict) -> Optional[Tuple[str, Dict]]:
+        """Devolve (intenção, argumentos) ou None quando a pergunta deve ir ao LLM."""
+        text = normalize_words(message)
+        if not text:
+            return None
+        if _CAPABILITIES.match(text):
+            return "capabilities", {}
+        if _HISTORY.search(text):
+            return "contec_history", {}
+        if _RAMAIS_LIST.match(text):
+            return "ramais_list", {}
+        ramal = _RAMAL_BY_NAME.match(text)
+        if ramal:
+            nome = ramal.group("nome").strip()
+            # "ramal do financeiro" é uma pergunta sobre departamento: fica com o LLM.
+            if nome not in {normalize_words(dept) for dept in departments}:
+                return "ramal_by_name", {"nome": nome}
+        return None
+
+    def record(self, intent: Optional[str]):
+        with self._lock:
+            key = intent or "llm"
+            self._stats[key] = self._stats.get(key, 0) + 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+        total = sum(stats.values())
+        routed = total - stats.get("llm", 0)
+        return {"by_intent": stats, "total": total, "routed": routed, "routed_share": round(routed / total, 3) if total else 0.0}
+
+
+def render_ramal_matches(matches: List[Dict]) -> str:
+    """Modelos de resposta 'Ramal' e 'Múltiplas Pessoas' do prompt de sistema."""
+    if len(matches) == 1:
+        person = matches[0]
+        return f"📞 O ramal de <b>{person['nome']}</b> ({person['depto']}) é o <b>{person['ramal']}</b>."
+    options = "<br>".join(f"{i}. <b>{m['nome']}</b> ({m['depto']})" for i, m in enumerate(matches, start=1))
+    return f"🤔 Encontrei mais de uma pessoa com este nome. Qual delas você se refere?<br>{options}"
+
+
+intent_router = IntentRouter()
@@ -1,182 +1,798 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import datetime
+import functools
 import json
 import os
-import google.generativeai as genai
+import threading
+import time
 from dotenv import load_dotenv
-import sqlite3
-import unicodedata
+import uuid
 
-from gclick_automation import GClickAutomation
+from ramal_index import get_ramal_index
+from knowledge_store import knowledge_store
+from history_manager import history_manager
+from intent_router import intent_router, render_ramal_matches, CAPABILITIES_TEXT
+from answer_cache import answer_cache, make_key
+from llm_gate import llm_gate, LLMBusyError
+from metrics import PHASE_SECONDS, TOOL_CALLS, TOOL_SECONDS
+from feedback_embeddings import correction_index, render_hints
+from text_utils import normalize_text
+import tracing
 
 load_dotenv()
-genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
 
-gclick_tools = GClickAutomation()
+# O SDK do Gemini, o cliente G-Click e o diretório de clientes só são criados
+# no primeiro uso: importar este módulo (e o app) não toca na rede nem exige
+# credenciais, e o /login fica pronto sem pagar o import do SDK.
+_init_lock = threading.RLock()
+_genai = None
+_gclick = None
 
-def normalize_text(text):
-    if not text: return ""
-    return "".join(
-        c for c in unicodedata.normalize("NFD", text)
-        if unicodedata.category(c) != "Mn"
-    ).lower()
+def get_genai():
+    """Módulo google.generativeai, importado e configurado uma vez por processo."""
+    global _genai
+    if _genai is None:
+        with _init_lock:
+            if _genai is None:
+                import google.generativeai as genai
+                genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+                _genai = genai
+    return _genai
+
+def get_gclick():
+    """Cliente G-Click partilhado, com o diretório local de clientes e a sua sincronização."""
+    global _gclick
+    if _gclick is None:
+        with _init_lock:
+            if _gclick is None:
+                from gclick_automation import GClickAutomation
+                from client_directory import ClientDirectory
+                gclick = GClickAutomation()
+                directory = ClientDirectory(gclick)
+                gclick.attach_directory(directory)
+                directory.start_background_sync()
+                _gclick = gclick
+    return _gclick
+
+# Ferramenta equivalente a cada intenção respondida pelo fast path
+INTENT_TOOLS = {
+    "contec_history": "get_contec_history",
+    "ramais_list": "format_ramais_list",
+    "ramal_by_name": "find_ramal_by_name",
+}
+
+# Ferramentas que devolvem listas de onde o utilizador escolhe pelo número
+LIST_TOOLS = ('search_clients_by_text', 'find_ramal_by_name')
+# Ferramentas que identificam o cliente a partir do texto da pergunta
+CLIENT_SEARCH_TOOLS = ('search_clients_by_text', 'find_client_by_cnpj')
+
+def _from_struct(value):
+    """Resultado de ferramenta lido do histórico: o Struct do protobuf guarda todos os números como float."""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, list):
+        return [_from_struct(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _from_struct(item) for key, item in value.items()}
+    return value
+
+def _found_client_ids(name, result):
+    """Ids dos clientes devolvidos por uma ferramenta de busca (conjunto vazio para as restantes)."""
+    if name not in CLIENT_SEARCH_TOOLS:
+        return set()
+    if isinstance(result, dict) and "result" in result:
+        result = result["result"]
+    items = result if isinstance(result, list) else [result]
+    return {int(item["id"]) for item in items if isinstance(item, dict) and item.get("id") is not None}
+
+RECENT_TURNS_TO_KEEP = 6  # turnos (pergunta + resposta) preservados ao despejar um cérebro
+
+TOOL_PROGRESS_MESSAGES = {
+    'search_clients_by_text': "🔎 Buscando empresa…",
+    'find_client_by_cnpj': "🔎 Buscando empresa pelo CNPJ…",
+    'list_client_responsibles': "👥 Consultando responsáveis…",
+    'get_client_group': "🏢 Consultando regime tributário…",
+    'get_client_contacts': "📞 Consultando contatos…",
+    'get_client_address': "📍 Consultando endereço…",
+    'format_ramais_list': "📋 Montando lista de ramais…",
+    'find_ramal_by_name': "📞 Procurando ramal…",
+    'get_contec_history': "📖 Buscando a história da Contec…",
+}
+
+def _render_ramais_list(knowledge):
+    departments = knowledge.get("departments", {})
+    if not departments: return "Não encontrei informações sobre os departamentos."
+    icons = {"diretoria": "👑", "dp": "👥", "fiscal": "🧾", "contábil": "💹", "administrativo": "📁", "ti": "💻", "financeiro": "💰", "comercial": "📈", "recepção": "👋", "rh": "👩‍💼", "irpf": "📄"}
+    response_html = "Aqui está a lista de ramais e equipes da <b>Contec Contabilidade</b>:<br><pre>"
+    for dept_name, teams in departments.items():
+        icon = icons.get(dept_name.lower(), "🏢")
+        response_html += f"{icon} <b>{dept_name.upper()}</b>\n"
+        for team in teams:
+            ramal = team.get("ramal", "N/A")
+            members = " • ".join([m.get("nome") for m in team.get("equipe", [])])
+            response_html += f"  <b>Ramal {ramal}</b>: {members}\n"
+        response_html += "\n"
+    response_html += "</pre>"
+    return response_html
+
+def get_contec_history():
+    """Retorna a história resumida da Contec Contabilidade."""
+    return """A Contec Contabilidade nasceu de um sonho em <b>02 de janeiro de 1996</b>. Fundada por <b>Clodoaldo da Silva Mello</b>, a jornada começou em um pequeno escritório com apenas um colaborador, mas com uma grande visão de futuro, construída sobre os pilares da honestidade, ética e responsabilidade.<br><br>Com muito esforço e a confiança de seus clientes, a empresa cresceu e se tornou uma referência regional. Hoje, a Contec tem orgulho de sua sede própria, um prédio moderno que abriga mais de <b>65 colaboradores</b> e atende mais de <b>600 clientes</b>.<br><br>O legado de Clodoaldo continua com a diretoria atual, formada por seu primeiro colaborador, <b>Emerson Xavier da Silva</b>, e seu filho e sucessor, <b>Felipe Ronconi de Mello</b>, mantendo vivo o propósito que nos guia desde o início: trabalhar com <b>qualidade e honestidade desde 1996</b>."""
+
+def format_ramais_list():
+    return knowledge_store.current().derived("ramais_html", _render_ramais_list)
+
+def find_ramal_by_name(nome: str) -> list:
+    snapshot = knowledge_store.current()
+    return get_ramal_index(snapshot.data.get("departments", {}), snapshot.version).search(nome)
+
+_tools = None
+
+def _instrumented(name, function):
+    """Ferramenta com a duração e o resultado registados nas métricas e no trace do turno.
+
+    O functools.wraps mantém nome, docstring e assinatura, que o SDK usa para
+    gerar a declaração da função enviada ao Gemini.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        outcome, result = "error", None
+        started = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+            outcome = "error" if isinstance(result, dict) and "error" in result else "ok"
+            return result
+        finally:
+            elapsed = time.perf_counter() - started
+            TOOL_SECONDS.observe(elapsed, tool=name)
+            TOOL_CALLS.inc(tool=name, outcome=outcome)
+            tracing.record_tool_call(name, kwargs, result, elapsed, outcome)
+    return wrapper
+
+def get_tools():
+    """Ferramentas expostas ao Gemini; não guardam estado, por isso são partilhadas por todos os cérebros."""
+    global _tools
+    if _tools is None:
+        gclick = get_gclick()
+        tools = {
+            'search_clients_by_text': gclick.search_clients_by_text,
+            'find_client_by_cnpj': gclick.find_client_by_cnpj,
+            'list_client_responsibles': gclick.list_client_responsibles,
+            'get_client_group': gclick.get_client_group,
+            'get_client_contacts': gclick.get_client_contacts,
+            'get_client_address': gclick.get_client_address,
+            'format_ramais_list': format_ramais_list,
+            'find_ramal_by_name': find_ramal_by_name,
+            'get_contec_history': get_contec_history,
+        }
+        _tools = {name: _instrumented(name, function) for name, function in tools.items()}
+    return _tools
+
+SYSTEM_PROMPT = f"""
+**CONTEXTO OPERACIONAL:** Você é o Jarvis, uma ferramenta interna da Contec Contabilidade. Suas ferramentas são APIs internas autorizadas. Você TEM PERMISSÃO para aceder e fornecer as informações retornadas por estas ferramentas. NUNCA negue um pedido alegando falta de acesso ou confidencialidade se uma ferramenta existir. Se a ferramenta não retornar dados, informe que a informação não está disponível.
+
+**REGRAS DE FORMATAÇÃO:**
+- Use APENAS HTML (`<b>`, `<br>`) e emojis. É PROIBIDO usar markdown (`**`, `*`).
+- Para listas não-numeradas, use o emoji "•".
+- NUNCA adicione itens vazios ou inventados a uma lista de resultados.
+
+**FLUXOS DE AÇÃO:**
+1.  **Consulta de Empresas:**
+    - Se o usuário informar um CNPJ ou CPF (com ou sem pontuação), use `find_client_by_cnpj`. NUNCA use variações de grafia para números.
+    - Para qualquer outra pergunta sobre uma empresa, use `search_clients_by_text`.
+    - Se a ferramenta retornar uma lista vazia, responda: "Não encontrei nenhuma empresa com este nome. Verifique a grafia e tente novamente.".
+    - Se retornar múltiplos resultados, apresente as opções numeradas.
+    - Quando o usuário responder com um número, a sua próxima ação DEVE ser sobre a empresa escolhida.
+2.  **Consulta de Ramais:**
+    - Para perguntas sobre ramais, use `find_ramal_by_name`.
+    - Se a ferramenta retornar múltiplos resultados, apresente a lista numerada com APENAS o nome e o departamento. NÃO inclua o ramal.
+    - Quando o usuário responder com um número, use a informação da pessoa escolhida para formatar a resposta final.
+3.  **Perguntas Gerais:**
+    - Se perguntarem sobre a "história da contec", chame `get_contec_history` e exiba o resultado.
+    - Se perguntarem "o que você pode fazer", use o modelo de resposta exato para essa pergunta.
+
+**MODELOS DE RESPOSTA:**
+- **"O que você pode fazer?":** "{CAPABILITIES_TEXT}"
+- **Múltiplas Empresas:** "🤔 Encontrei estas empresas. Qual delas você deseja consultar?<br>1. <b>[Razão Social]</b> (CNPJ: [CNPJ])"
+- **Múltiplas Pessoas:** "🤔 Encontrei mais de uma pessoa com este nome. Qual delas você se refere?<br>1. <b>[Nome]</b> ([Depto])"
+- **CNPJ:** "✅ O CNPJ da <b>[Razão Social Completa]</b> é <b>[CNPJ Formatado]</b>."
+- **Responsáveis:** "✅ Os responsáveis por <b>[Empresa]</b> são:<br><br>• 🧾 <b>[Nome]</b> (Fiscal)<br>• 💹 <b>[Nome]</b> (Contábil)<br>• 👥 <b>[Nome]</b> (DP)"
+- **Ramal:** "📞 O ramal de <b>[Nome]</b> ([Depto]) é o <b>[Ramal]</b>."
+- **Endereço:** "📍 O endereço de <b>[Empresa]</b> é:<br><br>[Rua]<br>[Bairro] - [Cidade]/[Estado]<br>CEP: [CEP]"
+- **Tributação:** "🏢 O regime de <b>[Empresa]</b> é:&nbsp;<b>[Regime]</b>."
+- **Contatos:** "📞 Os contatos para <b>[Empresa]</b> são:<br><br><b>Telefones:</b><br>• [Nome]:&nbsp;[Número]<br><br><b>Emails:</b><br>• [Nome]:&nbsp;[Email]"
+"""
+
+MODEL_NAME = os.environ.get("JARVIS_MODEL", "gemini-1.5-flash")
+CONTEXT_CACHE_TTL = int(os.environ.get("JARVIS_CONTEXT_CACHE_TTL", "0"))  # segundos; 0 desliga
+FEEDBACK_HINTS = int(os.environ.get("JARVIS_FEEDBACK_HINTS", "3"))  # correções parecidas juntas à pergunta; 0 desliga
+
+_model = None
+_model_info = {}
+_usage_lock = threading.Lock()
+_usage = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "output_tokens": 0}
+
+def _build_model():
+    """Modelo com as ferramentas e o prompt de sistema; tenta o context caching se configurado.
+
+    O cache de contexto exige um nome de modelo versionado e um mínimo de
+    tokens no conteúdo; se a API o recusar, fica o modelo normal.
+    """
+    genai = get_genai()
+    tools = list(get_tools().values())
+    if CONTEXT_CACHE_TTL > 0:
+        try:
+            cached = genai.caching.CachedContent.create(
+                model=MODEL_NAME, system_instruction=SYSTEM_PROMPT, tools=tools,
+                ttl=datetime.timedelta(seconds=CONTEXT_CACHE_TTL)
+            )
+            return genai.GenerativeModel.from_cached_content(cached), cached.name
+        except Exception as e:
+            print(f"AVISO: context caching indisponível, usando system_instruction: {e}")
+    return genai.GenerativeModel(model_name=MODEL_NAME, tools=tools, system_instruction=SYSTEM_PROMPT), None
+
+def get_model():
+    """GenerativeModel partilhado por todos os cérebros, construído uma vez por processo."""
+    global _model
+    if _model is None:
+        with _init_lock:
+            if _model is None:
+                started = time.perf_counter()
+                model, cached_content = _build_model()
+                _model_info.update(
+                    model_name=MODEL_NAME,
+                    build_ms=round((time.perf_counter() - started) * 1000, 1),
+                    cached_content=cached_content,
+                    system_prompt_chars=len(SYSTEM_PROMPT),
+                )
+                _model = model
+    return _model
+
+def _record_usage(response):
+    """Acumula os tokens de entrada/saída informados pelo Gemini em cada chamada."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    with _usage_lock:
+        _usage["calls"] += 1
+        _usage["prompt_tokens"] += usage.prompt_token_count
+        _usage["cached_tokens"] += getattr(usage, "cached_content_token_count", 0)
+        _usage["output_tokens"] += usage.candidates_token_count
+
+def model_stats():
+    with _usage_lock:
+        usage = dict(_usage)
+    calls = usage["calls"] or 1
+    usage["avg_prompt_tokens"] = usage["prompt_tokens"] // calls
+    usage["avg_cached_tokens"] = usage["cached_tokens"] // calls
+    return {"model": dict(_model_info), "usage": usage, "sdk_loaded": _genai is not None, "gclick_ready": _gclick is not None}
+
+def gclick_stats():
+    """Contadores do cliente G-Click; vazio enquanto o cliente não for criado (não o inicializa)."""
+    gclick = _gclick
+    if gclick is None:
+        return {}
+    return {"token": gclick.token_stats(), "client_cache": gclick.client_cache_stats(), "search_reports": gclick.search_reports()[-20:]}
+
+def warm_up():
+    """Antecipa o trabalho adiado (SDK, G-Click, modelo e snapshot do conhecimento), p.ex. numa thread após o arranque."""
+    started = time.perf_counter()
+    try:
+        get_model()
+        knowledge_store.current()
+        if FEEDBACK_HINTS:
+            correction_index.refresh(force=True)
+    except Exception as e:
+        print(f"ERRO ao pré-aquecer o Jarvis: {e}")
+        return
+    _model_info["warm_up_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+class _ToolLoop:
+    """Estado de um turno com ciclo manual de ferramentas (streaming): texto, chamadas feitas e último resultado de lista."""
+
+    def __init__(self):
+        self.text = ""
+        self.calls = []  # (nome, args) de todas as rondas
+        self.list_result = None
+        self.found_ids = set()  # clientes encontrados por buscas neste turno
+        self._pending = []  # function_call pedidos na ronda em curso
+
+    def read(self, chunk):
+        """Texto novo do pedaço; os function_call ficam guardados para take_calls()."""
+        text = ""
+        for part in chunk.parts:
+            if part.function_call.name:
+                self._pending.append(part.function_call)
+            elif part.text:
+                text += part.text
+        self.text += text
+        return text
+
+    def take_calls(self):
+        """function_call pedidos na ronda (lista vazia = resposta final)."""
+        pending, self._pending = self._pending, []
+        self.calls.extend((fc.name, dict(fc.args)) for fc in pending)
+        return pending
+
+    def answer(self, function_calls, results):
+        """Mensagem com os resultados das ferramentas, a enviar na ronda seguinte."""
+        protos = get_genai().protos
+        parts = []
+        for fc, result in zip(function_calls, results):
+            if fc.name in LIST_TOOLS:
+                self.list_result = result
+            self.found_ids |= _found_client_ids(fc.name, result)
+            if not isinstance(result, dict):
+                result = {"result": result}
+            parts.append(protos.Part(function_response=protos.FunctionResponse(name=fc.name, response=result)))
+        return protos.Content(role='user', parts=parts)
 
 class JarvisBrain:
     """Uma classe para gerir a lógica, memória e o uso de ferramentas."""
 
     def __init__(self, user_id):
         self.user_id = user_id
-        self.contec_knowledge = self._load_knowledge_from_db()
         self.last_search_results = None # Memória de curto prazo para seleções
         self.selected_company_id = None # Memória de longo prazo (para a conversa)
         self.original_intent = "" # Guarda a intenção original do usuário
+        self.last_prompt_report = {} # Tamanho do prompt antes/depois da compactação
+        self.last_turn_tools = [] # Ferramentas usadas no último turno
+        self._answer_key = None # Chave do cache de respostas para o turno atual
+        self._answer_knowledge_version = None
+        self.last_turn_error = None # Exceção que interrompeu o último turno, se houve
+        self._turn_start = None # Tamanho do histórico antes do primeiro envio ao Gemini neste turno
+        self._hinted_question = None # Pergunta sem as dicas de correções, quando foram juntas neste turno
+        self.session_id = uuid.uuid4().hex
+        self.state_version = 0 # Versão do estado persistido, mantida pelo BrainPool
 
-        def get_contec_history():
-            """Retorna a história resumida da Contec Contabilidade."""
-            return """A Contec Contabilidade nasceu de um sonho em <b>02 de janeiro de 1996</b>. Fundada por <b>Clodoaldo da Silva Mello</b>, a jornada começou em um pequeno escritório com apenas um colaborador, mas com uma grande visão de futuro, construída sobre os pilares da honestidade, ética e responsabilidade.<br><br>Com muito esforço e a confiança de seus clientes, a empresa cresceu e se tornou uma referência regional. Hoje, a Contec tem orgulho de sua sede própria, um prédio moderno que abriga mais de <b>65 colaboradores</b> e atende mais de <b>600 clientes</b>.<br><br>O legado de Clodoaldo continua com a diretoria atual, formada por seu primeiro colaborador, <b>Emerson Xavier da Silva</b>, e seu filho e sucessor, <b>Felipe Ronconi de Mello</b>, mantendo vivo o propósito que nos guia desde o início: trabalhar com <b>qualidade e honestidade desde 1996</b>."""
-
-        def format_ramais_list():
-            departments = self.contec_knowledge.get("departments", {})
-            if not departments: return "Não encontrei informações sobre os departamentos."
-            icons = {"diretoria": "👑", "dp": "👥", "fiscal": "🧾", "contábil": "💹", "administrativo": "📁", "ti": "💻", "financeiro": "💰", "comercial": "📈", "recepção": "👋", "rh": "👩‍💼", "irpf": "📄"}
-            response_html = "Aqui está a lista de ramais e equipes da <b>Contec Contabilidade</b>:<br><pre>"
-            for dept_name, teams in departments.items():
-                icon = icons.get(dept_name.lower(), "🏢")
-                response_html += f"{icon} <b>{dept_name.upper()}</b>\n"
-                for team in teams:
-                    ramal = team.get("ramal", "N/A")
-                    members = " • ".join([m.get("nome") for m in team.get("equipe", [])])
-                    response_html += f"  <b>Ramal {ramal}</b>: {members}\n"
-                response_html += "\n"
-            response_html += "</pre>"
-            return response_html
-
-        def find_ramal_by_name(nome: str) -> list:
-            departments = self.contec_knowledge.get("departments", {})
-            search_term_normalized = normalize_text(nome)
-            matches = []
-            for dept_name, teams in departments.items():
-                for team in teams:
-                    for member in team.get("equipe", []):
-                        member_name_normalized = normalize_text(member.get("nome", ""))
-                        found_in_name = search_term_normalized in member_name_normalized
-                        found_in_nickname = False
-                        for apelido in member.get("apelidos", []):
-                            if search_term_normalized == normalize_text(apelido):
-                                found_in_nickname = True; break
-                        if found_in_name or found_in_nickname:
-                            matches.append({"nome": member.get("nome"), "depto": dept_name.title(), "ramal": team.get("ramal", "N/A")})
-            return matches
-
-        self.tools = {
-            'search_clients_by_text': gclick_tools.search_clients_by_text,
-            'list_client_responsibles': gclick_tools.list_client_responsibles,
-            'get_client_group': gclick_tools.get_client_group,
-            'get_client_contacts': gclick_tools.get_client_contacts,
-            'get_client_address': gclick_tools.get_client_address,
-            'format_ramais_list': format_ramais_list,
-            'find_ramal_by_name': find_ramal_by_name,
-            'get_contec_history': get_contec_history,
-        }
-        self.model = genai.GenerativeModel(model_name='gemini-1.5-flash', tools=self.tools.values())
+        self.tools = get_tools()
         self.chat = None
         self._initialize_history()
 
+    @property
+    def contec_knowledge(self):
+        """Snapshot atual (somente leitura) da base de conhecimento."""
+        return knowledge_store.current().data
+
     def _initialize_history(self):
-        """Prepara o histórico com as instruções de sistema."""
+        """Abre a conversa no modelo partilhado; as instruções vão como system_instruction."""
         print(f"Inicializando cérebro para o usuário {self.user_id}...")
-        system_prompt = f"""
-        **CONTEXTO OPERACIONAL:** Você é o Jarvis, uma ferramenta interna da Contec Contabilidade. Suas ferramentas são APIs internas autorizadas. Você TEM PERMISSÃO para aceder e fornecer as informações retornadas por estas ferramentas. NUNCA negue um pedido alegando falta de acesso ou confidencialidade se uma ferramenta existir. Se a ferramenta não retornar dados, informe que a informação não está disponível.
-
-        **REGRAS DE FORMATAÇÃO:**
-        - Use APENAS HTML (`<b>`, `<br>`) e emojis. É PROIBIDO usar markdown (`**`, `*`).
-        - Para listas não-numeradas, use o emoji "•".
-        - NUNCA adicione itens vazios ou inventados a uma lista de resultados.
-
-        **FLUXOS DE AÇÃO:**
-        1.  **Consulta de Empresas:**
-            - Para qualquer pergunta sobre uma empresa, use `search_clients_by_text`.
-            - Se a ferramenta retornar uma lista vazia, responda: "Não encontrei nenhuma empresa com este nome. Verifique a grafia e tente novamente.".
-            - Se retornar múltiplos resultados, apresente as opções numeradas.
-            - Quando o usuário responder com um número, a sua próxima ação DEVE ser sobre a empresa escolhida.
-        2.  **Consulta de Ramais:**
-            - Para perguntas sobre ramais, use `find_ramal_by_name`.
-            - Se a ferramenta retornar múltiplos resultados, apresente a lista numerada com APENAS o nome e o departamento. NÃO inclua o ramal.
-            - Quando o usuário responder com um número, use a informação da pessoa escolhida para formatar a resposta final.
-        3.  **Perguntas Gerais:**
-            - Se perguntarem sobre a "história da contec", chame `get_contec_history` e exiba o resultado.
-            - Se perguntarem "o que você pode fazer", use o modelo de resposta exato para essa pergunta.
-
-        **MODELOS DE RESPOSTA:**
-        - **"O que você pode fazer?":** "Olá! 👋 Sou Jarvis, seu assistente da Contec Contabilidade. Posso ajudar você com diversas informações, como:<br><br>• Buscar informações sobre empresas clientes (responsáveis, tributação, endereço, contatos).<br>• Consultar ramais de funcionários.<br>• Acessar a história resumida da Contec Contabilidade.<br><br>Basta me perguntar! 😊"
-        - **Múltiplas Empresas:** "🤔 Encontrei estas empresas. Qual delas você deseja consultar?<br>1. <b>[Razão Social]</b> (CNPJ: [CNPJ])"
-        - **Múltiplas Pessoas:** "🤔 Encontrei mais de uma pessoa com este nome. Qual delas você se refere?<br>1. <b>[Nome]</b> ([Depto])"
-        - **CNPJ:** "✅ O CNPJ da <b>[Razão Social Completa]</b> é <b>[CNPJ Formatado]</b>."
-        - **Responsáveis:** "✅ Os responsáveis por <b>[Empresa]</b> são:<br><br>• 🧾 <b>[Nome]</b> (Fiscal)<br>• 💹 <b>[Nome]</b> (Contábil)<br>• 👥 <b>[Nome]</b> (DP)"
-        - **Ramal:** "📞 O ramal de <b>[Nome]</b> ([Depto]) é o <b>[Ramal]</b>."
-        - **Endereço:** "📍 O endereço de <b>[Empresa]</b> é:<br><br>[Rua]<br>[Bairro] - [Cidade]/[Estado]<br>CEP: [CEP]"
-        - **Tributação:** "🏢 O regime de <b>[Empresa]</b> é:&nbsp;<b>[Regime]</b>."
-        - **Contatos:** "📞 Os contatos para <b>[Empresa]</b> são:<br><br><b>Telefones:</b><br>• [Nome]:&nbsp;[Número]<br><br><b>Emails:</b><br>• [Nome]:&nbsp;[Email]"
+        self.chat = get_model().start_chat(history=[], enable_automatic_function_calling=True)
+        self._base_history_len = len(self.chat.history)
+
+    def _try_fast_path(self, user_message):
+        """Responde sem o Gemini quando a intenção tem um modelo de resposta fixo."""
+        match = intent_router.match(user_message, self.contec_knowledge.get("departments", {}))
+        if not match:
+            return None
+        intent, args = match
+        self.last_search_results = None
+        if intent == "capabilities":
+            answer = CAPABILITIES_TEXT
+        elif intent == "contec_history":
+            answer = self.tools['get_contec_history']()
+        elif intent == "ramais_list":
+            answer = self.tools['format_ramais_list']()
+        else:
+            matches = self.tools['find_ramal_by_name'](args['nome'])
+            if not matches:
+                return None  # Nome desconhecido: o LLM decide como responder.
+            answer = render_ramal_matches(matches)
+            if len(matches) > 1:
+                self.last_search_results = matches
+        self.selected_company_id = None
+        self.original_intent = user_message
+        self._record_turn(user_message, answer)
+        self.last_turn_tools = [INTENT_TOOLS[intent]] if intent in INTENT_TOOLS else []
+        intent_router.record(intent)
+        return answer
+
+    def _cached_answer(self, user_message):
+        """Resposta do cache partilhado para a pergunta atual, se ainda for válida."""
+        snapshot = knowledge_store.current()
+        self._answer_knowledge_version = snapshot.version
+        answer = answer_cache.get(self._answer_key, snapshot.version, get_gclick().record_version)
+        if answer is None:
+            return None
+        self.last_search_results = None
+        self._record_turn(user_message, answer)
+        intent_router.record("answer_cache")
+        tracing.annotate(path="answer_cache")
+        return answer
+
+    def _with_feedback_hints(self, user_message):
+        """Pergunta a enviar ao Gemini, precedida das correções de utilizadores a perguntas parecidas (few-shot)."""
+        if not FEEDBACK_HINTS:
+            return user_message
+        with PHASE_SECONDS.time(phase="feedback_hints"):
+            hints = correction_index.search(user_message, k=FEEDBACK_HINTS)
+        if not hints:
+            return user_message
+        tracing.annotate(feedback_hints=len(hints))
+        return render_hints(hints) + user_message
+
+    def _store_answer(self, answer, calls, list_result=None, found_ids=()):
+        """Guarda a resposta final quando o turno só usou ferramentas factuais e não deixou escolhas pendentes.
+
+        Cada cliente consultado tem de vir da própria pergunta (uma busca neste
+        turno) ou da empresa selecionada que faz parte da chave. Um "qual o cnpj
+        dela?" resolvido pelo histórico não vai ao cache: a mesma pergunta de
+        outro utilizador refere-se a outra empresa.
         """
-        self.chat = self.model.start_chat(history=[{'role': 'user', 'parts': [system_prompt]}, {'role': 'model', 'parts': ["Entendido. Seguirei as instruções e fluxos de ação rigorosamente."]}], enable_automatic_function_calling=True)
+        pending_choice = isinstance(list_result, list) and len(list_result) > 1
+        if self._answer_key is None or pending_choice or not answer_cache.is_cacheable(name for name, _ in calls):
+            return
+        client_ids = {int(args["client_id"]) for _, args in calls if args.get("client_id") is not None}
+        known_ids = set(found_ids)
+        if self._answer_key[1] is not None:
+            known_ids.add(int(self._answer_key[1]))
+        if not client_ids <= known_ids:
+            return
+        answer_cache.put(
+            self._answer_key, answer, self._answer_knowledge_version,
+            {client_id: get_gclick().record_version(client_id) for client_id in client_ids}
+        )
+
+    def _compact_history(self):
+        """Mantém o histórico dentro do orçamento de tokens antes de cada chamada ao Gemini."""
+        history, report = history_manager.compact(self.chat.history, self._base_history_len)
+        if report["compacted"]:
+            self.chat.history = history
+        self.last_prompt_report = report
+
+    def export_state(self, max_turns=RECENT_TURNS_TO_KEEP):
+        """Estado serializável da conversa: seleção atual e os turnos de texto mais recentes."""
+        turns = []
+        if self.chat:
+            for content in self.chat.history[self._base_history_len:]:
+                text = "".join(part.text for part in content.parts if part.text)
+                if text:
+                    turns.append({"role": content.role, "text": text})
+        return {
+            "selected_company_id": self.selected_company_id,
+            "last_search_results": self.last_search_results,
+            "original_intent": self.original_intent,
+            "session_id": self.session_id,
+            "turns": turns[-2 * max_turns:],
+        }
+
+    def restore_state(self, state):
+        """Reconstrói a conversa a partir de export_state()."""
+        self.selected_company_id = state.get("selected_company_id")
+        self.last_search_results = state.get("last_search_results")
+        self.original_intent = state.get("original_intent", "")
+        self.session_id = state.get("session_id") or self.session_id
+        if not self.chat: self._initialize_history()
+        turns = state.get("turns", [])
+        # A conversa tem de começar com o utilizador e alternar papéis.
+        while turns and turns[0]["role"] != "user":
+            turns = turns[1:]
+        self.chat.history.extend(
+            get_genai().protos.Content(role=turn["role"], parts=[get_genai().protos.Part(text=turn["text"])]) for turn in turns
+        )
+
+    def memory_usage(self):
+        """Estimativa do tamanho da conversa em memória (histórico serializado)."""
+        history = self.chat.history if self.chat else []
+        history_bytes = sum(type(content).pb(content).ByteSize() for content in history)
+        results_bytes = len(json.dumps(self.last_search_results, ensure_ascii=False)) if self.last_search_results else 0
+        return {
+            "history_messages": len(history),
+            "approx_bytes": history_bytes + results_bytes,
+            "last_prompt_tokens": self.last_prompt_report.get("tokens_after"),
+        }
+
+    def _record_turn(self, user_message, answer):
+        """Regista no histórico do chat um turno respondido localmente, para manter o contexto."""
+        if not self.chat: self._initialize_history()
+        self.chat.history.extend([
+            get_genai().protos.Content(role='user', parts=[get_genai().protos.Part(text=user_message)]),
+            get_genai().protos.Content(role='model', parts=[get_genai().protos.Part(text=answer)]),
+        ])
+
+    def _prepare_message(self, user_message):
+        """Trata seleções numéricas, o fast path e o contexto da empresa selecionada.
+
+        Devolve (resposta_pronta, None) quando o turno já foi respondido, ou
+        (None, mensagem) com a mensagem a enviar ao Gemini.
+        """
+        self.last_turn_tools = []
+        self.last_turn_error = None
+        self._turn_start = None
+        self._hinted_question = None
+        self._answer_key = None
+        answer_key = None
+        if user_message.strip().isdigit() and self.last_search_results:
+            index = int(user_message.strip()) - 1
+            if 0 <= index < len(self.last_search_results):
+                selected_item = self.last_search_results[index]
+                self.last_search_results = None
+                
+                if 'depto' in selected_item:
+                    tracing.annotate(path="selection")
+                    return f"📞 O ramal de <b>{selected_item['nome']}</b> ({selected_item['depto']}) é o <b>{selected_item['ramal']}</b>.", None
+                else:
+                    self.selected_company_id = selected_item['id']
+                    answer_key = make_key(self.original_intent, self.selected_company_id)
+                    user_message = f"Continue a pergunta anterior sobre a empresa com ID {self.selected_company_id}"
+            else:
+                return "Seleção inválida. Por favor, tente a busca novamente.", None
+
+        fast_answer = self._try_fast_path(user_message)
+        if fast_answer is not None:
+            tracing.annotate(path="fast_path")
+            return fast_answer, None
+
+        if not any(keyword in normalize_text(user_message) for keyword in ['empresa', 'cliente', 'cnpj', 'ramal', 'historia', 'fazer']):
+            if self.selected_company_id:
+                 answer_key = answer_key or make_key(user_message, self.selected_company_id)
+                 user_message = f"{user_message} da empresa com ID {self.selected_company_id}"
+            else: # Se não há contexto, limpa a memória
+                 self.selected_company_id = None
+        else: # Se é uma nova busca, limpa a memória
+            answer_key = answer_key or make_key(user_message)
+            self.selected_company_id = None
+            self.original_intent = user_message
+        # Sem entidade explícita ("e o endereço dela?") a pergunta depende do histórico: não vai ao cache.
+        self._answer_key = answer_key
+        return None, user_message
+
+    def _open_turn(self, user_message):
+        """Passos comuns a todos os caminhos antes do Gemini: seleção, fast path, cache de respostas, histórico e dicas.
+
+        Devolve (resposta_pronta, None) quando o turno já foi respondido, ou
+        (None, mensagem) com a mensagem a enviar ao Gemini.
+        """
+        with PHASE_SECONDS.time(phase="prepare"):
+            ready_answer, user_message = self._prepare_message(user_message)
+        if ready_answer is not None:
+            return ready_answer, None
+
+        if not self.chat: self._initialize_history()
+
+        with PHASE_SECONDS.time(phase="answer_cache"):
+            cached_answer = self._cached_answer(user_message)
+        if cached_answer is not None:
+            return cached_answer, None
+
+        intent_router.record(None)
+        tracing.annotate(path="gemini")
+        with PHASE_SECONDS.time(phase="history"):
+            self._compact_history()
+        message = self._with_feedback_hints(user_message)
+        if message != user_message:
+            self._hinted_question = user_message
+        self._turn_start = len(self.chat.history)
+        return None, message
 
     def get_response(self, user_message):
         try:
-            if user_message.strip().isdigit() and self.last_search_results:
-                index = int(user_message.strip()) - 1
-                if 0 <= index < len(self.last_search_results):
-                    selected_item = self.last_search_results[index]
-                    self.last_search_results = None
-                    
-                    if 'depto' in selected_item:
-                        return f"📞 O ramal de <b>{selected_item['nome']}</b> ({selected_item['depto']}) é o <b>{selected_item['ramal']}</b>."
-                    else:
-                        self.selected_company_id = selected_item['id']
-                        user_message = f"Continue a pergunta anterior sobre a empresa com ID {self.selected_company_id}"
-                else:
-                    return "Seleção inválida. Por favor, tente a busca novamente."
-
-            if not any(keyword in normalize_text(user_message) for keyword in ['empresa', 'cliente', 'cnpj', 'ramal', 'historia', 'fazer']):
-                if self.selected_company_id:
-                     user_message = f"{user_message} da empresa com ID {self.selected_company_id}"
-                else: # Se não há contexto, limpa a memória
-                     self.selected_company_id = None
-            else: # Se é uma nova busca, limpa a memória
-                self.selected_company_id = None
-                self.original_intent = user_message
+            ready_answer, message = self._open_turn(user_message)
+            if ready_answer is not None:
+                return ready_answer
 
+            if _model_info.get("cached_content"):
+                # O modelo criado a partir do cache de contexto não tem as ferramentas
+                # do lado do cliente (estão no cache): o AFC devolveria os function_call
+                # por executar, por isso as ferramentas correm no ciclo manual.
+                loop = _ToolLoop()
+                with PHASE_SECONDS.time(phase="gemini"):
+                    for _ in self._tool_loop(message, loop, stream=False):
+                        pass
+                return self._finish_streamed_turn(loop)
 
-            if not self.chat: self._initialize_history()
-            
-            response = self.chat.send_message(user_message)
+            history_len = self._turn_start
+            queued = time.perf_counter()
+            with llm_gate.slot():
+                PHASE_SECONDS.observe(time.perf_counter() - queued, phase="llm_queue")
+                # Inclui as ferramentas chamadas automaticamente, que têm também jarvis_tool_seconds.
+                with PHASE_SECONDS.time(phase="gemini"):
+                    response = self.chat.send_message(message)
+            _record_usage(response)
+            calls = [
+                (part.function_call.name, dict(part.function_call.args)) for content in self.chat.history[history_len:]
+                for part in content.parts if part.function_call.name
+            ]
+            self.last_turn_tools = [name for name, _ in calls]
+            list_result = None
+            found_ids = set()
+            for content in self.chat.history[history_len:]:
+                for part in content.parts:
+                    if not part.function_response.name:
+                        continue
+                    result = _from_struct(type(part.function_response).to_dict(part.function_response).get("response") or {})
+                    if part.function_response.name in LIST_TOOLS:
+                        list_result = result.get("result")
+                    found_ids |= _found_client_ids(part.function_response.name, result)
             
-            last_response = self.chat.history[-1]
-            if last_response.role == 'model' and len(last_response.parts) > 0 and hasattr(last_response.parts[0], 'function_call'):
-                tool_name = last_response.parts[0].function_call.name
-                if len(self.chat.history) > 1:
-                    tool_response_part = self.chat.history[-2].parts[0]
-                    if tool_name in ['search_clients_by_text', 'find_ramal_by_name'] and hasattr(tool_response_part, 'function_response'):
-                        tool_data = tool_response_part.function_response.response.get('result', [])
-                        if isinstance(tool_data, list) and len(tool_data) > 1:
-                            self.last_search_results = tool_data
-                        else:
-                             self.last_search_results = None
-            else:
-                if "Encontrei estas empresas" not in response.text:
-                    self.selected_company_id = None
-                self.last_search_results = None
-
-            return response.text.strip()
+            answer = response.text.strip()
+            self._remember_choices(answer, list_result)
+            self._drop_feedback_hints()
+            self._store_answer(answer, calls, list_result, found_ids)
+            return answer
+        except LLMBusyError:
+            raise  # A rota responde 503 com Retry-After.
         except Exception as e:
             print(f"Erro no get_response: {e}")
+            self._rollback_turn()
             return "Ocorreu um erro ao processar sua solicitação. Tente novamente."
 
-    def _load_knowledge_from_db(self):
+    def _call_tool(self, name, args):
+        tool = self.tools.get(name)
+        return tool(**args) if tool else {"error": f"Ferramenta desconhecida: {name}"}
+
+    def _announce_tools(self, function_calls):
+        """Regista as ferramentas pedidas na ronda e devolve as mensagens de progresso a mostrar."""
+        self.last_turn_tools.extend(fc.name for fc in function_calls)
+        return [TOOL_PROGRESS_MESSAGES.get(fc.name, "⏳ A consultar informações…") for fc in function_calls]
+
+    def _tool_loop(self, message, loop, stream=True):
+        """Ciclo manual de ferramentas: gera "text" e "progress" até o Gemini dar a resposta final."""
+        self.chat.enable_automatic_function_calling = False
+        try:
+            while True:
+                with llm_gate.slot():
+                    response = self.chat.send_message(message, stream=stream)
+                    for chunk in response if stream else [response]:
+                        text = loop.read(chunk)
+                        if text:
+                            yield "text", text
+                _record_usage(response)
+                function_calls = loop.take_calls()
+                if not function_calls:
+                    return
+                for progress in self._announce_tools(function_calls):
+                    yield "progress", progress
+                message = loop.answer(function_calls, [self._call_tool(fc.name, dict(fc.args)) for fc in function_calls])
+        finally:
+            self.chat.enable_automatic_function_calling = True
+
+    async def _atool_loop(self, message, loop):
+        """Versão assíncrona de _tool_loop: as ferramentas pedidas na mesma ronda correm em paralelo, em threads."""
+        self.chat.enable_automatic_function_calling = False
+        try:
+            while True:
+                async with llm_gate.aslot():
+                    response = await self.chat.send_message_async(message, stream=True)
+                    async for chunk in response:
+                        text = loop.read(chunk)
+                        if text:
+                            yield "text", text
+                _record_usage(response)
+                function_calls = loop.take_calls()
+                if not function_calls:
+                    return
+                for progress in self._announce_tools(function_calls):
+                    yield "progress", progress
+                results = await asyncio.gather(*(asyncio.to_thread(self._call_tool, fc.name, dict(fc.args)) for fc in function_calls))
+                message = loop.answer(function_calls, results)
+        finally:
+            self.chat.enable_automatic_function_calling = True
+
+    def _finish_streamed_turn(self, loop):
+        """Atualiza a memória de seleção e o cache no fim de um turno com ciclo manual de ferramentas."""
+        self._remember_choices(loop.text, loop.list_result)
+        self._drop_feedback_hints()
+        self._store_answer(loop.text.strip(), loop.calls, loop.list_result, loop.found_ids)
+        return loop.text.strip()
+
+    def _remember_choices(self, answer, list_result):
+        """Guarda a lista devolvida no turno quando o utilizador tem de escolher um item pelo número."""
+        if isinstance(list_result, list) and len(list_result) > 1:
+            self.last_search_results = list_result
+        else:
+            if "Encontrei estas empresas" not in answer:
+                self.selected_company_id = None
+            self.last_search_results = None
+
+    def _drop_feedback_hints(self):
+        """No fim do turno, troca no histórico a pergunta enviada com as dicas pela pergunta simples.
+
+        As dicas servem só às chamadas deste turno; se ficassem no histórico
+        seriam reenviadas em todos os turnos seguintes e gravadas no brain_state.
+        """
+        question, self._hinted_question = self._hinted_question, None
+        if question is None or self._turn_start is None:
+            return
+        history = self.chat.history
+        if len(history) > self._turn_start and history[self._turn_start].role == 'user':
+            history[self._turn_start] = get_genai().protos.Content(role='user', parts=[get_genai().protos.Part(text=question)])
+
+    def _rollback_turn(self):
+        """Desfaz um turno interrompido: o histórico volta ao ponto em que o turno começou.
+
+        Só há envio em curso (fora do histórico) quando chat.last está preenchido;
+        nesse caso é descartado com rewind(). Sem isso, rewind() apagaria o par
+        pergunta/resposta do turno anterior, que já estava completo.
+        """
+        start, self._turn_start = self._turn_start, None
+        if start is None or not self.chat:
+            return  # O erro ocorreu antes de qualquer envio ao Gemini.
         try:
-            conn = sqlite3.connect('jarvis.db')
-            conn.row_factory = sqlite3.Row
-            knowledge = {row['key']: json.loads(row['content']) for row in conn.execute("SELECT key, content FROM knowledge_base").fetchall()}
-            conn.close()
-            return knowledge
+            if self.chat.last is not None:
+                try:
+                    self.chat.rewind()
+                except get_genai().types.IncompleteIterationError:
+                    # Stream fechado a meio: rewind() lê a resposta incompleta e falha;
+                    # descarta-se o par em curso como ele faria.
+                    self.chat._last_sent = self.chat._last_received = None
+            if len(self.chat.history) > start:
+                # Rondas de ferramentas já concluídas: sem isto ficaria um function_call órfão.
+                self.chat.history = self.chat.history[:start]
         except Exception as e:
-            print(f"ERRO ao carregar conhecimento do DB: {e}")
-            return {}
\ No newline at end of file
+            print(f"ERRO ao desfazer o turno interrompido: {e}")
+
+    def _turn_error(self, where, e):
+        print(f"Erro no {where}: {e}")
+        self.last_turn_error = e
+        self._rollback_turn()
+        if isinstance(e, LLMBusyError):
+            return "O Jarvis está com muitas perguntas neste momento. Tente novamente em instantes."
+        return "Ocorreu um erro ao processar sua solicitação. Tente novamente."
+
+    def stream_response(self, user_message):
+        """Versão em streaming de get_response.
+
+        Gera eventos (tipo, dados): "progress" quando uma ferramenta é chamada,
+        "text" para cada pedaço da resposta e "done" com o texto final. O SDK não
+        suporta streaming com function calling automático, por isso as chamadas
+        de ferramentas são executadas aqui, no mesmo ciclo.
+        """
+        completed = False
+        try:
+            ready_answer, message = self._open_turn(user_message)
+            if ready_answer is not None:
+                completed = True
+                yield "text", ready_answer
+                yield "done", ready_answer
+                return
+            loop = _ToolLoop()
+            yield from self._tool_loop(message, loop)
+            answer = self._finish_streamed_turn(loop)
+            completed = True
+            yield "done", answer
+        except Exception as e:
+            completed = True
+            yield "error", self._turn_error("stream_response", e)
+        finally:
+            if not completed:
+                # Gerador fechado a meio (cliente desligou-se): GeneratorExit não passa
+                # pelo except, e um function_call sem resposta estragaria os turnos seguintes.
+                self._rollback_turn()
+
+    async def astream_response(self, user_message):
+        """Versão assíncrona de stream_response, para o modo de serviço ASGI.
+
+        A preparação do turno (cache, histórico, dicas) corre numa thread, as
+        chamadas ao Gemini são aguardadas (send_message_async) e as ferramentas,
+        que fazem HTTP bloqueante, correm em threads.
+        """
+        completed = False
+        try:
+            ready_answer, message = await asyncio.to_thread(self._open_turn, user_message)
+            if ready_answer is not None:
+                completed = True
+                yield "text", ready_answer
+                yield "done", ready_answer
+                return
+            loop = _ToolLoop()
+            async for event in self._atool_loop(message, loop):
+                yield event
+            answer = self._finish_streamed_turn(loop)
+            completed = True
+            yield "done", answer
+        except Exception as e:
+            completed = True
+            yield "error", self._turn_error("astream_response", e)
+        finally:
+            if not completed:
+                self._rollback_turn()  # Ver stream_response.
+
+    async def get_response_async(self, user_message):
+        """Resposta completa pelo caminho assíncrono (sem os eventos intermédios)."""
+        async for event, data in self.astream_response(user_message):
+            if event == "error" and isinstance(self.last_turn_error, LLMBusyError):
+                raise self.last_turn_error
+            if event in ("done", "error"):
+                return data
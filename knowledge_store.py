@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Optional
+
+import db
+
+POLL_INTERVAL = 1.0  # segundos entre verificações de PRAGMA data_version
+
+def ensure_schema(conn: sqlite3.Connection):
+    """Cria o contador de revisão da base de conhecimento e os triggers que o incrementam."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS knowledge_meta (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            revision INTEGER NOT NULL
+        )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO knowledge_meta (id, revision) VALUES (1, 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS knowledge_base_revision_{event.lower()}
+            AFTER {event} ON knowledge_base
+            BEGIN
+                UPDATE knowledge_meta SET revision = revision + 1 WHERE id = 1;
+            END
+        ''')
+
+class KnowledgeSnapshot:
+    """Versão imutável da base de conhecimento, partilhada por todos os cérebros.
+
+    Artefactos derivados (HTML da lista de ramais, índices) são calculados uma
+    vez por snapshot através de `derived()`.
+    """
+
+    def __init__(self, data: Dict, version: str, revision: int):
+        self.data = MappingProxyType(data)
+        self.version = version
+        self.revision = revision
+        self.loaded_at = time.time()
+        self._derived: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def derived(self, name: str, builder: Callable[[MappingProxyType], Any]) -> Any:
+        value = self._derived.get(name)
+        if value is None:
+            with self._lock:
+                value = self._derived.get(name)
+                if value is None:
+                    value = builder(self.data)
+                    self._derived[name] = value
+        return value
+
+class KnowledgeStore:
+    """Mantém o snapshot atual e deteta alterações feitas por outros processos.
+
+    A verificação é barata: `PRAGMA data_version` só muda quando outra conexão
+    faz commit, e nesse caso basta ler `knowledge_meta.revision` para saber se
+    a base de conhecimento mudou de facto.
+    """
+
+    def __init__(self, db_path: str = "jarvis.db", poll_interval: float = POLL_INTERVAL):
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+        self._snapshot: Optional[KnowledgeSnapshot] = None
+        self._data_version = None
+        self._last_poll = 0.0
+        self._stats = {"reloads": 0, "polls": 0}
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # Conexão dedicada (fora do pool): PRAGMA data_version é por conexão.
+            self._conn = db.open_connection(self.db_path)
+            ensure_schema(self._conn)
+            self._conn.commit()
+        return self._conn
+
+    def current(self) -> KnowledgeSnapshot:
+        """Snapshot atual; recarrega apenas se a revisão no banco mudou."""
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._last_poll < self.poll_interval:
+            return snapshot
+        with self._lock:
+            try:
+                self._poll()
+            except Exception as e:
+                print(f"ERRO ao verificar versão do conhecimento: {e}")
+                self._last_poll = time.monotonic()
+            if self._snapshot is None:
+                self._snapshot = KnowledgeSnapshot({}, "", -1)
+            return self._snapshot
+
+    def _poll(self):
+        conn = self._connection()
+        self._last_poll = time.monotonic()
+        self._stats["polls"] += 1
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if self._snapshot is not None and data_version == self._data_version:
+            return
+        self._data_version = data_version
+        revision = conn.execute("SELECT revision FROM knowledge_meta WHERE id = 1").fetchone()[0]
+        if self._snapshot is None or revision != self._snapshot.revision:
+            self._load(conn, revision)
+
+    def _load(self, conn: sqlite3.Connection, revision: int):
+        rows = conn.execute("SELECT key, content FROM knowledge_base ORDER BY key").fetchall()
+        version = hashlib.sha1("".join(row['key'] + row['content'] for row in rows).encode('utf-8')).hexdigest()
+        if self._snapshot is not None and version == self._snapshot.version:
+            self._snapshot.revision = revision
+            return
+        self._snapshot = KnowledgeSnapshot({row['key']: json.loads(row['content']) for row in rows}, version, revision)
+        self._stats["reloads"] += 1
+
+    def update(self, key: str, content: Any) -> KnowledgeSnapshot:
+        """Grava uma chave e troca o snapshot de imediato, sem derrubar conversas."""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT INTO knowledge_base (key, content) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET content = excluded.content",
+                    (key, json.dumps(content, indent=4, ensure_ascii=False))
+                )
+            revision = conn.execute("SELECT revision FROM knowledge_meta WHERE id = 1").fetchone()[0]
+            self._load(conn, revision)
+            self._last_poll = time.monotonic()
+            return self._snapshot
+
+    def stats(self) -> Dict:
+        snapshot = self._snapshot
+        return dict(self._stats, version=snapshot.version if snapshot else None, revision=snapshot.revision if snapshot else None)
+
+
+knowledge_store = KnowledgeStore()
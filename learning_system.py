@@ -1,49 +1,53 @@
 # learning_system.py - Sistema de Aprendizagem e Personalização do Jarvis
-import sqlite3
 import json
 import os
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
 import re
 from collections import Counter
 
+import db
+import feedback_rollups
+from feedback_embeddings import correction_index
+
+MAX_CORRECTION_EXAMPLES = 20
+
 class LearningSystem:
     """Sistema de aprendizagem ativa do Jarvis baseado em feedback"""
     
     def __init__(self, db_path: str = "jarvis.db"):
         self.db_path = db_path
     
-    def analyze_negative_feedback(self, days_back: int = 7) -> Dict:
-        """Analisa feedback negativo dos últimos dias"""
+    def analyze_negative_feedback(self, days_back: int = 7, raw: bool = False) -> Dict:
+        """Analisa feedback negativo dos últimos dias.
+
+        Por omissão lê os agregados diários (feedback_rollups); com raw=True
+        percorre as linhas do período pelo cursor, sem as carregar numa lista.
+        O período conta dias de calendário (UTC), a granularidade dos agregados.
+        """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Data limite
-            date_limit = (datetime.now() - timedelta(days=days_back)).isoformat()
-            
-            # Buscar feedback negativo com correções
-            cursor.execute('''
-                SELECT user_query, bot_response, correction, timestamp
-                FROM feedback 
-                WHERE rating = -1 
-                AND correction IS NOT NULL 
-                AND timestamp >= ?
-                ORDER BY timestamp DESC
-            ''', (date_limit,))
-            
-            negative_feedback = cursor.fetchall()
-            conn.close()
+            with db.connection(self.db_path) as conn:
+                if raw:
+                    cursor = conn.execute('''
+                        SELECT user_query, bot_response, correction, timestamp
+                        FROM feedback 
+                        WHERE rating = -1 
+                        AND correction IS NOT NULL 
+                        AND timestamp >= date('now', ?)
+                        ORDER BY timestamp DESC
+                    ''', (f"-{int(days_back)} days",))
+                    patterns, total = self._identify_error_patterns(cursor)
+                else:
+                    feedback_rollups.refresh(conn)
+                    patterns, total = self._patterns_from_rollups(conn, days_back)
             
-            if not negative_feedback:
+            if not total:
                 return {"message": "Nenhum feedback negativo com correções encontrado"}
             
-            # Analisar padrões
-            patterns = self._identify_error_patterns(negative_feedback)
             suggestions = self._generate_improvement_suggestions(patterns)
             
             return {
-                "total_negative_feedback": len(negative_feedback),
+                "total_negative_feedback": total,
                 "patterns": patterns,
                 "suggestions": suggestions,
                 "period_days": days_back
@@ -52,64 +56,71 @@ class LearningSystem:
         except Exception as e:
             return {"error": f"Erro ao analisar feedback: {str(e)}"}
     
-    def _identify_error_patterns(self, feedback_data: List[Tuple]) -> Dict:
-        """Identifica padrões nos erros do Jarvis"""
+    def _patterns_from_rollups(self, conn, days_back: int) -> Tuple[Dict, int]:
+        """Mesmos padrões de _identify_error_patterns, somados a partir dos agregados diários."""
+        since = (f"-{int(days_back)} days",)
+        total = conn.execute(
+            "SELECT COALESCE(SUM(corrections), 0) FROM feedback_daily WHERE day >= date('now', ?)", since
+        ).fetchone()[0]
+        common_topics = conn.execute('''
+            SELECT keyword, SUM(count) AS total FROM feedback_keyword_daily
+            WHERE day >= date('now', ?) GROUP BY keyword ORDER BY total DESC, keyword LIMIT 10
+        ''', since).fetchall()
+        frequent_errors = conn.execute('''
+            SELECT error_type, SUM(count) AS total FROM feedback_error_daily
+            WHERE day >= date('now', ?) GROUP BY error_type ORDER BY total DESC, error_type LIMIT 5
+        ''', since).fetchall()
+        examples = conn.execute('''
+            SELECT user_query, bot_response, correction, timestamp FROM feedback
+            WHERE rating = -1 AND correction IS NOT NULL AND timestamp >= date('now', ?)
+            ORDER BY timestamp DESC LIMIT ?
+        ''', since + (MAX_CORRECTION_EXAMPLES,))
+        return {
+            "common_topics": [(row[0], row[1]) for row in common_topics],
+            "frequent_errors": [(row[0], row[1]) for row in frequent_errors],
+            "correction_examples": [self._correction_example(*row) for row in examples],
+            "correction_count": total,
+        }, total
+    
+    def _correction_example(self, user_query: str, bot_response: str, correction: str, timestamp) -> Dict:
+        return {
+            "query": user_query,
+            "wrong_response": bot_response[:100] + "..." if len(bot_response) > 100 else bot_response,
+            "correct_response": correction[:100] + "..." if len(correction) > 100 else correction,
+            "timestamp": timestamp
+        }
+    
+    def _identify_error_patterns(self, feedback_rows: Iterable[Tuple]) -> Tuple[Dict, int]:
+        """Identifica padrões nos erros do Jarvis a partir das linhas (percorridas uma vez)."""
         patterns = {
             "common_topics": [],
             "frequent_errors": [],
             "correction_examples": []
         }
         
-        # Extrair tópicos das perguntas
-        topics = []
-        error_types = []
+        topic_counts = Counter()
+        error_counts = Counter()
+        total = 0
         
-        for user_query, bot_response, correction, timestamp in feedback_data:
-            # Extrair palavras-chave da pergunta
-            query_words = re.findall(r'\b\w+\b', user_query.lower())
-            topics.extend([word for word in query_words if len(word) > 3])
+        for user_query, bot_response, correction, timestamp in feedback_rows:
+            total += 1
+            topic_counts.update(feedback_rollups.query_keywords(user_query))
+            error_counts[self._classify_error_type(bot_response, correction)] += 1
             
-            # Classificar tipo de erro baseado na resposta e correção
-            error_type = self._classify_error_type(bot_response, correction)
-            if error_type:
-                error_types.append(error_type)
-            
-            # Adicionar exemplo de correção
-            patterns["correction_examples"].append({
-                "query": user_query,
-                "wrong_response": bot_response[:100] + "..." if len(bot_response) > 100 else bot_response,
-                "correct_response": correction[:100] + "..." if len(correction) > 100 else correction,
-                "timestamp": timestamp
-            })
-        
-        # Contar tópicos mais frequentes
-        topic_counts = Counter(topics)
-        patterns["common_topics"] = topic_counts.most_common(10)
+            # Só os exemplos mais recentes (as linhas vêm por ordem decrescente de data)
+            if len(patterns["correction_examples"]) < MAX_CORRECTION_EXAMPLES:
+                patterns["correction_examples"].append(self._correction_example(user_query, bot_response, correction, timestamp))
         
-        # Contar tipos de erro mais frequentes
-        error_counts = Counter(error_types)
-        patterns["frequent_errors"] = error_counts.most_common(5)
+        # Empates por ordem alfabética, como na consulta aos agregados
+        patterns["common_topics"] = sorted(topic_counts.items(), key=lambda item: (-item[1], item[0]))[:10]
+        patterns["frequent_errors"] = sorted(error_counts.items(), key=lambda item: (-item[1], item[0]))[:5]
+        patterns["correction_count"] = total
         
-        return patterns
+        return patterns, total
     
     def _classify_error_type(self, bot_response: str, correction: str) -> str:
         """Classifica o tipo de erro baseado na resposta e correção"""
-        bot_lower = bot_response.lower()
-        correction_lower = correction.lower()
-        
-        # Padrões de classificação
-        if "não sei" in bot_lower or "não encontrei" in bot_lower:
-            return "Falta de conhecimento"
-        elif "erro" in bot_lower or "desculpe" in bot_lower:
-            return "Erro de processamento"
-        elif len(correction) > len(bot_response) * 2:
-            return "Resposta incompleta"
-        elif any(word in correction_lower for word in ["ramal", "telefone", "contato"]):
-            return "Informação de contato incorreta"
-        elif any(word in correction_lower for word in ["prazo", "data", "quando"]):
-            return "Informação temporal incorreta"
-        else:
-            return "Informação factual incorreta"
+        return feedback_rollups.classify_error_type(bot_response, correction)
     
     def _generate_improvement_suggestions(self, patterns: Dict) -> List[str]:
         """Gera sugestões de melhoria baseadas nos padrões"""
@@ -143,16 +154,21 @@ class LearningSystem:
                 )
         
         # Sugestão geral se há muitos exemplos de correção
-        if len(patterns["correction_examples"]) > 5:
+        correction_count = patterns.get("correction_count", len(patterns["correction_examples"]))
+        if correction_count > 5:
             suggestions.append(
-                f"Com {len(patterns['correction_examples'])} correções disponíveis, "
+                f"Com {correction_count} correções disponíveis, "
                 "considere usar esses dados para fine-tuning do modelo ou atualização do prompt."
             )
         
         return suggestions
     
-    def generate_prompt_improvements(self, patterns: Dict) -> str:
-        """Gera melhorias para o system prompt baseadas nos padrões"""
+    def generate_prompt_improvements(self, patterns: Dict, question: Optional[str] = None) -> str:
+        """Gera melhorias para o system prompt baseadas nos padrões.
+
+        Com `question`, os exemplos few-shot são as correções mais parecidas
+        com ela (feedback_embeddings); sem, as 3 mais recentes.
+        """
         improvements = []
         
         # Adicionar instruções específicas baseadas nos erros
@@ -170,9 +186,13 @@ class LearningSystem:
                     )
         
         # Adicionar exemplos de correções como few-shot examples
-        if patterns.get("correction_examples"):
+        if question:
+            examples = [{"query": hint["query"], "correct_response": hint["correction"]} for hint in correction_index.search(question, k=3)]
+        else:
+            examples = patterns.get("correction_examples", [])[:3]
+        if examples:
             improvements.append("\nExemplos de respostas corretas baseadas em feedback:")
-            for i, example in enumerate(patterns["correction_examples"][:3]):  # Apenas 3 exemplos
+            for example in examples:
                 improvements.append(
                     f"Pergunta: {example['query']}\n"
                     f"Resposta correta: {example['correct_response']}\n"
@@ -190,27 +210,26 @@ class PersonalizationSystem:
     def analyze_user_interests(self, user_id: int) -> Dict:
         """Analisa os interesses do usuário baseado em atalhos e histórico"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with db.connection(self.db_path) as conn:
+                cursor = conn.cursor()
             
-            # Buscar atalhos do usuário
-            cursor.execute('''
-                SELECT text, timestamp FROM shortcuts 
-                WHERE user_id = ? 
-                ORDER BY timestamp DESC
-            ''', (user_id,))
-            shortcuts = cursor.fetchall()
+                # Buscar atalhos do usuário
+                cursor.execute('''
+                    SELECT text, timestamp FROM shortcuts 
+                    WHERE user_id = ? 
+                    ORDER BY timestamp DESC
+                ''', (user_id,))
+                shortcuts = cursor.fetchall()
             
-            # Buscar histórico de perguntas (feedback positivo)
-            cursor.execute('''
-                SELECT user_query, timestamp FROM feedback 
-                WHERE user_id = ? AND rating = 1
-                ORDER BY timestamp DESC
-                LIMIT 50
-            ''', (user_id,))
-            positive_queries = cursor.fetchall()
+                # Buscar histórico de perguntas (feedback positivo)
+                cursor.execute('''
+                    SELECT user_query, timestamp FROM feedback 
+                    WHERE user_id = ? AND rating = 1
+                    ORDER BY timestamp DESC
+                    LIMIT 50
+                ''', (user_id,))
+                positive_queries = cursor.fetchall()
             
-            conn.close()
             
             # Analisar tópicos de interesse
             interests = self._extract_topics_from_text([s[0] for s in shortcuts] + [q[0] for q in positive_queries])
@@ -290,16 +309,15 @@ class PersonalizationSystem:
         try:
             # Por enquanto, apenas salva como um novo atalho se for relevante
             if "interest" in new_data:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
+                with db.connection(self.db_path) as conn:
+                    cursor = conn.cursor()
                 
-                cursor.execute('''
-                    INSERT INTO shortcuts (user_id, text, timestamp)
-                    VALUES (?, ?, ?)
-                ''', (user_id, f"Interesse: {new_data['interest']}", datetime.now().isoformat()))
+                    cursor.execute('''
+                        INSERT INTO shortcuts (user_id, text, timestamp)
+                        VALUES (?, ?, ?)
+                    ''', (user_id, f"Interesse: {new_data['interest']}", datetime.now().isoformat()))
                 
-                conn.commit()
-                conn.close()
+                    conn.commit()
                 return True
                 
         except Exception as e:
@@ -321,35 +339,33 @@ class FeedbackAnalyzer:
             # Analisar feedback da semana
             weekly_analysis = learning_system.analyze_negative_feedback(days_back=7)
             
-            # Estatísticas gerais
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            # Estatísticas gerais, lidas dos agregados diários (já atualizados pela análise acima)
+            with db.connection(self.db_path) as conn:
+                cursor = conn.cursor()
             
-            # Feedback da semana
-            week_ago = (datetime.now() - timedelta(days=7)).isoformat()
-            cursor.execute('''
-                SELECT rating, COUNT(*) as count 
-                FROM feedback 
-                WHERE timestamp >= ? 
-                GROUP BY rating
-            ''', (week_ago,))
+                # Feedback da semana
+                cursor.execute('''
+                    SELECT COALESCE(SUM(positive), 0), COALESCE(SUM(negative), 0)
+                    FROM feedback_daily
+                    WHERE day >= date('now', '-7 days')
+                ''')
             
-            weekly_stats = {row[0]: row[1] for row in cursor.fetchall()}
+                positive, negative = cursor.fetchone()
+                weekly_stats = {1: positive, -1: negative}
             
-            # Usuários mais ativos
-            cursor.execute('''
-                SELECT u.username, COUNT(f.id) as feedback_count
-                FROM feedback f
-                JOIN users u ON f.user_id = u.id
-                WHERE f.timestamp >= ?
-                GROUP BY f.user_id, u.username
-                ORDER BY feedback_count DESC
-                LIMIT 5
-            ''', (week_ago,))
+                # Usuários mais ativos
+                cursor.execute('''
+                    SELECT u.username, SUM(d.positive + d.negative) as feedback_count
+                    FROM feedback_daily d
+                    JOIN users u ON d.user_id = u.id
+                    WHERE d.day >= date('now', '-7 days')
+                    GROUP BY d.user_id, u.username
+                    ORDER BY feedback_count DESC
+                    LIMIT 5
+                ''')
             
-            active_users = [{"username": row[0], "feedback_count": row[1]} for row in cursor.fetchall()]
+                active_users = [{"username": row[0], "feedback_count": row[1]} for row in cursor.fetchall()]
             
-            conn.close()
             
             # Compilar relatório
             report = {
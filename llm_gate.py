@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict
+
+LLM_MAX_CONCURRENCY = int(os.environ.get("JARVIS_LLM_MAX_CONCURRENCY", "16"))
+LLM_QUEUE_TIMEOUT = float(os.environ.get("JARVIS_LLM_QUEUE_TIMEOUT", "10"))
+
+class LLMBusyError(Exception):
+    """Não houve vaga para chamar o Gemini dentro do tempo de espera."""
+
+    def __init__(self, retry_after: int = 1):
+        super().__init__("Limite de chamadas simultâneas ao Gemini atingido.")
+        self.retry_after = retry_after
+
+class LLMGate:
+    """Semáforo global para as chamadas ao Gemini, partilhado por threads e event loops.
+
+    Limita quantas chamadas estão em curso no processo; quem excede espera no
+    máximo `queue_timeout` segundos e depois recebe LLMBusyError.
+    """
+
+    def __init__(self, max_concurrent: int = LLM_MAX_CONCURRENCY, queue_timeout: float = LLM_QUEUE_TIMEOUT):
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._stats = {"acquired": 0, "timeouts": 0, "in_flight": 0, "waiting": 0, "peak_in_flight": 0, "wait_ms_total": 0.0}
+
+    def _track(self, key: str, delta: int):
+        with self._lock:
+            self._stats[key] += delta
+            if key == "in_flight":
+                self._stats["peak_in_flight"] = max(self._stats["peak_in_flight"], self._stats["in_flight"])
+
+    def _acquired(self, started: float):
+        with self._lock:
+            self._stats["acquired"] += 1
+            self._stats["wait_ms_total"] += (time.monotonic() - started) * 1000
+        self._track("in_flight", 1)
+
+    def _timed_out(self):
+        with self._lock:
+            self._stats["timeouts"] += 1
+        raise LLMBusyError(retry_after=max(1, round(self.queue_timeout / 2)))
+
+    def _release(self):
+        self._track("in_flight", -1)
+        self._semaphore.release()
+
+    @contextmanager
+    def slot(self):
+        """Vaga para uma chamada síncrona (bloqueia a thread enquanto espera)."""
+        started = time.monotonic()
+        self._track("waiting", 1)
+        try:
+            acquired = self._semaphore.acquire(timeout=self.queue_timeout)
+        finally:
+            self._track("waiting", -1)
+        if not acquired:
+            self._timed_out()
+        self._acquired(started)
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def aslot(self):
+        """Vaga para uma chamada assíncrona; espera sem bloquear o event loop."""
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        delay = 0.005
+        self._track("waiting", 1)
+        try:
+            while not self._semaphore.acquire(blocking=False):
+                if time.monotonic() >= deadline:
+                    self._timed_out()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.05)
+        finally:
+            self._track("waiting", -1)
+        self._acquired(started)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["avg_wait_ms"] = round(stats.pop("wait_ms_total") / stats["acquired"], 1) if stats["acquired"] else 0.0
+        stats["max_concurrent"] = self.max_concurrent
+        stats["queue_timeout"] = self.queue_timeout
+        return stats
+
+
+llm_gate = LLMGate()
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+import bisect
+import contextvars
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# Limites dos buckets em segundos: de 0,1 ms (SQLite, cache) a 60 s (Gemini com várias ferramentas).
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Fases acumuladas no pedido atual (ver request_breakdown); None fora de um pedido.
+_breakdown: contextvars.ContextVar = contextvars.ContextVar("jarvis_breakdown", default=None)
+_breakdown_lock = threading.Lock()  # o mesmo pedido pode medir fases em várias threads (buscas G-Click em paralelo)
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Counter:
+    """Contador monotónico por combinação de labels."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in sorted(values.items())]
+
+    def summary(self) -> Dict:
+        with self._lock:
+            return {",".join(str(v) for _, v in key) or "total": value for key, value in sorted(self._values.items())}
+
+class Histogram:
+    """Histograma cumulativo (estilo Prometheus) por combinação de labels.
+
+    `breakdown` indica sob que nome cada observação entra no detalhe do pedido
+    atual, p.ex. "{phase}" ou "sqlite"; None para não entrar.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS, breakdown: Optional[str] = None):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.breakdown = breakdown
+        self._lock = threading.Lock()
+        self._series: Dict[tuple, list] = {}  # labels -> [contagens por bucket (+Inf no fim), soma, total]
+
+    def observe(self, seconds: float, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+        breakdown = _breakdown.get()
+        if breakdown is not None and self.breakdown:
+            phase = self.breakdown.format(**labels)
+            with _breakdown_lock:
+                breakdown[phase] = breakdown.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        lines = []
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(round(total, 6))}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+    def _quantile(self, counts: list, count: int, q: float) -> float:
+        """Estimativa por interpolação linear dentro do bucket, como o histogram_quantile do Prometheus."""
+        rank = q * count
+        cumulative = 0
+        for i, bucket_count in enumerate(counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i >= len(self.buckets):
+                    return self.buckets[-1]
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+    def summary(self) -> Dict:
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        return {
+            ",".join(str(v) for _, v in key) or "total": {
+                "count": count,
+                "avg_ms": round(total / count * 1000, 1),
+                "p50_ms": round(self._quantile(counts, count, 0.5) * 1000, 1),
+                "p95_ms": round(self._quantile(counts, count, 0.95) * 1000, 1),
+            }
+            for key, (counts, total, count) in sorted(series.items()) if count
+        }
+
+class MetricsRegistry:
+    """Métricas do processo, exportadas em texto Prometheus e resumidas para o painel de admin."""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._register(Counter(name, help_text))
+
+    def histogram(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS, breakdown: Optional[str] = None) -> Histogram:
+        return self._register(Histogram(name, help_text, buckets, breakdown))
+
+    def render(self, gauges: Optional[Dict[str, tuple]] = None) -> str:
+        """Texto no formato de exposição do Prometheus; `gauges` = {nome: (ajuda, valor)} lidos na hora."""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            samples = metric.samples()
+            if not samples:
+                continue
+            lines += [f"# HELP {metric.name} {metric.help}", f"# TYPE {metric.name} {metric.kind}", *samples]
+        for name, (help_text, value) in (gauges or {}).items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {_format_value(value)}"]
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> Dict:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        summaries = {metric.name: metric.summary() for metric in metrics}
+        return {name: summary for name, summary in summaries.items() if summary}
+
+    @contextmanager
+    def request_breakdown(self):
+        """Acumula, durante o bloco, o tempo de cada fase do pedido atual (em segundos)."""
+        breakdown: Dict[str, float] = {}
+        token = _breakdown.set(breakdown)
+        try:
+            yield breakdown
+        finally:
+            _breakdown.reset(token)
+
+
+def server_timing(breakdown: Dict[str, float]) -> str:
+    """Cabeçalho Server-Timing com o detalhe do pedido (visível no separador Rede do browser)."""
+    return ", ".join(f"{re.sub(r'[^A-Za-z0-9_-]', '_', phase)};dur={seconds * 1000:.1f}" for phase, seconds in breakdown.items())
+
+def endpoint_label(endpoint: str) -> str:
+    """Caminho sem query string e com identificadores trocados por {id}, para manter poucas séries."""
+    path = endpoint.split("?", 1)[0]
+    return "/".join("{id}" if re.search(r"\d", segment) or len(segment) > 40 else segment for segment in path.split("/"))
+
+
+metrics = MetricsRegistry()
+
+PHASE_SECONDS = metrics.histogram("jarvis_phase_seconds", "Duração de cada fase de um turno do JarvisBrain.", breakdown="{phase}")
+TOOL_SECONDS = metrics.histogram("jarvis_tool_seconds", "Duração de cada ferramenta chamada pelo Gemini.", breakdown="tools")
+TOOL_CALLS = metrics.counter("jarvis_tool_calls_total", "Chamadas às ferramentas do Gemini, por resultado.")
+HTTP_SECONDS = metrics.histogram("jarvis_http_request_seconds", "Pedidos HTTP a serviços externos (G-Click, Microsoft Graph).", breakdown="{service}")
+HTTP_REQUESTS = metrics.counter("jarvis_http_requests_total", "Pedidos HTTP a serviços externos, por resultado.")
+SQLITE_SECONDS = metrics.histogram("jarvis_sqlite_seconds", "Tempo com uma conexão SQLite do pool emprestada.", breakdown="sqlite")
+ROUTE_SECONDS = metrics.histogram("jarvis_route_seconds", "Duração dos pedidos servidos pelo Flask, por rota.")
@@ -2,9 +2,12 @@
 import os
 import requests
 import json
+import time
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 
+from metrics import HTTP_REQUESTS, HTTP_SECONDS, endpoint_label
+
 class MicrosoftGraphClient:
     """Cliente para interagir com a Microsoft Graph API"""
     
@@ -19,6 +22,8 @@ class MicrosoftGraphClient:
     def _make_request(self, method: str, endpoint: str, data: Optional[Dict] = None) -> Dict:
         """Faz uma requisição para a Microsoft Graph API"""
         url = f"{self.base_url}{endpoint}"
+        started = time.perf_counter()
+        outcome = "error"
         
         try:
             if method.upper() == "GET":
@@ -33,11 +38,15 @@ class MicrosoftGraphClient:
                 raise ValueError(f"Método HTTP não suportado: {method}")
             
             response.raise_for_status()
+            outcome = "ok"
             return response.json() if response.content else {}
             
         except requests.exceptions.RequestException as e:
             print(f"Erro na requisição para Microsoft Graph: {e}")
             return {"error": str(e)}
+        finally:
+            HTTP_SECONDS.observe(time.perf_counter() - started, service="graph", endpoint=endpoint_label(endpoint))
+            HTTP_REQUESTS.inc(service="graph", outcome=outcome)
     
     # === FUNCIONALIDADES DE E-MAIL ===
     
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+import atexit
+import json
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+import db
+import feedback_embeddings
+import feedback_rollups
+
+MAX_QUEUE = 10000
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 0.5  # segundos máximos que uma escrita espera na fila
+FEEDBACK_SQL = 'INSERT INTO feedback (user_id, user_query, bot_response, rating, correction, embedding) VALUES (?, ?, ?, ?, ?, ?)'
+
+def ensure_schema(conn: sqlite3.Connection):
+    """Acrescenta ao conversation_history as colunas de ferramentas e latência e cria a tabela de traces."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(conversation_history)")}
+    if "tool_calls" not in columns:
+        conn.execute("ALTER TABLE conversation_history ADD COLUMN tool_calls TEXT")
+    if "latency_ms" not in columns:
+        conn.execute("ALTER TABLE conversation_history ADD COLUMN latency_ms REAL")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS turn_traces (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER,
+            session_id TEXT,
+            started_at REAL NOT NULL,
+            total_ms REAL,
+            tool_count INTEGER NOT NULL,
+            answer_chars INTEGER,
+            path TEXT,
+            trace TEXT NOT NULL
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_turn_traces_started ON turn_traces (started_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_turn_traces_total_ms ON turn_traces (total_ms)")
+
+class WriteBehindWriter:
+    """Fila de escrita em segundo plano para o SQLite.
+
+    As rotas apenas enfileiram os INSERTs; uma thread dedicada agrupa-os em
+    lotes e faz um único commit por lote. A fila é limitada: quando está cheia,
+    `submit()` devolve False em vez de bloquear o pedido.
+    """
+
+    def __init__(self, db_path: str = "jarvis.db", max_queue: int = MAX_QUEUE, batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stopping = False
+        self._stats = {"enqueued": 0, "written": 0, "batches": 0, "dropped": 0, "errors": 0}
+
+    def start(self):
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="jarvis-db-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def submit(self, sql: str, params: tuple) -> bool:
+        """Enfileira um comando; nunca bloqueia o chamador."""
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+        try:
+            self._queue.put_nowait((sql, params))
+        except queue.Full:
+            self._stats["dropped"] += 1
+            return False
+        self._stats["enqueued"] += 1
+        return True
+
+    # --- Registos de domínio ---
+
+    def record_turn(self, user_id, session_id: str, user_message: str, answer: str, tool_calls: List[str], latency_ms: float) -> bool:
+        sql = 'INSERT INTO conversation_history (user_id, session_id, role, content, tool_calls, latency_ms) VALUES (?, ?, ?, ?, ?, ?)'
+        accepted = self.submit(sql, (user_id, session_id, 'user', user_message, None, None))
+        return self.submit(sql, (user_id, session_id, 'model', answer, json.dumps(tool_calls) if tool_calls else None, round(latency_ms, 1))) and accepted
+
+    def record_feedback(self, user_id, user_query: str, bot_response: str, rating: int, correction: Optional[str]) -> bool:
+        # Só as correções entram na busca por semelhança (feedback_embeddings).
+        embedding = feedback_embeddings.embed_blob(user_query) if rating == -1 and correction else None
+        return self.submit(FEEDBACK_SQL, (user_id, user_query, bot_response, rating, correction, embedding))
+
+    def record_trace(self, trace: Dict) -> bool:
+        return self.submit(
+            'INSERT OR REPLACE INTO turn_traces (id, user_id, session_id, started_at, total_ms, tool_count, answer_chars, path, trace) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (trace["id"], trace["user_id"], trace["session_id"], trace["started_at"], trace["total_ms"], len(trace["calls"]),
+             trace["answer_chars"], trace["path"], json.dumps(trace, ensure_ascii=False, default=str))
+        )
+
+    # --- Thread de escrita ---
+
+    def _run(self):
+        conn = db.open_connection(self.db_path)
+        try:
+            ensure_schema(conn)
+            feedback_rollups.ensure_schema(conn)
+            conn.commit()
+        except Exception as e:
+            print(f"ERRO ao preparar tabelas do escritor em segundo plano: {e}")
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._write(conn, batch)
+            elif self._stopping:
+                break
+        conn.close()
+
+    def _next_batch(self) -> List:
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=max(remaining, 0)) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, conn: sqlite3.Connection, batch: List):
+        try:
+            try:
+                self._commit(conn, batch)
+                self._stats["batches"] += 1
+            except Exception as e:
+                # Um registo inválido não pode levar consigo o resto do lote: grava um a um.
+                print(f"ERRO ao gravar lote de {len(batch)} registos, a gravar um a um: {e}")
+                for item in batch:
+                    try:
+                        self._commit(conn, [item])
+                    except Exception as e:
+                        self._stats["errors"] += 1
+                        print(f"ERRO ao gravar registo: {e}")
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def _commit(self, conn: sqlite3.Connection, rows: List):
+        with conn:
+            for sql, params in rows:
+                conn.execute(sql, params)
+            if any(sql is FEEDBACK_SQL for sql, _ in rows):
+                # Agregados do feedback atualizados no mesmo commit que as linhas novas.
+                feedback_rollups.catch_up(conn)
+        self._stats["written"] += len(rows)
+
+    def flush(self):
+        """Bloqueia até que tudo o que já foi enfileirado esteja gravado."""
+        if self._thread and self._thread.is_alive():
+            self._queue.join()
+
+    def stop(self, timeout: float = 10):
+        """Esvazia a fila e encerra a thread (chamado no encerramento do processo)."""
+        if not self._thread or not self._thread.is_alive():
+            return
+        self._stopping = True
+        self._thread.join(timeout)
+
+    def stats(self) -> Dict:
+        return dict(self._stats, queue_depth=self._queue.qsize(), queue_max=self._queue.maxsize)
+
+
+writer = WriteBehindWriter()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import threading
+from collections import defaultdict
+from typing import Dict, List
+
+from text_utils import normalize_text
+
+MIN_PREFIX = 2
+FUZZY_THRESHOLD = 0.45
+MAX_CACHED_VERSIONS = 4
+
+def _normalize(text: str) -> str:
+    return normalize_text(text).strip()
+
+def _trigrams(token: str) -> set:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class RamalIndex:
+    """Índice invertido de nomes e apelidos dos colaboradores para busca de ramais.
+
+    Construído uma vez por versão da base de conhecimento. Cada consulta faz
+    apenas buscas em dicionários (exato, prefixo e trigramas), sem percorrer
+    todos os departamentos.
+    """
+
+    def __init__(self, departments: Dict):
+        self.entries: List[Dict] = []
+        self._exact = defaultdict(set)     # nome completo, palavras e apelidos
+        self._prefix = defaultdict(set)    # prefixos das palavras do nome
+        self._trigrams = defaultdict(set)  # trigrama -> palavras indexadas
+        self._token_entries = defaultdict(set)
+        self._token_grams: Dict[str, set] = {}
+
+        for dept_name, teams in (departments or {}).items():
+            for team in teams:
+                for member in team.get("equipe", []):
+                    entry_id = len(self.entries)
+                    self.entries.append({"nome": member.get("nome"), "depto": dept_name.title(), "ramal": team.get("ramal", "N/A")})
+                    full_name = _normalize(member.get("nome", ""))
+                    keys = {full_name, *full_name.split()}
+                    keys.update(_normalize(apelido) for apelido in member.get("apelidos", []))
+                    for key in filter(None, keys):
+                        self._exact[key].add(entry_id)
+                        for token in key.split():
+                            self._token_entries[token].add(entry_id)
+                            if token not in self._token_grams:
+                                self._token_grams[token] = _trigrams(token)
+                                for gram in self._token_grams[token]:
+                                    self._trigrams[gram].add(token)
+                    for token in full_name.split():
+                        for size in range(MIN_PREFIX, len(token)):
+                            self._prefix[token[:size]].add(entry_id)
+
+    def _fuzzy(self, token: str) -> Dict[int, float]:
+        """Coeficiente de Dice entre trigramas, tolerante a erros de digitação."""
+        grams = _trigrams(token)
+        shared = defaultdict(int)
+        for gram in grams:
+            for candidate in self._trigrams.get(gram, ()):
+                shared[candidate] += 1
+        scores: Dict[int, float] = {}
+        for candidate, count in shared.items():
+            score = 2 * count / (len(grams) + len(self._token_grams[candidate]))
+            if score >= FUZZY_THRESHOLD:
+                for entry_id in self._token_entries[candidate]:
+                    scores[entry_id] = max(scores.get(entry_id, 0), score)
+        return scores
+
+    def _score_token(self, token: str) -> Dict[int, float]:
+        scores = {entry_id: 3.0 for entry_id in self._exact.get(token, ())}
+        for entry_id in self._prefix.get(token, ()):
+            scores.setdefault(entry_id, 2.0)
+        if not scores:
+            scores = self._fuzzy(token)
+        return scores
+
+    def search(self, nome: str) -> List[Dict]:
+        """Devolve os colaboradores que correspondem ao nome, do mais ao menos relevante."""
+        query = _normalize(nome)
+        if not query:
+            return []
+        scores = None
+        for token in query.split():
+            token_scores = self._score_token(token)
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {e: scores[e] + s for e, s in token_scores.items() if e in scores}
+            if not scores:
+                return []
+        for entry_id in self._exact.get(query, ()):
+            scores[entry_id] = scores.get(entry_id, 0) + 1.0
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self.entries[item[0]]["nome"]))
+        return [dict(self.entries[entry_id]) for entry_id, _ in ranked]
+
+
+_indexes: Dict[str, RamalIndex] = {}
+_indexes_lock = threading.Lock()
+
+def get_ramal_index(departments: Dict, version: str) -> RamalIndex:
+    """Índice partilhado para uma versão da base de conhecimento."""
+    index = _indexes.get(version)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(version)
+            if index is None:
+                index = RamalIndex(departments)
+                if len(_indexes) >= MAX_CACHED_VERSIONS:
+                    _indexes.pop(next(iter(_indexes)))
+                _indexes[version] = index
+    return index
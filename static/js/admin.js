@@ -42,8 +42,44 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     };
 
+    // Carrega as métricas de desempenho
+    const statsView = document.getElementById('stats-view');
+    const loadStats = async () => {
+        if (!statsView) return;
+        try {
+            const response = await fetch('/api/admin/stats');
+            if (!response.ok) throw new Error('Falha ao buscar métricas');
+            const data = await response.json();
+            statsView.textContent = JSON.stringify(data, null, 4);
+        } catch (error) {
+            console.error('Erro ao carregar métricas:', error);
+            showNotification('Erro ao carregar métricas de desempenho.', 'error');
+        }
+    };
+    const refreshStatsBtn = document.getElementById('refresh-stats-btn');
+    if (refreshStatsBtn) refreshStatsBtn.addEventListener('click', loadStats);
+
+    // Carrega os traces dos turnos (mais lentos, com mais ferramentas ou mais recentes)
+    const tracesView = document.getElementById('traces-view');
+    const tracesOrder = document.getElementById('traces-order');
+    const loadTraces = async () => {
+        if (!tracesView) return;
+        try {
+            const response = await fetch(`/api/admin/traces?order=${tracesOrder.value}&limit=20`);
+            if (!response.ok) throw new Error('Falha ao buscar traces');
+            const data = await response.json();
+            tracesView.textContent = JSON.stringify(data.traces, null, 4);
+        } catch (error) {
+            console.error('Erro ao carregar traces:', error);
+            showNotification('Erro ao carregar os traces dos turnos.', 'error');
+        }
+    };
+    const refreshTracesBtn = document.getElementById('refresh-traces-btn');
+    if (refreshTracesBtn) refreshTracesBtn.addEventListener('click', loadTraces);
+    if (tracesOrder) tracesOrder.addEventListener('change', loadTraces);
+
     // Adiciona o evento de clique para os botões de salvar
-    document.querySelectorAll('.save-btn').forEach(button => {
+    document.querySelectorAll('.save-btn[data-key]').forEach(button => {
         button.addEventListener('click', async () => {
             const key = button.dataset.key;
             const editor = editors[key];
@@ -77,4 +113,6 @@ document.addEventListener('DOMContentLoaded', () => {
     });
 
     loadKnowledge();
+    loadStats();
+    loadTraces();
 });
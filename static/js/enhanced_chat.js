@@ -124,21 +124,53 @@ class EnhancedJarvisChat {
             });
             
             if (!response.ok) {
+                // 429/503: o servidor explica o motivo (turno anterior em curso, sobrecarga).
+                const data = await response.json().catch(() => null);
+                if (data && data.text) {
+                    textElement.textContent = data.text;
+                    return;
+                }
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
             
             const reader = response.body.getReader();
             const decoder = new TextDecoder();
             let fullResponse = '';
-            
+            let buffer = '';
+
             while (true) {
                 const { done, value } = await reader.read();
                 if (done) break;
-                
-                const chunk = decoder.decode(value, { stream: true });
-                fullResponse += chunk;
-                textElement.textContent = fullResponse;
-                
+
+                // O servidor envia Server-Sent Events separados por linha em branco
+                buffer += decoder.decode(value, { stream: true });
+                const events = buffer.split('\n\n');
+                buffer = events.pop();
+
+                for (const rawEvent of events) {
+                    let eventType = 'message';
+                    let data = '';
+                    for (const line of rawEvent.split('\n')) {
+                        if (line.startsWith('event: ')) eventType = line.slice(7);
+                        else if (line.startsWith('data: ')) data += line.slice(6);
+                    }
+                    if (!data) continue;
+                    const payload = JSON.parse(data);
+
+                    if (eventType === 'progress') {
+                        if (!fullResponse) textElement.textContent = payload;
+                    } else if (eventType === 'done') {
+                        fullResponse = payload;
+                        textElement.innerHTML = fullResponse;
+                    } else if (eventType === 'error') {
+                        fullResponse = payload;
+                        textElement.textContent = payload;
+                    } else {
+                        fullResponse += payload;
+                        textElement.innerHTML = fullResponse;
+                    }
+                }
+
                 // Auto-scroll
                 this.scrollToBottom();
             }
@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+import re
+import unicodedata
+
+def normalize_text(text: str) -> str:
+    """Minúsculas e sem acentos: 'Comércio' -> 'comercio'."""
+    if not text: return ""
+    return "".join(
+        c for c in unicodedata.normalize("NFD", text)
+        if unicodedata.category(c) != "Mn"
+    ).lower()
+
+def normalize_words(text: str) -> str:
+    """normalize_text() sem pontuação e com os espaços colapsados: 'Qual é o ramal?' -> 'qual e o ramal'."""
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s]", " ", normalize_text(text))).strip()
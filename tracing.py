@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import db
+
+TRACE_BUFFER_SIZE = int(os.environ.get("JARVIS_TRACE_BUFFER", "500"))
+TRACE_SPILL = os.environ.get("JARVIS_TRACE_SPILL", "0") == "1"
+MAX_ARG_CHARS = 120
+MAX_MESSAGE_CHARS = 200
+
+# Trace do turno em curso; None fora de um turno (p.ex. na sincronização do diretório).
+_current: contextvars.ContextVar = contextvars.ContextVar("jarvis_trace", default=None)
+
+ORDERS = {
+    "slowest": ("total_ms", lambda trace: trace["total_ms"] or 0),
+    "tools": ("tool_count", lambda trace: (len(trace["calls"]), trace["total_ms"] or 0)),
+    "recent": ("started_at", lambda trace: trace["started_at"]),
+}
+
+def _short(value, limit: int = MAX_ARG_CHARS):
+    if isinstance(value, str) and len(value) > limit:
+        return value[:limit] + "…"
+    return value
+
+def _result_size(result) -> int:
+    try:
+        return len(json.dumps(result, ensure_ascii=False, default=str))
+    except Exception:
+        return len(str(result))
+
+def record_tool_call(name: str, args: Dict, result, elapsed: float, outcome: str):
+    """Acrescenta uma chamada de ferramenta ao turno em curso (se houver um)."""
+    trace = _current.get()
+    if trace is None or "_started" not in trace:
+        return
+    trace["calls"].append({
+        "tool": name,
+        "args": {key: _short(value) for key, value in args.items()},
+        "result_bytes": _result_size(result),
+        "ms": round(elapsed * 1000, 1),
+        "outcome": outcome,
+        "offset_ms": round((time.perf_counter() - trace["_started"]) * 1000, 1),
+    })
+
+def record_retry(service: str, reason: str):
+    """Regista uma nova tentativa (reautenticação, retry HTTP, espera por vaga) no turno em curso."""
+    trace = _current.get()
+    if trace is not None:
+        trace["retries"].append({"service": service, "reason": reason})
+
+def annotate(**fields):
+    """Marca o caminho do turno em curso (fast_path, answer_cache, gemini…)."""
+    trace = _current.get()
+    if trace is not None:
+        trace.update(fields)
+
+class TraceBuffer:
+    """Últimos turnos (mensagem, cadeia de ferramentas, retries, tamanho da resposta) num buffer circular.
+
+    Com JARVIS_TRACE_SPILL=1 cada trace é também gravado na tabela turn_traces
+    pelo escritor em segundo plano, para análise além do que cabe em memória.
+    """
+
+    def __init__(self, size: int = TRACE_BUFFER_SIZE, spill: bool = TRACE_SPILL, db_path: str = "jarvis.db"):
+        self.spill = spill
+        self.db_path = db_path
+        self._traces: deque = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._stats = {"recorded": 0, "spilled": 0, "spill_dropped": 0}
+
+    @contextmanager
+    def turn(self, user_id, message: str):
+        """Abre o trace de um turno; o chamador fecha-o com finish(trace, resposta).
+
+        Se o bloco terminar sem finish() (exceção, cliente que desistiu do
+        streaming), o trace é fechado na mesma, com o erro anotado.
+        """
+        trace = {
+            "id": uuid.uuid4().hex[:12],
+            "user_id": user_id,
+            "session_id": None,
+            "started_at": time.time(),
+            "message": _short(message or "", MAX_MESSAGE_CHARS),
+            "path": None,
+            "calls": [],
+            "retries": [],
+            "answer_chars": None,
+            "total_ms": None,
+            "_started": time.perf_counter(),
+        }
+        token = _current.set(trace)
+        error = "turno interrompido"
+        try:
+            yield trace
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            try:
+                _current.reset(token)
+            except ValueError:
+                _current.set(None)  # Gerador fechado noutro contexto (streaming).
+            if trace["total_ms"] is None:
+                self.finish(trace, None, error=error)
+
+    def finish(self, trace: Dict, answer: Optional[str], error: Optional[str] = None):
+        trace["total_ms"] = round((time.perf_counter() - trace.pop("_started")) * 1000, 1)
+        trace["answer_chars"] = len(answer) if answer is not None else None
+        trace["tool_ms"] = round(sum(call["ms"] for call in trace["calls"]), 1)
+        if error:
+            trace["error"] = error
+        with self._lock:
+            self._traces.append(trace)
+            self._stats["recorded"] += 1
+        if self.spill:
+            from persistence import writer
+            key = "spilled" if writer.record_trace(trace) else "spill_dropped"
+            with self._lock:
+                self._stats[key] += 1
+
+    def top(self, order: str = "slowest", limit: int = 20) -> List[Dict]:
+        _, sort_key = ORDERS[order]
+        with self._lock:
+            traces = list(self._traces)
+        return sorted(traces, key=sort_key, reverse=True)[:limit]
+
+    def top_from_db(self, order: str = "slowest", limit: int = 20, since_hours: float = 24) -> List[Dict]:
+        """Mesma consulta sobre os traces gravados (requer JARVIS_TRACE_SPILL=1)."""
+        column, _ = ORDERS[order]
+        try:
+            with db.connection(self.db_path) as conn:
+                rows = conn.execute(
+                    f"SELECT trace FROM turn_traces WHERE started_at >= ? ORDER BY {column} DESC LIMIT ?",
+                    (time.time() - since_hours * 3600, limit)
+                ).fetchall()
+        except sqlite3.OperationalError as e:
+            print(f"ERRO ao ler traces gravados: {e}")
+            return []
+        return [json.loads(row["trace"]) for row in rows]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats, buffered=len(self._traces), capacity=self._traces.maxlen, spill=self.spill)
+
+
+traces = TraceBuffer()